@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
-from flask import Flask
+import time
+from flask import Flask, Response, g, request
 
 # Blueprints
 from routes.aparelhos import aparelhos_bp
@@ -9,6 +10,9 @@ from routes.recargas import recargas_bp
 from routes.relacionamentos import relacionamentos_bp
 from routes.movimentacao import mov_bp
 from routes.dashboard import bp_dashboard
+from utils.bigquery_client import get_bq
+from utils.query_metrics import current_route, get_query_metrics
+from utils.rollups import get_rollups
 
 
 # ================================
@@ -39,6 +43,56 @@ def create_app() -> Flask:
     def health():
         return {"ok": True}, 200
 
+    # ================================
+    # MÉTRICAS (PROMETHEUS)
+    # ================================
+    metrics = get_query_metrics()
+
+    @app.before_request
+    def metrics_inicio():
+        g.metrics_started = time.perf_counter()
+        g.metrics_route = request.url_rule.rule if request.url_rule else "nao_encontrada"
+        g.metrics_token = current_route.set(g.metrics_route)
+
+    @app.after_request
+    def metrics_fim(response):
+        if request.endpoint != "static" and "metrics_started" in g:
+            metrics.record_request(g.metrics_route, request.method, response.status_code, time.perf_counter() - g.metrics_started)
+        return response
+
+    @app.teardown_request
+    def metrics_contexto(_exc):
+        if "metrics_token" in g:
+            current_route.reset(g.metrics_token)
+
+    @app.get("/admin/metrics")
+    def admin_metrics():
+        bq = get_bq()
+        cache, guard, rollups = bq.cache.stats(), bq.guard.stats(), get_rollups().stats()
+        extra = {
+            "painel_bq_result_cache_hits_total": ("counter", "Acertos do cache de resultados.", cache["hits"]),
+            "painel_bq_result_cache_misses_total": ("counter", "Faltas do cache de resultados.", cache["misses"]),
+            "painel_bq_result_cache_bytes": ("gauge", "Bytes estimados no cache de resultados.", cache["bytes"]),
+            "painel_bq_result_cache_entries": ("gauge", "Entradas no cache de resultados.", cache["entries"]),
+            "painel_bq_guard_dry_runs_total": ("counter", "Dry runs de estimativa da guarda de custo.", guard["dry_runs"]),
+            "painel_bq_guard_rejected_total": ("counter", "Consultas recusadas por orçamento de bytes.", guard["rejeitadas"]),
+            "painel_bq_guard_downgraded_total": ("counter", "Consultas trocadas pelo fallback por orçamento de bytes.", guard["rebaixadas"]),
+            "painel_rollup_refreshes_total": ("counter", "Refreshes dos agregados do dashboard.", rollups["refreshes"]),
+            "painel_rollup_refresh_failures_total": ("counter", "Refreshes dos agregados que falharam.", rollups["falhas"]),
+        }
+        return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+    # ================================
+    # AGREGADOS DO DASHBOARD (REFRESH SOB DEMANDA / CLOUD SCHEDULER)
+    # ================================
+    @app.post("/admin/rollups/refresh")
+    def admin_rollups_refresh():
+        try:
+            return {"ok": True, "tempo_ms": get_rollups().refresh()}, 200
+        except Exception as e:
+            print("🚨 Erro no refresh dos agregados:", e)
+            return {"ok": False, "error": str(e)}, 500
+
     # ================================ 
     # BLUEPRINTS
     # ================================
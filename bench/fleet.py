@@ -0,0 +1,94 @@
+# bench/fleet.py
+# -*- coding: utf-8 -*-
+
+# ============================================================
+# FROTA SINTÉTICA PARA O MOTOR LOCAL
+# ============================================================
+# Gera aparelhos, chips, vínculos e eventos direto no DuckDB (SQL com
+# range()), então 100k chips sobem em segundos. Proporções aproximam a
+# operação: ~1 aparelho para cada 8 chips, metade dos chips vinculada,
+# 5 eventos por chip.
+
+APARELHOS_POR_CHIP = 8
+EVENTOS_POR_CHIP = 5
+
+
+def seed_fleet(engine, chips, seed=42):
+    """Recria as tabelas do marts no engine com `chips` chips sintéticos."""
+    aparelhos = max(chips // APARELHOS_POR_CHIP, 1)
+    cur = engine.cursor()
+    try:
+        cur.execute(f"SELECT setseed({(seed % 100) / 100})")
+        for table in ("f_chip_evento", "f_chip_aparelho", "dim_chip", "dim_aparelho"):
+            cur.execute(f"DELETE FROM {table}")
+
+        cur.execute("""
+            INSERT INTO dim_aparelho
+            SELECT
+                i AS sk_aparelho,
+                'AP-' || lpad(CAST(i AS VARCHAR), 6, '0') AS id_aparelho,
+                ['Samsung', 'Motorola', 'Xiaomi', 'LG'][1 + i % 4] AS marca,
+                'Modelo ' || (i % 12) AS modelo,
+                CAST(350000000000000 + i AS VARCHAR) AS imei,
+                IF(i % 20 = 0, 'MANUTENCAO', 'ATIVO') AS status,
+                2 AS cap_whats_business,
+                2 AS cap_whats_normal,
+                TRUE AS ativo,
+                current_timestamp - INTERVAL (i % 400) DAY AS created_at,
+                current_timestamp - INTERVAL (i % 40) DAY AS updated_at
+            FROM range(1, ? + 1) t(i)
+        """, [aparelhos])
+
+        # metade dos chips ocupa os slots 1..4 dos aparelhos, em ordem
+        cur.execute("""
+            INSERT INTO dim_chip
+            SELECT
+                i AS sk_chip,
+                'CHIP-' || lpad(CAST(i AS VARCHAR), 7, '0') AS id_chip,
+                numero,
+                numero AS numero_limpo,
+                ['VIVO', 'TIM', 'CLARO', 'OI'][1 + i % 4] AS operadora,
+                ['PRE', 'CONTROLE', 'POS'][1 + i % 3] AS plano,
+                ['ATIVO', 'DISPARANDO', 'MATURANDO', 'DISPONIVEL', 'BANIDO', 'RESTRINGIDO'][1 + i % 6] AS status,
+                'Operador ' || (i % 25) AS operador,
+                '' AS observacao,
+                'Seed' AS origem,
+                IF(vinculado, IF((i - 1) % 4 < 2, 'BUSINESS', 'NORMAL'), NULL) AS tipo_whatsapp,
+                IF(vinculado, (i - 1) % 4 + 1, NULL) AS slot_whatsapp,
+                IF(vinculado, (i - 1) // 4 + 1, NULL) AS sk_aparelho_atual,
+                IF(i % 5 = 0, NULL, 20 + (i % 5) * 10) AS ultima_recarga_valor,
+                IF(i % 5 = 0, NULL, current_date - CAST(i % 60 AS INTEGER)) AS ultima_recarga_data,
+                (i % 17) * 15.0 AS total_gasto,
+                i % 300 AS qt_disparos,
+                IF(i % 6 = 4, 1 + i % 3, 0) AS qt_banimentos,
+                IF(i % 6 = 4, current_date - CAST(i % 90 AS INTEGER), NULL) AS dt_banimentos,
+                current_date - CAST(i % 30 AS INTEGER) AS data_status,
+                current_date - CAST(i % 200 AS INTEGER) AS dt_inicio,
+                IF(i % 6 = 2, current_timestamp - INTERVAL (i % 14) DAY, NULL) AS maturando_em,
+                i % 50 != 0 AS ativo,
+                current_timestamp - INTERVAL (i % 365) DAY AS created_at,
+                current_timestamp - INTERVAL (i % 3600) MINUTE AS updated_at
+            FROM (
+                SELECT i, '11' || CAST(900000000 + i AS VARCHAR) AS numero, (i - 1) // 4 + 1 <= ? AND i % 2 = 1 AS vinculado
+                FROM range(1, ? + 1) t(i)
+            )
+        """, [aparelhos, chips])
+
+        cur.execute("""
+            INSERT INTO f_chip_aparelho
+            SELECT sk_chip, sk_aparelho_atual, slot_whatsapp, 'Seed', 'Vínculo inicial', created_at, NULL
+            FROM dim_chip WHERE sk_aparelho_atual IS NOT NULL
+        """)
+        cur.execute("""
+            INSERT INTO f_chip_evento
+            SELECT
+                c.sk_chip,
+                ['CADASTRO', 'RECARGA', 'EDICAO', 'VINCULO_APARELHO', 'STATUS'][1 + e % 5],
+                IF(e % 3 = 0, 'Seed', 'Painel'),
+                'Evento sintético ' || e,
+                c.created_at + INTERVAL (e) DAY
+            FROM dim_chip c, range(?) t(e)
+        """, [EVENTOS_POR_CHIP])
+    finally:
+        cur.close()
+    return {"chips": chips, "aparelhos": aparelhos, "eventos": chips * EVENTOS_POR_CHIP}
@@ -0,0 +1,260 @@
+# bench/run_routes.py
+# -*- coding: utf-8 -*-
+
+# ============================================================
+# BENCHMARK DAS ROTAS (MOTOR LOCAL, SEM BIGQUERY)
+# ============================================================
+# Sobe o app com BQ_BACKEND=local, semeia uma frota sintética e chama cada
+# rota dos blueprints pelo test client do Flask, reportando p50/p99 de
+# latência e pico de memória por rota. Cada tamanho de frota roda num
+# processo próprio (memória e índices residentes não vazam entre tamanhos).
+#
+#   python -m bench.run_routes --sizes 1000,10000,100000
+#   python -m bench.run_routes --sizes 1000 --routes /chips,/dashboard --json resultado.json
+#
+# O cache de resultados do BigQueryClient fica desligado (mede o caminho
+# de consulta); --cache liga. Os índices residentes (slots, números, busca)
+# fazem parte do app e ficam ligados, aquecidos pelas chamadas de warmup.
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import resource
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class RouteTimeout(BaseException):
+    """Rota passou do tempo limite (BaseException: os try/except das rotas não engolem)."""
+
+
+# ============================================================
+# CENÁRIOS — UM POR REGRA DO url_map
+# ============================================================
+def build_scenarios(frota):
+    """{regra: (método, fábrica de kwargs do test client)} para a frota semeada.
+
+    As fábricas geram um request por chamada: números novos a cada
+    cadastro, chips e aparelhos rodando pela frota para os vínculos.
+    """
+    chips, aparelhos = frota["chips"], frota["aparelhos"]
+    seq = itertools.count(1)
+    pares = itertools.cycle(range(2, chips + 1, 2))    # chips pares nascem sem aparelho
+    impares = itertools.cycle(range(1, chips + 1, 2))  # ímpares nascem vinculados
+    aps = itertools.cycle(range(1, aparelhos + 1))
+    sks = itertools.cycle(range(1, chips + 1))
+
+    def numero():
+        return f"31{800000000 + next(seq)}"
+
+    def planilha(linhas=50):
+        corpo = "numero;operadora\n" + "".join(f"{numero()};VIVO\n" for _ in range(linhas))
+        return {"data": {"arquivo": (io.BytesIO(corpo.encode()), "bench.csv")}, "content_type": "multipart/form-data"}
+
+    def get(path):
+        return ("GET", lambda: {"path": path})
+
+    def post(path):
+        return ("POST", lambda: {"path": path})
+
+    alvo = chips // 2
+    return {
+        "/": get("/"),
+        "/dashboard": get("/dashboard"),
+        "/dashboard/tabela": get("/dashboard/tabela"),
+        "/health": get("/health"),
+        "/admin/diagnostico": get("/admin/diagnostico"),
+        "/admin/schema/refresh": post("/admin/schema/refresh"),
+        "/admin/metrics": get("/admin/metrics"),
+        "/admin/rollups/refresh": post("/admin/rollups/refresh"),
+        "/aparelhos": get("/aparelhos"),
+        "/aparelhos/add": ("POST", lambda: {"path": "/aparelhos/add", "data": {"id_aparelho": f"AP-B{next(seq)}", "marca": "Bench", "modelo": "B1"}}),
+        "/chips": get("/chips"),
+        "/chips?q": ("GET", lambda: {"path": f"/chips?q={next(sks)}"}),
+        "/chips/sk/<int:sk_chip>": ("GET", lambda: {"path": f"/chips/sk/{next(sks)}"}),
+        "/chips/timeline/<int:sk_chip>": ("GET", lambda: {"path": f"/chips/timeline/{next(sks)}"}),
+        "/chips/add": ("POST", lambda: {"path": "/chips/add", "data": {"numero": numero(), "operadora": "VIVO", "status": "DISPONIVEL", "operador": "Bench"}}),
+        "/chips/update-json": ("POST", lambda: {"path": "/chips/update-json", "json": {"sk_chip": next(pares), "numero": numero(), "operadora": "TIM", "status": "ATIVO", "operador": "Bench"}}),
+        "/chips/recarga": ("POST", lambda: {"path": "/chips/recarga", "json": {"sk_chip": next(sks), "valor": 20}}),
+        "/chips/banir": ("POST", lambda: {"path": "/chips/banir", "json": {"sk_chip": next(sks)}}),
+        "/chips/bulk": ("POST", lambda: {"path": "/chips/bulk", "json": {"acao": "status", "status": "MATURANDO", "sk_chips": [next(sks) for _ in range(50)]}}),
+        "/chips/import": ("POST", lambda: {"path": "/chips/import", **planilha()}),
+        "/api/chips/listar": get("/api/chips/listar"),
+        # poll do delta sync: alterações do último minuto
+        "/api/chips/changes": ("GET", lambda: {"path": "/api/chips/changes", "query_string": {
+            "since": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - 60))}}),
+        "/api/recargas/listar": get("/api/recargas/listar"),
+        "/api/recargas/salvar": ("POST", lambda: {"path": "/api/recargas/salvar", "json": {"id_chip": next(sks), "valor": 15}}),
+        "/recargas": get("/recargas"),
+        "/movimentacao": get("/movimentacao"),
+        "/movimentacao/buscar": ("GET", lambda: {"path": f"/movimentacao/buscar?q={11900000000 + alvo}"}),
+        "/movimentacao/historico/<int:sk_chip>": ("GET", lambda: {"path": f"/movimentacao/historico/{next(sks)}"}),
+        "/relacionamentos": get("/relacionamentos"),
+        "/relacionamentos/proximo-slot": ("GET", lambda: {"path": f"/relacionamentos/proximo-slot?sk_aparelho={next(aps)}&tipo=NORMAL"}),
+        "/relacionamentos/vincular": ("POST", lambda: {"path": "/relacionamentos/vincular", "json": {"sk_chip": next(pares), "sk_aparelho": next(aps), "tipo": "BUSINESS"}}),
+        "/relacionamentos/desvincular": ("POST", lambda: {"path": "/relacionamentos/desvincular", "json": {"sk_chip": next(impares)}}),
+    }
+
+
+# ============================================================
+# MEDIÇÃO (PROCESSO FILHO: UM TAMANHO DE FROTA)
+# ============================================================
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _maxrss_mb():
+    # ru_maxrss vem em KiB no Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _alarme(_sig, _frame):
+    raise RouteTimeout()
+
+
+def _chamar(client, metodo, kwargs):
+    kwargs = dict(kwargs)
+    path = kwargs.pop("path")
+    with contextlib.redirect_stdout(io.StringIO()):
+        resposta = client.open(path, method=metodo, **kwargs)
+    return resposta.status_code
+
+
+def medir_rota(client, metodo, fabrica, iterations, warmup, timeout_sec):
+    """Latências (ms) de `iterations` chamadas, pico de memória Python de uma chamada e status vistos."""
+    status = set()
+    signal.signal(signal.SIGALRM, _alarme)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, timeout_sec)
+        for _ in range(warmup):
+            status.add(_chamar(client, metodo, fabrica()))
+        tempos = []
+        for _ in range(iterations):
+            kwargs = fabrica()
+            t0 = time.perf_counter()
+            status.add(_chamar(client, metodo, kwargs))
+            tempos.append((time.perf_counter() - t0) * 1000)
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+        # pico de alocação medido numa chamada extra: o tracemalloc deixa a rota mais lenta
+        kwargs = fabrica()
+        tracemalloc.start()
+        try:
+            status.add(_chamar(client, metodo, kwargs))
+            pico = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except RouteTimeout:
+        return {"erro": f"passou de {timeout_sec}s"}
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return {
+        "n": len(tempos),
+        "p50_ms": round(statistics.median(tempos), 2),
+        "p99_ms": round(_percentil(tempos, 99), 2),
+        "max_ms": round(max(tempos), 2),
+        "pico_py_kb": round(pico / 1024, 1),
+        "rss_mb": _maxrss_mb(),
+        "status": sorted(status),
+    }
+
+
+def rodar_tamanho(chips, iterations, warmup, timeout_sec, filtro=None):
+    """Semeia `chips` chips no motor local, importa o app e mede as rotas. Roda no processo filho."""
+    from bench.fleet import seed_fleet
+    from utils.local_engine import get_local_engine
+
+    t0 = time.perf_counter()
+    frota = seed_fleet(get_local_engine(), chips)
+    seed_ms = round((time.perf_counter() - t0) * 1000)
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import app
+        from utils.rollups import get_rollups
+
+        # agregados já prontos, como em produção (o refresh automático fica desligado no filho)
+        get_rollups().refresh()
+    client = app.test_client()
+
+    cenarios = build_scenarios(frota)
+    regras = {r.rule for r in app.url_map.iter_rules() if r.endpoint != "static"}
+    sem_cenario = sorted(regras - {nome.split("?")[0] for nome in cenarios})
+    rotas = {}
+    for nome, (metodo, fabrica) in cenarios.items():
+        if filtro and nome not in filtro:
+            continue
+        rotas[nome] = {"metodo": metodo, **medir_rota(client, metodo, fabrica, iterations, warmup, timeout_sec)}
+    return {"chips": chips, "frota": frota, "seed_ms": seed_ms, "rss_mb": _maxrss_mb(), "rotas": rotas, "sem_cenario": sem_cenario}
+
+
+# ============================================================
+# ORQUESTRAÇÃO E RELATÓRIO
+# ============================================================
+def _filho(args, chips):
+    env = dict(os.environ)
+    env.update({"BQ_BACKEND": "local", "BQ_REPLICA_ENABLED": "0", "ROLLUPS_ENABLED": "1", "ROLLUP_REFRESH_SEC": "0", "PYTHONPATH": str(ROOT)})
+    if not args.cache:
+        env["BQ_CACHE_MAX_MB"] = "0"
+    cmd = [sys.executable, "-m", "bench.run_routes", "--child", str(chips), "--iterations", str(args.iterations),
+           "--warmup", str(args.warmup), "--timeout-sec", str(args.timeout_sec)]
+    if args.routes:
+        cmd += ["--routes", args.routes]
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"frota de {chips} chips falhou:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def imprimir(resultado):
+    print(f"\n=== {resultado['chips']} chips / {resultado['frota']['aparelhos']} aparelhos "
+          f"(seed {resultado['seed_ms']} ms, RSS máx {resultado['rss_mb']} MB) ===")
+    print(f"{'rota':<42} {'mét':<4} {'n':>4} {'p50 ms':>9} {'p99 ms':>9} {'pico py KB':>11} {'RSS MB':>7}  status")
+    for nome, r in resultado["rotas"].items():
+        if "erro" in r:
+            print(f"{nome:<42} {r['metodo']:<4} {r['erro']}")
+            continue
+        print(f"{nome:<42} {r['metodo']:<4} {r['n']:>4} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['pico_py_kb']:>11.1f} {r['rss_mb']:>7.1f}  {','.join(map(str, r['status']))}")
+    if resultado["sem_cenario"]:
+        print("rotas sem cenário:", ", ".join(resultado["sem_cenario"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latência e memória por rota do painel sobre o motor local (DuckDB).")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="tamanhos de frota (chips), separados por vírgula")
+    parser.add_argument("--iterations", type=int, default=50, help="chamadas medidas por rota")
+    parser.add_argument("--warmup", type=int, default=3, help="chamadas descartadas por rota (carga dos índices residentes)")
+    parser.add_argument("--timeout-sec", type=float, default=60, help="tempo máximo por rota (warmup + medidas)")
+    parser.add_argument("--routes", default="", help="só estas rotas (regras do url_map, separadas por vírgula)")
+    parser.add_argument("--cache", action="store_true", help="liga o cache de resultados do BigQueryClient")
+    parser.add_argument("--json", dest="json_path", help="grava os resultados em JSON neste arquivo")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    filtro = {r.strip() for r in args.routes.split(",") if r.strip()} or None
+
+    if args.child:
+        resultado = rodar_tamanho(args.child, args.iterations, args.warmup, args.timeout_sec, filtro)
+        sys.stdout.write(json.dumps(resultado, default=str) + "\n")
+        return 0
+
+    resultados = []
+    for chips in (int(s) for s in args.sizes.split(",") if s.strip()):
+        resultado = _filho(args, chips)
+        imprimir(resultado)
+        resultados.append(resultado)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(resultados, indent=2, default=str), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
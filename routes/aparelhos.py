@@ -2,11 +2,10 @@
 # -*- coding: utf-8 -*-
 
 from flask import Blueprint, render_template, request, redirect
-from utils.bigquery_client import BigQueryClient
-from utils.sanitizer import sanitize_df
+from utils.bigquery_client import get_bq
 
 aparelhos_bp = Blueprint("aparelhos", __name__)
-bq = BigQueryClient()
+bq = get_bq()
 
 
 # =======================================================
@@ -15,8 +14,10 @@ bq = BigQueryClient()
 @aparelhos_bp.route("/aparelhos")
 def aparelhos_list():
     try:
-        df = bq.get_view("vw_aparelhos")
-        df = sanitize_df(df)
+        aparelhos = bq.run_rows(f"""
+            SELECT *
+            FROM `{bq.project}.{bq.dataset}.vw_aparelhos`
+        """, cache=True)
 
         # 🔐 BLINDAGEM ABSOLUTA CONTRA Undefined
         colunas_padrao = {
@@ -27,13 +28,9 @@ def aparelhos_list():
             "status": "DESCONHECIDO"
         }
 
-        for col, default in colunas_padrao.items():
-            if col not in df.columns:
-                df[col] = default
-
-        df = df.fillna(colunas_padrao)
-
-        aparelhos = df.to_dict(orient="records")
+        for aparelho in aparelhos:
+            for col, default in colunas_padrao.items():
+                aparelho.setdefault(col, default)
 
         return render_template(
             "aparelhos.html",
@@ -1,22 +1,42 @@
 # routes/chips.py
 # -*- coding: utf-8 -*-
 
+import os
 import re
+import json
+import base64
 import uuid
 import time
+import threading
 import unicodedata
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 from flask import Blueprint, jsonify, redirect, render_template, request, url_for, flash
 from google.cloud import bigquery
 
-from utils.bigquery_client import BigQueryClient
-from utils.sanitizer import sanitize_df
+from utils.bigquery_client import get_bq
+from utils.chip_import import MAX_LINHAS as IMPORT_MAX_LINHAS, ler_planilha, normalizar_linhas
+from utils.chip_search import ChipSearchIndex, filtro_sql
+from utils.event_writer import EventWriter
+from utils.number_index import get_number_index
+from utils.query_guard import QueryBudgetExceeded
+from utils.rollups import get_rollups
+from utils.slot_map import get_slot_map
 
 chips_bp = Blueprint("chips", __name__)
-bq = BigQueryClient()
+bq = get_bq()
 PROJECT = bq.project
 DATASET = bq.dataset
+eventos = EventWriter(bq, "f_chip_evento")
+slots = get_slot_map()
+numeros = get_number_index()
+busca = ChipSearchIndex(lambda since: carregar_busca(since))
+
+# Cache de schema (INFORMATION_SCHEMA) — evita 3 consultas de metadados por request
+SCHEMA_TTL_SEC = int(os.getenv("CHIPS_SCHEMA_TTL_SEC", "600"))
+CHIP_TABLES = ("dim_chip", "vw_chips_painel")
+_schema_lock = threading.Lock()
+_schema_cache = {"version": 0, "loaded_at": 0.0, "columns": {}, "maturando_em_ok": False, "numero_limpo_ok": False, "source": None}
 
 
 def only_digits(value):
@@ -62,21 +82,75 @@ def is_status_maturando(value):
     return normalize_status(value) in {"maturando", "em maturacao", "maturacao"}
 
 
+def maturando_sql(status_expr):
+    return f"LOWER(TRIM(REGEXP_REPLACE(NORMALIZE(COALESCE({status_expr}, ''), NFD), r'[\\u0300-\\u036f]', ''))) IN ('maturando', 'em maturacao', 'maturacao')"
+
+
+def maturacao_concluida_sql(status_expr, maturando_em_expr):
+    return f"{maturando_sql(status_expr)} AND {maturando_em_expr} IS NOT NULL AND TIMESTAMP_DIFF(CURRENT_TIMESTAMP(), {maturando_em_expr}, SECOND) >= 604800"
+
+
+def recarga_pendente_sql(data_expr):
+    return f"({data_expr} IS NULL OR {data_expr} < DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY))"
+
+
 def ensure_maturando_em_column():
+    if _schema_cache["maturando_em_ok"] and _schema_fresh():
+        return True
     columns = get_table_columns("dim_chip")
     if "maturando_em" in columns:
+        _schema_cache["maturando_em_ok"] = True
         return True
     try:
         run_op("criar campo maturando_em", f"""
             ALTER TABLE `{PROJECT}.{DATASET}.dim_chip`
             ADD COLUMN maturando_em TIMESTAMP
         """)
+        invalidate_schema_cache()
+        _schema_cache["maturando_em_ok"] = True
         return True
     except Exception as exc:
         print(f"[Chips] Aviso: maturando_em não foi criado automaticamente: {exc}")
         return False
 
 
+def has_numero_limpo_column():
+    """numero_limpo existe na dim_chip (só lê o schema; quem cria é ensure_numero_limpo_column)."""
+    return "numero_limpo" in get_table_columns("dim_chip")
+
+
+def ensure_numero_limpo_column():
+    """Coluna numero_limpo (só dígitos) gravada pelas escritas do painel; criada se faltar.
+
+    Só os caminhos de escrita chamam. Linhas gravadas fora do painel (SPs,
+    importações externas, DML manual) podem ficar com NULL, por isso as
+    leituras usam numero_limpo_sql(); o preenchimento das linhas antigas é
+    o sql/alter_dim_chip_numero_limpo.sql, rodado à parte.
+    """
+    if _schema_cache["numero_limpo_ok"] and _schema_fresh():
+        return True
+    if has_numero_limpo_column():
+        _schema_cache["numero_limpo_ok"] = True
+        return True
+    try:
+        run_op("criar campo numero_limpo", f"""
+            ALTER TABLE `{PROJECT}.{DATASET}.dim_chip` ADD COLUMN IF NOT EXISTS numero_limpo STRING
+        """)
+        invalidate_schema_cache()
+        _schema_cache["numero_limpo_ok"] = True
+        return True
+    except Exception as exc:
+        print(f"[Chips] Aviso: numero_limpo não foi criado automaticamente: {exc}")
+        return False
+
+
+def numero_limpo_sql(alias=None):
+    # coluna persistida quando preenchida; linha com NULL (escrita fora do painel) cai no REGEXP
+    col = f"{alias}.numero_limpo" if alias else "numero_limpo"
+    regexp = f"REGEXP_REPLACE({alias}.numero, r'[^0-9]', '')" if alias else "REGEXP_REPLACE(numero, r'[^0-9]', '')"
+    return f"COALESCE({col}, {regexp})" if has_numero_limpo_column() else regexp
+
+
 def maturando_em_assignment(new_status, previous_status=None):
     if is_status_maturando(new_status):
         if not is_status_maturando(previous_status):
@@ -85,29 +159,96 @@ def maturando_em_assignment(new_status, previous_status=None):
     return "maturando_em=NULL"
 
 
-def maturacao_concluida(value):
-    if not value:
-        return False
-    try:
-        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return (datetime.now(timezone.utc) - dt).total_seconds() >= 7 * 24 * 60 * 60
-    except Exception:
-        return False
+def maturando_em_update_sql(new_status_sql, previous_status_sql):
+    """maturando_em_assignment calculado no próprio SQL, quando o status anterior só existe na linha."""
+    return (f"maturando_em=IF({maturando_sql(new_status_sql)}, "
+            f"IF({maturando_sql(previous_status_sql)}, COALESCE(maturando_em, CURRENT_TIMESTAMP()), CURRENT_TIMESTAMP()), NULL)")
+
+
+def _schema_fresh():
+    return (time.monotonic() - _schema_cache["loaded_at"]) < SCHEMA_TTL_SEC
+
+
+def invalidate_schema_cache():
+    """Descarta colunas, fonte e SQL montados; a próxima leitura recarrega o schema."""
+    with _schema_lock:
+        _schema_cache["version"] += 1
+        _schema_cache["loaded_at"] = 0.0
+        _schema_cache["columns"] = {}
+        _schema_cache["maturando_em_ok"] = False
+        _schema_cache["numero_limpo_ok"] = False
+        _schema_cache["source"] = None
+
+
+def _load_schema():
+    # uma única consulta traz as colunas de todas as tabelas de chips
+    rows = bq.run_rows(f"""
+        SELECT table_name, column_name
+        FROM `{PROJECT}.{DATASET}.INFORMATION_SCHEMA.COLUMNS`
+        WHERE table_name IN UNNEST(@table_names)
+    """, [bigquery.ArrayQueryParameter("table_names", "STRING", list(CHIP_TABLES))])
+    columns = {name: set() for name in CHIP_TABLES}
+    for row in rows:
+        columns.setdefault(str(row["table_name"]), set()).add(str(row["column_name"]))
+    return columns
 
 
 def get_table_columns(table_name):
-    try:
-        df = bq.run_df(f"""
-            SELECT column_name
-            FROM `{PROJECT}.{DATASET}.INFORMATION_SCHEMA.COLUMNS`
-            WHERE table_name = @table_name
-        """, [param("table_name", "STRING", table_name)])
-        return {str(row["column_name"]) for _, row in df.iterrows()}
-    except Exception as exc:
-        print(f"[Chips] Erro ao ler schema de {table_name}: {exc}")
-        return set()
+    with _schema_lock:
+        if _schema_fresh() and table_name in _schema_cache["columns"]:
+            return _schema_cache["columns"][table_name]
+        try:
+            columns = _load_schema()
+        except Exception as exc:
+            print(f"[Chips] Erro ao ler schema de {table_name}: {exc}")
+            return set()
+        # schema vazio (tabela ausente/erro) não é cacheado para não fixar uma falha
+        if any(columns.values()):
+            _schema_cache["version"] += 1
+            _schema_cache["loaded_at"] = time.monotonic()
+            _schema_cache["columns"] = columns
+            _schema_cache["source"] = None
+            print(f"[Chips] Schema recarregado (versão {_schema_cache['version']}): { {k: len(v) for k, v in columns.items()} }")
+        return columns.get(table_name, set())
+
+
+def chip_source():
+    """Fonte de leitura dos chips (view ou dim) com as expressões SQL já montadas."""
+    source = _schema_cache["source"]
+    if source is not None and _schema_fresh():
+        return source
+    view_columns = get_table_columns("vw_chips_painel")
+    dim_columns = get_table_columns("dim_chip")
+    source_table = "vw_chips_painel" if view_columns and "maturando_em" in view_columns else "dim_chip"
+    source_columns = view_columns if source_table == "vw_chips_painel" else dim_columns
+    source = {
+        "table": source_table,
+        "columns": source_columns,
+        "exprs": chip_select_expr(source_columns),
+        "select_list": chip_select_list(source_columns),
+    }
+    if source_columns:
+        _schema_cache["source"] = source
+    return source
+
+
+def carregar_busca(since):
+    """Linhas do índice de busca (mesmas expressões da lista), alteradas desde o watermark."""
+    source = chip_source()
+    if not source["columns"]:
+        raise RuntimeError("Tabela/view de chips não encontrada no dataset configurado.")
+    exprs = source["exprs"]
+    where, params = "TRUE", None
+    if since is not None:
+        where = f"{exprs['updated_at']} >= @since"
+        params = [param("since", "TIMESTAMP", since)]
+    # carga inicial lê a frota toda: página a página, sem montar a lista inteira
+    return bq.iter_rows(f"""
+        SELECT {exprs['sk_chip']} AS sk_chip, {exprs['numero']} AS numero, {exprs['id_chip']} AS id_chip,
+               {exprs['operador']} AS operador, {exprs['updated_at']} AS updated_at
+        FROM `{PROJECT}.{DATASET}.{source['table']}`
+        WHERE {where}
+    """, params)
 
 
 def pick_col(columns, *names):
@@ -169,41 +310,109 @@ def run_op(operation, sql, params=None):
 
 
 def fetch_one(sql, params=None):
-    df = bq.run_df(sql, params=params)
-    return None if df.empty else sanitize_df(df).iloc[0].to_dict()
-
-
-def chip_by_clean_number(numero_limpo, exclude_sk=None):
-    where = "REGEXP_REPLACE(numero, r'[^0-9]', '') = @numero_limpo AND COALESCE(ativo, TRUE) = TRUE"
-    params = [param("numero_limpo", "STRING", numero_limpo)]
-    if exclude_sk:
-        where += " AND sk_chip != @exclude_sk"
-        params.append(param("exclude_sk", "INT64", int(exclude_sk)))
-    return fetch_one(f"""
-        SELECT sk_chip, id_chip, numero, status
-        FROM `{PROJECT}.{DATASET}.dim_chip`
-        WHERE {where}
-        LIMIT 1
-    """, params)
+    rows = bq.run_rows(sql, params=params)
+    return rows[0] if rows else None
 
 
 def insert_event(sk_chip, tipo, observacao, origem="Painel"):
+    # enfileira e retorna: o EventWriter grava em lote fora do caminho da requisição
     try:
-        run_op("registrar evento", f"""
-            INSERT INTO `{PROJECT}.{DATASET}.f_chip_evento`
-                (sk_chip, tipo_evento, origem, observacao, created_at)
-            VALUES (@sk_chip, @tipo, @origem, @observacao, CURRENT_TIMESTAMP())
-        """, [param("sk_chip", "INT64", int(sk_chip)), param("tipo", "STRING", tipo), param("origem", "STRING", origem), param("observacao", "STRING", observacao)])
+        eventos.enqueue(sk_chip, tipo, observacao, origem)
     except Exception as exc:
         print(f"⚠️ Evento não registrado ({tipo}) para sk_chip={sk_chip}: {exc}")
 
 
+STATS_KEYS = [
+    "total", "ativos", "inativos", "banidos", "disponiveis", "em_uso", "com_problema", "sem_aparelho",
+    "vinculados", "precisam_recarga", "maturando", "maturacao_concluida", "total_gasto",
+]
+
+
+def chips_stats(base_sql, params):
+    """Cards da listagem sobre TODO o conjunto filtrado (não só a página atual).
+
+    Reusa o mesmo base_sql/params da listagem; o resultado fica no cache de
+    consultas do BigQueryClient, ou seja, por assinatura de filtro.
+    """
+    status = "UPPER(COALESCE(status,''))"
+    sql = f"""
+        SELECT
+            COUNT(*) AS total,
+            COUNTIF(ativo IS TRUE OR {status} = 'ATIVO') AS ativos,
+            COUNTIF(ativo IS FALSE OR {status} = 'INATIVO') AS inativos,
+            COUNTIF({status} = 'BANIDO') AS banidos,
+            COUNTIF({status} IN ('DISPONIVEL', 'DISPONÍVEL')) AS disponiveis,
+            COUNTIF({status} IN ('EM_USO', 'EM USO', 'ATIVO')) AS em_uso,
+            COUNTIF({status} IN ('BANIDO', 'BLOQUEADO', 'RESTRINGIDO', 'MANUTENCAO')) AS com_problema,
+            COUNTIF(sk_aparelho_atual IS NULL) AS sem_aparelho,
+            COUNTIF(sk_aparelho_atual IS NOT NULL) AS vinculados,
+            COUNTIF({recarga_pendente_sql('ultima_recarga_data')}) AS precisam_recarga,
+            COUNTIF({maturando_sql('status')}) AS maturando,
+            COUNTIF({maturacao_concluida_sql('status', 'maturando_em')}) AS maturacao_concluida,
+            COALESCE(SUM(total_gasto), 0) AS total_gasto
+        FROM ({base_sql})
+    """
+    rows = bq.run_rows(sql, params=params or None, cache=True, null=None)
+    values = rows[0] if rows else {}
+    stats = {key: int(values.get(key) or 0) for key in STATS_KEYS}
+    stats["total_gasto"] = float(values.get("total_gasto") or 0)
+    return stats
+
+
+# Ordenação da listagem: (sort_ts DESC, sk_chip DESC) — também é a chave do cursor
+SORT_TS_SQL = "COALESCE(updated_at, created_at, TIMESTAMP('1970-01-01'))"
+
+
+def encode_cursor(sort_ts, sk_chip):
+    raw = json.dumps({"ts": sort_ts, "sk": int(sk_chip)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(str(data["ts"]).replace("Z", "+00:00")), int(data["sk"])
+    except Exception:
+        return None
+
+
+def page_query(base_sql, per_page, after=None, before=None, offset=0):
+    """SQL + params da página (keyset quando há cursor, OFFSET só no modo legado ?page=N).
+
+    Busca per_page+1 linhas para saber se existe próxima página sem COUNT.
+    """
+    params = [param("limit", "INT64", per_page + 1)]
+    where, order = "TRUE", "_sort_ts DESC, sk_chip DESC"
+    cursor = decode_cursor(after or before) if (after or before) else None
+    if cursor:
+        params += [param("cursor_ts", "TIMESTAMP", cursor[0]), param("cursor_sk", "INT64", cursor[1])]
+        if after:
+            where = "(_sort_ts < @cursor_ts OR (_sort_ts = @cursor_ts AND sk_chip < @cursor_sk))"
+        else:
+            # página anterior: percorre no sentido inverso e desinverte depois
+            where = "(_sort_ts > @cursor_ts OR (_sort_ts = @cursor_ts AND sk_chip > @cursor_sk))"
+            order = "_sort_ts ASC, sk_chip ASC"
+    limit_sql = "LIMIT @limit"
+    if not cursor and offset:
+        limit_sql += " OFFSET @offset"
+        params.append(param("offset", "INT64", offset))
+    sql = f"""
+        SELECT *, FORMAT_TIMESTAMP('%Y-%m-%dT%H:%M:%E6SZ', _sort_ts, 'UTC') AS _cursor_ts
+        FROM (SELECT *, {SORT_TS_SQL} AS _sort_ts FROM ({base_sql}))
+        WHERE {where}
+        ORDER BY {order}
+        {limit_sql}
+    """
+    return sql, params, bool(cursor and before)
+
+
 @chips_bp.route("/chips")
 def chips_list():
-    started = time.perf_counter()
-    route_params = {k: v for k, v in request.args.items() if clean_text(v) is not None}
-    print(f"[Chips] Rota /chips chamada. Params={route_params}")
     try:
+        # antes da leitura, recuado o quanto a lista (cache/réplica) pode estar atrasada:
+        # o delta sync da página parte daqui
+        changes_since = changes_watermark(atraso_sec=bq.read_lag_sec(cache=True))
         page = max(to_int(request.args.get("page"), 1), 1)
         per_page = min(max(to_int(request.args.get("per_page"), 50), 10), 100)
         offset = (page - 1) * per_page
@@ -214,25 +423,23 @@ def chips_list():
         filters = {k: clean_text(request.args.get(k)) for k in filter_names}
 
         ensure_maturando_em_column()
-        view_columns = get_table_columns("vw_chips_painel")
-        dim_columns = get_table_columns("dim_chip")
-        source_table = "vw_chips_painel" if view_columns and "maturando_em" in view_columns else "dim_chip"
-        source_columns = view_columns if source_table == "vw_chips_painel" else dim_columns
+        source = chip_source()
+        source_table, source_columns = source["table"], source["columns"]
         if not source_columns:
             raise RuntimeError("Tabela/view de chips não encontrada no dataset configurado.")
-        print(f"[Chips] Fonte selecionada: {source_table}. Colunas={sorted(source_columns)}")
 
-        exprs = chip_select_expr(source_columns)
+        exprs = source["exprs"]
         where, params = ["1=1"], []
         q = filters.get("q")
-        if q:
-            q_parts = [f"LOWER(COALESCE({exprs['numero']},'')) LIKE @q", f"LOWER(COALESCE({exprs['id_chip']},'')) LIKE @q", f"LOWER(COALESCE({exprs['operador']},'')) LIKE @q"]
-            digits = only_digits(q)
-            if digits:
-                q_parts.append(f"REGEXP_REPLACE(COALESCE({exprs['numero']},''), r'[^0-9]', '') LIKE @q_digits")
-                params.append(param("q_digits", "STRING", f"%{digits}%"))
-            where.append(f"({' OR '.join(q_parts)})")
-            params.append(param("q", "STRING", f"%{q.lower()}%"))
+        q_sks = busca.resolve(q) if q else None
+        if q_sks is not None:
+            # índice residente resolve o termo; a consulta só filtra pela chave
+            where.append(f"{exprs['sk_chip']} IN UNNEST(@q_sks)")
+            params.append(bigquery.ArrayQueryParameter("q_sks", "INT64", q_sks))
+        elif q:
+            q_where, q_params = filtro_sql(q, exprs)
+            where.append(q_where)
+            params += q_params
 
         equals_map = {"status": "status", "operadora": "operadora", "plano": "plano", "operador": "operador", "responsavel": "operador", "tipo_whatsapp": "tipo_whatsapp"}
         for filter_name, alias in equals_map.items():
@@ -261,53 +468,57 @@ def chips_list():
         quick = filters.get("quick")
         if quick == "sem_aparelho": where.append(f"{exprs['sk_aparelho_atual']} IS NULL")
         if quick == "banidos": where.append(f"UPPER(COALESCE({exprs['status']},'')) = 'BANIDO'")
-        if quick == "recarga": where.append(f"({exprs['ultima_recarga_data']} IS NULL OR {exprs['ultima_recarga_data']} < DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY))")
-        if quick == "maturando": where.append(f"LOWER(TRIM(REGEXP_REPLACE(NORMALIZE(COALESCE({exprs['status']}, ''), NFD), r'[\\u0300-\\u036f]', ''))) IN ('maturando', 'em maturacao', 'maturacao')")
-        if quick == "maturacao_concluida": where.append(f"LOWER(TRIM(REGEXP_REPLACE(NORMALIZE(COALESCE({exprs['status']}, ''), NFD), r'[\\u0300-\\u036f]', ''))) IN ('maturando', 'em maturacao', 'maturacao') AND {exprs['maturando_em']} IS NOT NULL AND TIMESTAMP_DIFF(CURRENT_TIMESTAMP(), {exprs['maturando_em']}, SECOND) >= 604800")
+        if quick == "recarga": where.append(recarga_pendente_sql(exprs['ultima_recarga_data']))
+        if quick == "maturando": where.append(maturando_sql(exprs['status']))
+        if quick == "maturacao_concluida": where.append(maturacao_concluida_sql(exprs['status'], exprs['maturando_em']))
 
         base_sql = f"""
-            SELECT {chip_select_list(source_columns)}
+            SELECT {source["select_list"]}
             FROM `{PROJECT}.{DATASET}.{source_table}`
             WHERE {' AND '.join(where)}
         """
-        sql = f"""
-            SELECT *, COUNT(*) OVER() AS total_count
-            FROM ({base_sql})
-            ORDER BY COALESCE(updated_at, created_at, TIMESTAMP('1970-01-01')) DESC, sk_chip DESC
-            LIMIT @limit OFFSET @offset
-        """
-        query_params = params + [param("limit", "INT64", per_page), param("offset", "INT64", offset)]
-        print(f"[Chips] Filtros aplicados: {filters}")
-        chips_df = sanitize_df(bq.run_df(sql, params=query_params))
-        total = int(chips_df["total_count"].iloc[0]) if not chips_df.empty and "total_count" in chips_df else 0
-        chips_records = chips_df.drop(columns=["total_count"], errors="ignore").to_dict("records")
+        after, before = clean_text(request.args.get("after")), clean_text(request.args.get("before"))
+        after = after if after and decode_cursor(after) else None
+        before = before if before and not after and decode_cursor(before) else None
+        sql, page_params, reverse = page_query(base_sql, per_page, after=after, before=before, offset=offset)
+        query_params = params + page_params
+        results = bq.gather({
+            "chips": lambda: bq.run_rows(sql, params=query_params, cache=True),
+            "stats": lambda: chips_stats(base_sql, params),
+            "aparelhos": lambda: bq.run_rows(f"SELECT sk_aparelho, marca, modelo FROM `{PROJECT}.{DATASET}.dim_aparelho` ORDER BY marca, modelo LIMIT 500", cache=True),
+        }, return_exceptions=True)
+        for name in ("chips", "stats"):
+            if isinstance(results[name], Exception):
+                raise results[name]
+        chips_records = results["chips"]
+        has_more = len(chips_records) > per_page
+        chips_records = chips_records[:per_page]
+        if reverse:
+            chips_records.reverse()
+        tokens = []
+        for c in chips_records:
+            c.pop("_sort_ts", None)
+            cursor_ts, sk = c.pop("_cursor_ts", None), to_int(c.get("sk_chip"))
+            if cursor_ts and sk is not None:
+                tokens.append(encode_cursor(cursor_ts, sk))
+        if reverse:
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = bool(after) or offset > 0, has_more
+        next_cursor = tokens[-1] if has_next and tokens else None
+        prev_cursor = tokens[0] if has_prev and tokens else None
+        stats = results["stats"]
+        total = stats["total"]
         aparelhos = []
-        try:
-            aparelhos_df = sanitize_df(bq.run_df(f"SELECT sk_aparelho, marca, modelo FROM `{PROJECT}.{DATASET}.dim_aparelho` ORDER BY marca, modelo LIMIT 500"))
-            aparelhos = aparelhos_df.to_dict("records")
-        except Exception as exc:
-            print(f"[Chips] Aviso: aparelhos não carregados: {exc}")
-        stats = {
-            "total": total,
-            "ativos": sum(1 for c in chips_records if c.get("ativo") is True or str(c.get("status") or "").upper() == "ATIVO"),
-            "inativos": sum(1 for c in chips_records if c.get("ativo") is False or str(c.get("status") or "").upper() == "INATIVO"),
-            "banidos": sum(1 for c in chips_records if str(c.get("status") or "").upper() == "BANIDO"),
-            "disponiveis": sum(1 for c in chips_records if str(c.get("status") or "").upper() in ["DISPONIVEL", "DISPONÍVEL"]),
-            "em_uso": sum(1 for c in chips_records if str(c.get("status") or "").upper() in ["EM_USO", "EM USO", "ATIVO"]),
-            "com_problema": sum(1 for c in chips_records if str(c.get("status") or "").upper() in ["BANIDO", "BLOQUEADO", "RESTRINGIDO", "MANUTENCAO"]),
-            "sem_aparelho": sum(1 for c in chips_records if not c.get("sk_aparelho_atual")),
-            "vinculados": sum(1 for c in chips_records if c.get("sk_aparelho_atual")),
-            "precisam_recarga": sum(1 for c in chips_records if not c.get("ultima_recarga_data")),
-            "maturando": sum(1 for c in chips_records if is_status_maturando(c.get("status"))),
-            "maturacao_concluida": sum(1 for c in chips_records if is_status_maturando(c.get("status")) and maturacao_concluida(c.get("maturando_em"))),
-            "total_gasto": sum(float(c.get("total_gasto") or 0) for c in chips_records),
-        }
-        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
-        print(f"[Chips] Registros retornados={len(chips_records)} total={total} tempo_ms={elapsed_ms}")
-        return render_template("chips.html", chips=chips_records, aparelhos=aparelhos, page=page, per_page=per_page, total=total, filters=filters, stats=stats, loading=False)
+        if isinstance(results["aparelhos"], Exception):
+            print(f"[Chips] Aviso: aparelhos não carregados: {results['aparelhos']}")
+        else:
+            aparelhos = results["aparelhos"]
+        return render_template("chips.html", chips=chips_records, aparelhos=aparelhos, page=page, per_page=per_page, total=total, filters=filters, stats=stats, next_cursor=next_cursor, prev_cursor=prev_cursor, changes_since=changes_since, loading=False)
+    except QueryBudgetExceeded as e:
+        return render_template("chips.html", chips=[], aparelhos=[], page=1, per_page=50, total=0, filters={}, stats={}, error=f"{e} Refine os filtros da busca.", loading=False), 200
     except Exception as e:
-        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
-        print(f"[Chips] Erro ao carregar chips tempo_ms={elapsed_ms}: {e}")
+        print(f"[Chips] Erro ao carregar chips: {e}")
         return render_template("chips.html", chips=[], aparelhos=[], page=1, per_page=50, total=0, filters={}, stats={}, error="Erro ao carregar chips. Verifique a conexão ou tente novamente.", loading=False), 200
 
 @chips_bp.route("/chips/add", methods=["POST"])
@@ -317,33 +528,56 @@ def chips_add():
     operadora = clean_text(data.get("operadora"))
     if not numero_limpo or not operadora:
         flash("Número e operadora são obrigatórios.", "error"); return redirect(url_for("chips.chips_list"))
+    ap = to_int(data.get("sk_aparelho_atual")); slot = to_int(data.get("slot_whatsapp"))
+    if ap and not slot:
+        flash("Slot WhatsApp é obrigatório para vincular aparelho.", "error"); return redirect(url_for("chips.chips_list"))
+    conflito = slots.check(ap, slot) if ap else None
+    if conflito:
+        flash(outcome_message({"resultado": conflito[0], "sk_conflito": conflito[1]}), "error"); return redirect(url_for("chips.chips_list"))
     try:
-        dup = chip_by_clean_number(numero_limpo)
+        dup = find_duplicates([numero_limpo]).get(numero_limpo)
         if dup:
-            flash(f"Chip já cadastrado para este número (SK {dup['sk_chip']}).", "error"); return redirect(url_for("chips.chips_list"))
+            flash(outcome_message({"resultado": "duplicate", "sk_conflito": dup}), "error"); return redirect(url_for("chips.chips_list"))
+        ensure_maturando_em_column()
         id_chip = clean_text(data.get("id_chip"), f"CHIP-{uuid.uuid4().hex[:10].upper()}")
         status = clean_text(data.get("status"), "DISPONIVEL")
-        observacao = clean_text(data.get("observacao"), "")
-        run_op("cadastrar chip", f"CALL `{PROJECT}.{DATASET}.sp_insert_chip`(@p_id_chip,@p_numero,@p_operadora,@p_plano,@p_status,@p_observacao,@p_origem)", [param("p_id_chip", "STRING", id_chip), param("p_numero", "STRING", numero_limpo), param("p_operadora", "STRING", operadora), param("p_plano", "STRING", clean_text(data.get("plano"), "")), param("p_status", "STRING", status), param("p_observacao", "STRING", observacao), param("p_origem", "STRING", "Painel")])
-        chip = chip_by_clean_number(numero_limpo)
-        if not chip or not chip.get("sk_chip"):
-            raise RuntimeError("Chip inserido, mas sk_chip não foi encontrado na dim_chip.")
-        sk_chip = int(chip["sk_chip"])
-        updates = []
-        params = [param("sk_chip", "INT64", sk_chip)]
-        for field, typ, default in [("operador","STRING",None),("tipo_whatsapp","STRING",None),("slot_whatsapp","INT64",None),("qt_disparos","INT64",0),("qt_banimentos","INT64",0),("dt_banimentos","DATE",None)]:
-            val = data.get(field)
-            if field.startswith("qt_"): val = to_int(val, default)
-            elif field == "slot_whatsapp": val = to_int(val)
-            elif field == "dt_banimentos": val = clean_text(val)
-            else: val = clean_text(val)
-            updates.append(f"{field}=@{field}"); params.append(param(field, typ, val))
-        ensure_maturando_em_column()
-        updates.append(maturando_em_assignment(status)); updates.append("ativo=TRUE"); updates.append("total_gasto=COALESCE(total_gasto,0)"); updates.append("updated_at=CURRENT_TIMESTAMP()")
-        run_op("complementar cadastro", f"UPDATE `{PROJECT}.{DATASET}.dim_chip` SET {', '.join(updates)} WHERE sk_chip=@sk_chip", params)
-        if to_int(data.get("sk_aparelho_atual")):
-            _vincular_chip(sk_chip, to_int(data.get("sk_aparelho_atual")), to_int(data.get("slot_whatsapp")), clean_text(data.get("tipo_whatsapp")))
+        dim = f"`{PROJECT}.{DATASET}.dim_chip`"
+        numero_limpo_set = "numero_limpo=@numero," if ensure_numero_limpo_column() else ""
+        # checagens + SP de cadastro + complemento + vínculo num único job
+        outcome = run_script("cadastrar chip", f"""
+            DECLARE resultado STRING DEFAULT 'ok';
+            DECLARE conflito INT64;
+            DECLARE novo_sk INT64;
+            SET conflito = ({dup_number_sql(dim)});
+            IF conflito IS NOT NULL THEN
+              SET resultado = 'duplicate';
+            ELSEIF @ap IS NOT NULL AND EXISTS({slot_owner_sql(dim)}) THEN
+              SET resultado = 'slot_taken';
+              SET conflito = ({slot_owner_sql(dim)});
+            ELSE
+              CALL `{PROJECT}.{DATASET}.sp_insert_chip`(@p_id_chip, @numero, @p_operadora, @p_plano, @p_status, @p_observacao, @p_origem);
+              -- número normalizado como o SP o gravar (a checagem acima garante que não há outro ativo com ele)
+              SET novo_sk = (SELECT MAX(sk_chip) FROM {dim} WHERE REGEXP_REPLACE(numero, r'[^0-9]', '') = @numero AND COALESCE(ativo, TRUE) = TRUE);
+              IF novo_sk IS NULL THEN
+                RAISE USING MESSAGE = 'Chip inserido, mas sk_chip não foi encontrado na dim_chip.';
+              END IF;
+              UPDATE {dim} SET
+                operador=@operador, tipo_whatsapp=@tipo_whatsapp, slot_whatsapp=@slot, sk_aparelho_atual=@ap,
+                qt_disparos=@qt_disparos, qt_banimentos=@qt_banimentos, dt_banimentos=@dt_banimentos, {numero_limpo_set}
+                {maturando_em_assignment(status)}, ativo=TRUE, total_gasto=COALESCE(total_gasto,0), updated_at=CURRENT_TIMESTAMP()
+              WHERE sk_chip = novo_sk;
+            END IF;
+            SELECT resultado, conflito AS sk_conflito, novo_sk AS sk_chip;
+        """, [param("sk", "INT64", None), param("numero", "STRING", numero_limpo), param("ap", "INT64", ap), param("slot", "INT64", slot), param("p_id_chip", "STRING", id_chip), param("p_operadora", "STRING", operadora), param("p_plano", "STRING", clean_text(data.get("plano"), "")), param("p_status", "STRING", status), param("p_observacao", "STRING", clean_text(data.get("observacao"), "")), param("p_origem", "STRING", "Painel"), param("operador", "STRING", clean_text(data.get("operador"))), param("tipo_whatsapp", "STRING", clean_text(data.get("tipo_whatsapp"))), param("qt_disparos", "INT64", to_int(data.get("qt_disparos"), 0)), param("qt_banimentos", "INT64", to_int(data.get("qt_banimentos"), 0)), param("dt_banimentos", "DATE", clean_text(data.get("dt_banimentos")))])
+        if outcome["resultado"] != "ok":
+            flash(outcome_message(outcome), "error"); return redirect(url_for("chips.chips_list"))
+        sk_chip = int(outcome["sk_chip"])
+        numeros.upsert(sk_chip, numero_limpo, operadora)
+        busca.upsert(sk_chip, numero_limpo, id_chip, clean_text(data.get("operador")))
         insert_event(sk_chip, "CADASTRO", "Cadastro realizado pelo painel")
+        if ap:
+            slots.occupy(ap, slot, sk_chip)
+            insert_event(sk_chip, "VINCULO_APARELHO", f"Vinculado ao aparelho {ap}, slot {slot}")
         flash(f"Chip cadastrado com sucesso (SK {sk_chip}).", "success")
     except Exception as e:
         print(f"🚨 Erro ao cadastrar chip numero={numero_limpo}: {e}")
@@ -351,27 +585,172 @@ def chips_add():
     return redirect(url_for("chips.chips_list"))
 
 
-def _vincular_chip(sk_chip, sk_aparelho, slot, tipo_whatsapp=None):
-    if not slot: raise ValueError("Slot WhatsApp é obrigatório para vincular aparelho.")
-    dup = fetch_one(f"SELECT sk_chip FROM `{PROJECT}.{DATASET}.dim_chip` WHERE sk_aparelho_atual=@ap AND slot_whatsapp=@slot AND sk_chip!=@sk AND COALESCE(ativo,TRUE)=TRUE LIMIT 1", [param("ap","INT64",sk_aparelho), param("slot","INT64",slot), param("sk","INT64",sk_chip)])
-    if dup: raise ValueError("Este slot já está ocupado no aparelho selecionado.")
-    run_op("vincular aparelho", f"UPDATE `{PROJECT}.{DATASET}.dim_chip` SET sk_aparelho_atual=@ap, slot_whatsapp=@slot, tipo_whatsapp=@tipo, updated_at=CURRENT_TIMESTAMP() WHERE sk_chip=@sk", [param("ap","INT64",sk_aparelho), param("slot","INT64",slot), param("tipo","STRING",tipo_whatsapp), param("sk","INT64",sk_chip)])
-    insert_event(sk_chip, "VINCULO_APARELHO", f"Vinculado ao aparelho {sk_aparelho}, slot {slot}")
+OUTCOME_MESSAGES = {
+    "duplicate": "Já existe chip ativo com este número (SK {sk_conflito}).",
+    "slot_taken": "Este slot já está ocupado no aparelho selecionado (SK {sk_conflito}).",
+    "not_found": "Chip não encontrado",
+    "invalid_slot": "Slot fora da capacidade do aparelho selecionado.",
+}
+OUTCOME_STATUS = {"duplicate": 409, "slot_taken": 409, "not_found": 404, "invalid_slot": 400}
+
+
+def dup_number_sql(dim):
+    """Outro chip ativo com o número limpo @numero (exceto @sk)."""
+    return f"SELECT sk_chip FROM {dim} WHERE {numero_limpo_sql()} = @numero AND COALESCE(ativo, TRUE) = TRUE AND sk_chip IS DISTINCT FROM @sk LIMIT 1"
+
+
+def slot_owner_sql(dim):
+    """Chip ativo (exceto @sk) que já ocupa @slot no aparelho @ap."""
+    return f"SELECT sk_chip FROM {dim} WHERE sk_aparelho_atual = @ap AND slot_whatsapp = @slot AND sk_chip IS DISTINCT FROM @sk AND COALESCE(ativo, TRUE) = TRUE LIMIT 1"
+
+
+def run_script(operation, sql, params):
+    """Executa um script multi-statement e devolve a linha do SELECT final (o desfecho)."""
+    rows = [dict(row.items()) for row in run_op(operation, sql, params)]
+    if not rows:
+        raise RuntimeError(f"Script '{operation}' não devolveu resultado.")
+    return rows[0]
+
+
+def outcome_message(outcome):
+    return OUTCOME_MESSAGES.get(outcome["resultado"], "Operação não concluída").format(**outcome)
+
+
+IMPORT_STAGE_SCHEMA = [
+    bigquery.SchemaField("linha", "INT64"), bigquery.SchemaField("id_chip", "STRING"), bigquery.SchemaField("numero", "STRING"),
+    bigquery.SchemaField("operadora", "STRING"), bigquery.SchemaField("plano", "STRING"), bigquery.SchemaField("status", "STRING"),
+    bigquery.SchemaField("operador", "STRING"), bigquery.SchemaField("observacao", "STRING"), bigquery.SchemaField("tipo_whatsapp", "STRING"),
+]
+
+
+def import_insert_columns(dim_columns):
+    """Colunas do INSERT da importação → expressão sobre a staging (S), só as que existem na dim_chip."""
+    exprs = {
+        "sk_chip": "S.sk_chip", "id_chip": "S.id_chip", "numero": "S.numero", "numero_limpo": "S.numero", "operadora": "S.operadora", "plano": "S.plano",
+        "status": "S.status", "operador": "S.operador", "observacao": "S.observacao", "tipo_whatsapp": "S.tipo_whatsapp",
+        "qt_disparos": "0", "qt_banimentos": "0", "ativo": "TRUE", "total_gasto": "0", "data_status": "CURRENT_DATE()",
+        "maturando_em": f"IF({maturando_sql('S.status')}, CURRENT_TIMESTAMP(), NULL)",
+        "created_at": "CURRENT_TIMESTAMP()", "updated_at": "CURRENT_TIMESTAMP()",
+    }
+    if not dim_columns:
+        return {k: v for k, v in exprs.items() if k in ("sk_chip", "id_chip", "numero", "operadora", "plano", "status", "observacao")}
+    return {k: v for k, v in exprs.items() if k in dim_columns}
+
+
+def find_duplicates(numeros_limpos, exclude_sk=None):
+    """Chips ativos (número limpo → sk_chip) que já usam algum dos números.
+
+    O índice residente responde o caso comum (nenhum duplicado) sem
+    consulta; só os números que ele aponta são confirmados com um lookup
+    por igualdade no número limpo (numero_limpo_sql). Escritas de outros workers ainda não
+    vistas pelo índice são barradas pela checagem dentro do script de escrita.
+    """
+    candidatos = [n for n in numeros_limpos if numeros.lookup(n) - {exclude_sk}]
+    if not candidatos:
+        return {}
+    where = f"{numero_limpo_sql()} IN UNNEST(@numeros) AND COALESCE(ativo, TRUE) = TRUE"
+    params = [bigquery.ArrayQueryParameter("numeros", "STRING", candidatos)]
+    if exclude_sk:
+        where += " AND sk_chip != @exclude_sk"
+        params.append(param("exclude_sk", "INT64", int(exclude_sk)))
+    rows = bq.run_rows(f"""
+        SELECT {numero_limpo_sql()} AS numero_limpo, sk_chip
+        FROM `{PROJECT}.{DATASET}.dim_chip`
+        WHERE {where}
+    """, params, null=None)
+    return {row["numero_limpo"]: row["sk_chip"] for row in rows}
+
+
+@chips_bp.route("/chips/import", methods=["POST"])
+def chips_import():
+    """Cadastro em lote (CSV/XLSX): 1 consulta de duplicados + 1 load job + 1 script MERGE/eventos.
+
+    ?simular=1 só valida e aponta duplicados, sem gravar nada.
+    """
+    arquivo = request.files.get("arquivo")
+    if not arquivo or not arquivo.filename:
+        return jsonify({"error": "Envie um arquivo CSV ou XLSX no campo 'arquivo'."}), 400
+    started_at = time.perf_counter()
+    stage = None
+    try:
+        linhas = ler_planilha(arquivo)
+        if len(linhas) > IMPORT_MAX_LINHAS:
+            return jsonify({"error": f"Arquivo com {len(linhas)} linhas; o limite por importação é {IMPORT_MAX_LINHAS}."}), 400
+        validas, invalidas = normalizar_linhas(linhas, operadora_padrao=clean_text(request.form.get("operadora")), status_padrao=clean_text(request.form.get("status"), "DISPONIVEL"))
+
+        existentes = find_duplicates([row["numero"] for row in validas])
+        duplicados = [{"linha": row["linha"], "numero": row["numero"], "sk_chip": existentes[row["numero"]]} for row in validas if row["numero"] in existentes]
+        novos = [row for row in validas if row["numero"] not in existentes]
+        resumo = {"success": True, "linhas": len(linhas), "validos": len(novos), "duplicados": duplicados, "invalidos": invalidas, "inseridos": 0, "chips": []}
+        if request.args.get("simular") in ("1", "true") or not novos:
+            return jsonify(resumo)
+
+        for row in novos:
+            row["id_chip"] = row["id_chip"] or f"CHIP-{uuid.uuid4().hex[:10].upper()}"
+        stage = f"_stg_import_chip_{uuid.uuid4().hex[:12]}"
+        bq.load_rows(stage, novos, IMPORT_STAGE_SCHEMA)
+
+        ensure_maturando_em_column()
+        ensure_numero_limpo_column()
+        columns = import_insert_columns(get_table_columns("dim_chip"))
+        dim = f"`{PROJECT}.{DATASET}.dim_chip`"
+        # novos recebe os sk_chip; o MERGE casa pelo número limpo de novo para não duplicar
+        # um chip cadastrado entre a checagem e o script
+        result = run_op("importar chips", f"""
+            BEGIN TRANSACTION;
+            CREATE TEMP TABLE novos AS
+            SELECT base.max_sk + ROW_NUMBER() OVER (ORDER BY S.linha) AS sk_chip, S.*
+            FROM `{PROJECT}.{DATASET}.{stage}` S
+            CROSS JOIN (SELECT COALESCE(MAX(sk_chip), 0) AS max_sk FROM {dim}) base;
+
+            MERGE {dim} T
+            USING novos S
+            ON {numero_limpo_sql("T")} = S.numero AND COALESCE(T.ativo, TRUE) = TRUE
+            WHEN NOT MATCHED THEN
+              INSERT ({", ".join(columns)}) VALUES ({", ".join(columns.values())});
+
+            INSERT INTO `{PROJECT}.{DATASET}.f_chip_evento` (sk_chip, tipo_evento, origem, observacao, created_at)
+            SELECT N.sk_chip, 'CADASTRO', 'Importação', 'Cadastro por importação em lote', CURRENT_TIMESTAMP()
+            FROM novos N JOIN {dim} D ON D.sk_chip = N.sk_chip AND D.numero = N.numero;
+            COMMIT TRANSACTION;
+
+            SELECT N.sk_chip, N.numero, N.linha
+            FROM novos N JOIN {dim} D ON D.sk_chip = N.sk_chip AND D.numero = N.numero
+            ORDER BY N.linha;
+        """)
+        rows = [dict(row.items()) for row in result]
+        por_numero = {row["numero"]: row for row in novos}
+        for row in rows:
+            origem = por_numero.get(row["numero"], {})
+            numeros.upsert(row["sk_chip"], row["numero"], origem.get("operadora"))
+            busca.upsert(row["sk_chip"], row["numero"], origem.get("id_chip"), origem.get("operador"))
+        resumo["inseridos"] = len(rows)
+        resumo["chips"] = rows
+        elapsed_ms = int((time.perf_counter() - started_at) * 1000)
+        print(f"[Chips] Importação: linhas={len(linhas)} inseridos={len(rows)} duplicados={len(duplicados)} invalidos={len(invalidas)} tempo_ms={elapsed_ms}")
+        return jsonify(resumo)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"🚨 Erro na importação de chips: {e}")
+        return jsonify({"error": f"Erro na importação: {e}"}), 500
+    finally:
+        if stage:
+            try:
+                bq.run(f"DROP TABLE IF EXISTS `{PROJECT}.{DATASET}.{stage}`")
+            except Exception as exc:
+                print(f"⚠️ Staging {stage} não removida: {exc}")
 
 
 @chips_bp.route("/chips/sk/<int:sk_chip>")
 def chips_get_by_sk(sk_chip):
     try:
         ensure_maturando_em_column()
-        view_columns = get_table_columns("vw_chips_painel")
-        dim_columns = get_table_columns("dim_chip")
-        source_table = "vw_chips_painel" if view_columns and "maturando_em" in view_columns else "dim_chip"
-        source_columns = view_columns if source_table == "vw_chips_painel" else dim_columns
-        exprs = chip_select_expr(source_columns)
+        source = chip_source()
         row = fetch_one(f"""
-            SELECT {chip_select_list(source_columns)}
-            FROM `{PROJECT}.{DATASET}.{source_table}`
-            WHERE {exprs['sk_chip']}=@sk
+            SELECT {source["select_list"]}
+            FROM `{PROJECT}.{DATASET}.{source["table"]}`
+            WHERE {source["exprs"]['sk_chip']}=@sk
             LIMIT 1
         """, [param("sk","INT64",sk_chip)])
         return (jsonify(row), 200) if row else (jsonify({"error":"Chip não encontrado"}),404)
@@ -384,37 +763,64 @@ def chips_update_json():
     try:
         p = request.json or {}; sk = to_int(p.get("sk_chip"))
         if not sk: return jsonify({"error":"sk_chip ausente"}),400
-        ensure_maturando_em_column()
-        atual = fetch_one(f"""
-            SELECT sk_chip, numero, operadora, plano, status, operador, observacao, tipo_whatsapp,
-                   slot_whatsapp, qt_disparos, qt_banimentos, dt_banimentos, data_status, sk_aparelho_atual
-            FROM `{PROJECT}.{DATASET}.dim_chip`
-            WHERE sk_chip=@sk
-            LIMIT 1
-        """, [param("sk","INT64",sk)])
-        if not atual: return jsonify({"error":"Chip não encontrado"}),404
         numero_limpo = only_digits(p.get("numero"))
         if not numero_limpo: return jsonify({"error":"Número obrigatório"}),400
-        dup = chip_by_clean_number(numero_limpo, exclude_sk=sk)
-        if dup: return jsonify({"error":f"Já existe chip ativo com este número (SK {dup['sk_chip']})."}),409
-        status_novo = clean_text(p.get("status"), atual.get("status") or "DISPONIVEL")
-        set_data_status = "data_status = CURRENT_DATE()," if status_novo != atual.get("status") else "data_status = @data_status,"
-        run_op("editar chip", f"""
-            UPDATE `{PROJECT}.{DATASET}.dim_chip` SET
-              numero=@numero, operadora=@operadora, plano=@plano, status=@status, operador=@operador,
-              observacao=@observacao, tipo_whatsapp=@tipo_whatsapp, slot_whatsapp=@slot_whatsapp,
-              qt_disparos=@qt_disparos, qt_banimentos=@qt_banimentos, dt_banimentos=@dt_banimentos,
-              {set_data_status} {maturando_em_assignment(status_novo, atual.get("status"))}, updated_at=CURRENT_TIMESTAMP()
-            WHERE sk_chip=@sk
-        """, [param("numero","STRING",numero_limpo), param("operadora","STRING",clean_text(p.get("operadora"))), param("plano","STRING",clean_text(p.get("plano"))), param("status","STRING",status_novo), param("operador","STRING",clean_text(p.get("operador"))), param("observacao","STRING",clean_text(p.get("observacao"))), param("tipo_whatsapp","STRING",clean_text(p.get("tipo_whatsapp"))), param("slot_whatsapp","INT64",to_int(p.get("slot_whatsapp"))), param("qt_disparos","INT64",to_int(p.get("qt_disparos"),0)), param("qt_banimentos","INT64",to_int(p.get("qt_banimentos"),0)), param("dt_banimentos","DATE",clean_text(p.get("dt_banimentos"))), param("data_status","DATE",clean_text(p.get("data_status") or p.get("dt_inicio"))), param("sk","INT64",sk)])
-        if "sk_aparelho_atual" in p:
-            ap = to_int(p.get("sk_aparelho_atual"))
-            if ap: _vincular_chip(sk, ap, to_int(p.get("slot_whatsapp")), clean_text(p.get("tipo_whatsapp")))
-            else:
-                run_op("desvincular aparelho", f"UPDATE `{PROJECT}.{DATASET}.dim_chip` SET sk_aparelho_atual=NULL, slot_whatsapp=NULL, tipo_whatsapp=NULL, updated_at=CURRENT_TIMESTAMP() WHERE sk_chip=@sk", [param("sk","INT64",sk)])
-                insert_event(sk, "DESVINCULO_APARELHO", "Desvinculado pelo painel")
+        vincular = "sk_aparelho_atual" in p and bool(to_int(p.get("sk_aparelho_atual")))
+        desvincular = "sk_aparelho_atual" in p and not vincular
+        ap = to_int(p.get("sk_aparelho_atual")) if vincular else None; slot = to_int(p.get("slot_whatsapp"))
+        if vincular and not slot: return jsonify({"error":"Slot WhatsApp é obrigatório para vincular aparelho."}),400
+        # mapa residente recusa conflito conhecido sem gastar job; o script confere de novo
+        conflito = slots.check(ap, slot, sk) if vincular else None
+        if not conflito:
+            dup = find_duplicates([numero_limpo], exclude_sk=sk).get(numero_limpo)
+            conflito = ("duplicate", dup) if dup else None
+        if conflito:
+            return jsonify({"error": outcome_message({"resultado": conflito[0], "sk_conflito": conflito[1]}), "resultado": conflito[0], "sk_conflito": conflito[1]}), OUTCOME_STATUS[conflito[0]]
+        ensure_maturando_em_column()
+        numero_limpo_set = "numero_limpo=@numero," if ensure_numero_limpo_column() else ""
+        status_novo = clean_text(p.get("status"))
+        if vincular:
+            aparelho_sql = "sk_aparelho_atual=@ap, slot_whatsapp=@slot, tipo_whatsapp=@tipo_whatsapp,"
+        elif desvincular:
+            aparelho_sql = "sk_aparelho_atual=NULL, slot_whatsapp=NULL, tipo_whatsapp=NULL,"
+        else:
+            aparelho_sql = "slot_whatsapp=@slot, tipo_whatsapp=@tipo_whatsapp,"
+        dim = f"`{PROJECT}.{DATASET}.dim_chip`"
+        # leitura do atual + duplicado + slot + UPDATE num único job; no SET, status/maturando_em são os valores antigos
+        outcome = run_script("editar chip", f"""
+            DECLARE resultado STRING DEFAULT 'ok';
+            DECLARE conflito INT64;
+            IF NOT EXISTS(SELECT 1 FROM {dim} WHERE sk_chip = @sk) THEN
+              SET resultado = 'not_found';
+            ELSE
+              SET conflito = ({dup_number_sql(dim)});
+              IF conflito IS NOT NULL THEN
+                SET resultado = 'duplicate';
+              ELSEIF @ap IS NOT NULL AND EXISTS({slot_owner_sql(dim)}) THEN
+                SET resultado = 'slot_taken';
+                SET conflito = ({slot_owner_sql(dim)});
+              ELSE
+                UPDATE {dim} SET
+                  numero=@numero, {numero_limpo_set} operadora=@operadora, plano=@plano, status=COALESCE(@status, status, 'DISPONIVEL'), operador=@operador,
+                  observacao=@observacao, {aparelho_sql}
+                  qt_disparos=@qt_disparos, qt_banimentos=@qt_banimentos, dt_banimentos=@dt_banimentos,
+                  data_status=IF(COALESCE(@status, status) IS DISTINCT FROM status, CURRENT_DATE(), @data_status),
+                  {maturando_em_update_sql("COALESCE(@status, status, 'DISPONIVEL')", "status")}, updated_at=CURRENT_TIMESTAMP()
+                WHERE sk_chip=@sk;
+              END IF;
+            END IF;
+            SELECT resultado, conflito AS sk_conflito;
+        """, [param("sk","INT64",sk), param("ap","INT64",ap), param("slot","INT64",slot), param("numero","STRING",numero_limpo), param("operadora","STRING",clean_text(p.get("operadora"))), param("plano","STRING",clean_text(p.get("plano"))), param("status","STRING",status_novo), param("operador","STRING",clean_text(p.get("operador"))), param("observacao","STRING",clean_text(p.get("observacao"))), param("tipo_whatsapp","STRING",clean_text(p.get("tipo_whatsapp"))), param("qt_disparos","INT64",to_int(p.get("qt_disparos"),0)), param("qt_banimentos","INT64",to_int(p.get("qt_banimentos"),0)), param("dt_banimentos","DATE",clean_text(p.get("dt_banimentos"))), param("data_status","DATE",clean_text(p.get("data_status") or p.get("dt_inicio")))])
+        if outcome["resultado"] != "ok":
+            return jsonify({"error": outcome_message(outcome), "resultado": outcome["resultado"], "sk_conflito": outcome.get("sk_conflito")}), OUTCOME_STATUS.get(outcome["resultado"], 500)
+        if vincular:
+            slots.occupy(ap, slot, sk); insert_event(sk, "VINCULO_APARELHO", f"Vinculado ao aparelho {ap}, slot {slot}")
+        if desvincular:
+            slots.release(sk); insert_event(sk, "DESVINCULO_APARELHO", "Desvinculado pelo painel")
+        numeros.upsert(sk, numero_limpo, clean_text(p.get("operadora")))
+        busca.patch(sk, numero=numero_limpo, operador=clean_text(p.get("operador")))
         insert_event(sk, "EDICAO", "Chip editado pelo painel")
-        return jsonify({"success": True})
+        return jsonify({"success": True, "resultado": "ok"})
     except Exception as e:
         print("🚨 Erro ao editar chip:", e); return jsonify({"error": str(e)}),500
 
@@ -446,21 +852,181 @@ def chips_banir():
         print("🚨 Erro ao banir chip:", e); return jsonify({"error":str(e)}),500
 
 
+BULK_MAX_IDS = int(os.getenv("CHIPS_BULK_MAX_IDS", "1000"))
+
+
+def bulk_action(acao, p):
+    """(SET do UPDATE, condição para aplicar, params, (tipo_evento, observacao), SQL extra) de uma ação em lote.
+
+    O lote não chama as SPs da ação unitária; o que elas gravam vai aqui em forma de conjunto:
+    sp_registrar_recarga_chip só escreve ultima_recarga_valor/_data, total_gasto e updated_at
+    (o SET abaixo), e sp_desvincular_aparelho_chip também fecha o vínculo aberto em
+    f_chip_aparelho (o SQL extra, que roda no mesmo script depois do UPDATE da dim_chip).
+    """
+    if acao == "banir":
+        return ("status='BANIDO', maturando_em=NULL, qt_banimentos=COALESCE(qt_banimentos,0)+1, dt_banimentos=CURRENT_DATE(), data_status=CURRENT_DATE()",
+                "TRUE", [], ("BANIMENTO", "Banimento em lote pelo painel"), "")
+    if acao == "recarga":
+        valor = to_float(p.get("valor"))
+        if valor is None or valor <= 0:
+            raise ValueError("valor obrigatório para recarga")
+        return ("ultima_recarga_valor=@valor, ultima_recarga_data=CURRENT_DATE(), total_gasto=COALESCE(total_gasto,0)+@valor",
+                "TRUE", [param("valor", "FLOAT64", valor)], ("RECARGA", clean_text(p.get("observacao"), f"Recarga em lote de R$ {valor:.2f}")), "")
+    if acao == "status":
+        status = clean_text(p.get("status"))
+        if not status:
+            raise ValueError("status obrigatório")
+        status = status.upper()
+        return (f"status=@status, data_status=IF(status IS DISTINCT FROM @status, CURRENT_DATE(), data_status), {maturando_em_update_sql('@status', 'status')}",
+                "TRUE", [param("status", "STRING", status)], ("ALTERACAO_STATUS", f"Status alterado em lote para {status}"), "")
+    if acao == "desvincular":
+        return ("sk_aparelho_atual=NULL, slot_whatsapp=NULL, tipo_whatsapp=NULL",
+                "sk_aparelho_atual IS NOT NULL", [], ("DESVINCULO_APARELHO", "Desvinculado em lote pelo painel"),
+                f"""UPDATE `{PROJECT}.{DATASET}.f_chip_aparelho` SET dt_fim=CURRENT_TIMESTAMP()
+            WHERE sk_chip IN (SELECT sk_chip FROM alvo WHERE aplica) AND dt_fim IS NULL;""")
+    raise ValueError(f"ação desconhecida: {acao}")
+
+
+@chips_bp.route("/chips/bulk", methods=["POST"])
+def chips_bulk():
+    """Ação em vários chips: um UPDATE ... WHERE sk_chip IN UNNEST(@ids) + eventos em lote.
+
+    Corpo: {"acao": "banir"|"recarga"|"status"|"desvincular", "sk_chips": [...], "valor"?, "status"?}.
+    Resposta com o resultado por sk_chip: ok, nao_encontrado ou sem_alteracao
+    (ex.: desvincular um chip que não estava vinculado).
+    """
+    try:
+        p = request.json or {}
+        acao = clean_text(p.get("acao"), "").lower()
+        ids = list(dict.fromkeys(sk for sk in (to_int(v) for v in (p.get("sk_chips") or [])) if sk))
+        if not ids: return jsonify({"error": "sk_chips obrigatório"}), 400
+        if len(ids) > BULK_MAX_IDS: return jsonify({"error": f"Máximo de {BULK_MAX_IDS} chips por ação"}), 400
+        try:
+            set_sql, aplica_sql, params, (tipo_evento, observacao), extra_sql = bulk_action(acao, p)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        ensure_maturando_em_column()
+        dim = f"`{PROJECT}.{DATASET}.dim_chip`"
+        # alvo calculado antes do UPDATE para separar "não encontrado" de "sem alteração"
+        result = run_op(f"ação em lote {acao}", f"""
+            CREATE TEMP TABLE alvo AS
+            SELECT sk_chip, {aplica_sql} AS aplica
+            FROM {dim}
+            WHERE sk_chip IN UNNEST(@ids);
+            UPDATE {dim} SET {set_sql}, updated_at=CURRENT_TIMESTAMP()
+            WHERE sk_chip IN (SELECT sk_chip FROM alvo WHERE aplica);
+            {extra_sql}
+            SELECT sk_chip, aplica FROM alvo;
+        """, [bigquery.ArrayQueryParameter("ids", "INT64", ids)] + params)
+        encontrados = {int(row["sk_chip"]): bool(row["aplica"]) for row in result}
+        resultados = []
+        for sk in ids:
+            if sk not in encontrados:
+                resultados.append({"sk_chip": sk, "resultado": "nao_encontrado"})
+            elif not encontrados[sk]:
+                resultados.append({"sk_chip": sk, "resultado": "sem_alteracao"})
+            else:
+                if acao == "desvincular":
+                    slots.release(sk)
+                insert_event(sk, tipo_evento, observacao)
+                resultados.append({"sk_chip": sk, "resultado": "ok"})
+        aplicados = sum(1 for r in resultados if r["resultado"] == "ok")
+        print(f"[Chips] Ação em lote acao={acao} ids={len(ids)} aplicados={aplicados}")
+        return jsonify({"success": True, "acao": acao, "aplicados": aplicados, "resultados": resultados})
+    except Exception as e:
+        print("🚨 Erro na ação em lote:", e); return jsonify({"error": str(e)}), 500
+
+
 @chips_bp.route("/chips/timeline/<int:sk_chip>")
 def chips_timeline(sk_chip):
     try:
-        df = bq.run_df(f"""
+        # eventos deste chip ainda na fila são gravados antes da leitura
+        if eventos.pending_for(sk_chip):
+            try:
+                eventos.flush()
+            except Exception as exc:
+                print(f"⚠️ Fila de eventos não gravada antes da timeline: {exc}")
+        rows = bq.run_rows(f"""
             SELECT sk_chip, tipo_evento, origem, observacao, created_at AS data_evento
             FROM `{PROJECT}.{DATASET}.f_chip_evento`
             WHERE sk_chip=@sk
             ORDER BY created_at DESC
             LIMIT 100
         """, [param("sk","INT64",sk_chip)])
-        return jsonify(sanitize_df(df).to_dict("records"))
+        return jsonify(rows)
     except Exception as e:
         print("🚨 Erro timeline:", e); return jsonify([]),500
 
 
+# Delta sync: a listagem e a tela de recargas pedem só o que mudou desde o watermark
+# (folga para escritas que ainda estavam em andamento; reenviar um chip é inofensivo).
+# Eventos usam uma folga maior: a fila grava created_at de quando o evento entrou e
+# pode commitar até eventos.max_latency_sec depois.
+CHANGES_FOLGA_SEC = int(os.getenv("CHIPS_CHANGES_FOLGA_SEC", "30"))
+# acima disso o cliente recarrega a página em vez de aplicar o delta
+CHANGES_MAX_CHIPS = int(os.getenv("CHIPS_CHANGES_MAX", "500"))
+
+
+def changes_watermark(since=None, atraso_sec=0):
+    """Watermark entregue ao cliente: agora menos a folga e o atraso da leitura (nunca antes de since), no formato do cursor da listagem."""
+    agora = datetime.now(timezone.utc) - timedelta(seconds=CHANGES_FOLGA_SEC + atraso_sec)
+    if since is not None:
+        agora = max(agora, since)
+    return agora.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+@chips_bp.route("/api/chips/changes")
+def chips_changes():
+    """Chips alterados (updated_at ou evento novo) depois de ?since=, mais tombstones dos desativados.
+
+    Sem since devolve só o watermark atual (o cliente pede antes da carga
+    inicial). recarregar=true quando o delta passa de CHANGES_MAX_CHIPS.
+    Lê sempre do BigQuery (sem cache nem réplica): uma cópia atrasada
+    perderia de vez o que mudou entre ela e o watermark.
+    """
+    since_raw = clean_text(request.args.get("since"))
+    if not since_raw:
+        return jsonify({"watermark": changes_watermark(), "chips": [], "removidos": [], "recarregar": False})
+    try:
+        since = datetime.fromisoformat(since_raw.replace("Z", "+00:00"))
+    except ValueError:
+        return jsonify({"error": "since inválido (use o watermark devolvido pela API)"}), 400
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # calculado antes da leitura: o que mudar durante a consulta vem no próximo delta
+    watermark = changes_watermark(since)
+    try:
+        source = chip_source()
+        if not source["columns"]:
+            raise RuntimeError("Tabela/view de chips não encontrada no dataset configurado.")
+        exprs = source["exprs"]
+        rows = bq.run_rows(f"""
+            SELECT {source["select_list"]}
+            FROM `{PROJECT}.{DATASET}.{source['table']}`
+            WHERE {exprs['updated_at']} > @since
+               OR {exprs['sk_chip']} IN (
+                    SELECT sk_chip FROM `{PROJECT}.{DATASET}.f_chip_evento` WHERE created_at > @since_eventos
+               )
+            LIMIT @limit
+        """, [param("since", "TIMESTAMP", since), param("since_eventos", "TIMESTAMP", since - timedelta(seconds=eventos.max_latency_sec)),
+              param("limit", "INT64", CHANGES_MAX_CHIPS + 1)], null=None, replica=False)
+        if len(rows) > CHANGES_MAX_CHIPS:
+            return jsonify({"watermark": watermark, "chips": [], "removidos": [], "recarregar": True})
+        chips = [r for r in rows if r.get("ativo") is not False]
+        removidos = [r["sk_chip"] for r in rows if r.get("ativo") is False]
+        return jsonify({"watermark": watermark, "chips": chips, "removidos": removidos, "recarregar": False})
+    except Exception as e:
+        print("🚨 Erro no delta de chips:", e)
+        return jsonify({"error": "Erro ao buscar alterações"}), 500
+
+
+@chips_bp.route("/admin/schema/refresh", methods=["POST"])
+def schema_refresh():
+    invalidate_schema_cache()
+    source = chip_source()
+    return jsonify({"success": True, "fonte": source["table"], "versao": _schema_cache["version"]})
+
+
 @chips_bp.route("/admin/diagnostico")
 def diagnostico():
     checks = []
@@ -472,9 +1038,23 @@ def diagnostico():
         "vínculo inválido": f"SELECT COUNT(*) qtd FROM `{PROJECT}.{DATASET}.dim_chip` c LEFT JOIN `{PROJECT}.{DATASET}.dim_aparelho` a ON c.sk_aparelho_atual=a.sk_aparelho WHERE c.sk_aparelho_atual IS NOT NULL AND a.sk_aparelho IS NULL",
         "slots duplicados": f"SELECT COUNT(*) qtd FROM (SELECT sk_aparelho_atual, slot_whatsapp FROM `{PROJECT}.{DATASET}.dim_chip` WHERE sk_aparelho_atual IS NOT NULL AND slot_whatsapp IS NOT NULL GROUP BY 1,2 HAVING COUNT(*)>1)",
     }
-    for nome, sql in queries.items():
-        try:
-            row = fetch_one(sql); checks.append({"check": nome, "ok": True, "resultado": row})
-        except Exception as e:
-            checks.append({"check": nome, "ok": False, "erro": str(e)})
+    if has_numero_limpo_column():
+        queries["numero_limpo desatualizado"] = f"SELECT COUNT(*) qtd FROM `{PROJECT}.{DATASET}.dim_chip` WHERE numero_limpo IS DISTINCT FROM REGEXP_REPLACE(numero, r'[^0-9]', '')"
+    results = bq.gather({nome: (lambda sql=sql: fetch_one(sql)) for nome, sql in queries.items()}, return_exceptions=True)
+    for nome, row in results.items():
+        if isinstance(row, Exception):
+            checks.append({"check": nome, "ok": False, "erro": str(row)})
+        else:
+            checks.append({"check": nome, "ok": True, "resultado": row})
+    checks.append({"check": "mapa de slots", "ok": True, "resultado": slots.stats()})
+    checks.append({"check": "índice de busca", "ok": True, "resultado": busca.stats()})
+    if bq.replica is not None:
+        replica = bq.replica.stats()
+        checks.append({"check": "réplica local", "ok": replica["last_error"] is None, "resultado": replica})
+    fila = eventos.stats()
+    checks.append({"check": "fila de eventos", "ok": fila["last_error"] is None, "resultado": fila})
+    checks.append({"check": "consultas que mais somam tempo", "ok": True, "resultado": bq.metrics.top(10)})
+    checks.append({"check": "guarda de custo", "ok": True, "resultado": bq.guard.stats()})
+    agregados = get_rollups().stats()
+    checks.append({"check": "agregados do dashboard", "ok": agregados["last_error"] is None, "resultado": agregados})
     return jsonify(checks)
@@ -1,28 +1,220 @@
 # routes/dashboard.py
 # -*- coding: utf-8 -*-
 
-from flask import Blueprint, render_template
+from flask import Blueprint, jsonify, render_template, request
+from datetime import date
 import os
-from collections import Counter
 
-from utils.bigquery_client import BigQueryClient
-from utils.sanitizer import sanitize_df
+from google.cloud import bigquery
+
+from utils.bigquery_client import get_bq
+from utils.query_guard import QueryBudgetExceeded
+from utils.rollups import MAX_STALENESS_SEC, get_rollups
 
 bp_dashboard = Blueprint("dashboard", __name__)
 
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "painel-universidade")
 DATASET = os.getenv("BQ_DATASET", "marts")
 
-bq = BigQueryClient()
+bq = get_bq()
+rollups = get_rollups()
 
 
-@bp_dashboard.route("/")
-@bp_dashboard.route("/dashboard")
-def dashboard():
+# Ordem "inteligente" dos cards de status (você pode ajustar como quiser)
+STATUS_ORDER = [
+    "ATIVO",
+    "DISPARANDO",
+    "MATURANDO",
+    "DISPONIVEL",
+    "DISPONÍVEL",
+    "RESTRINGIDO",
+    "BANIDO",
+    "CANCELADO",
+    "INATIVO",
+    "SEM STATUS",
+]
+
+STATUS_EXPR = "COALESCE(NULLIF(UPPER(TRIM(c.status)), ''), 'SEM STATUS')"
+
+ALERTA_DIAS = 80
+# o alerta lista só os mais antigos; a contagem vem inteira dos agregados
+ALERTA_LIMITE = 200
+
+# faixas de dias sem recarga (limite superior inclusivo; None = sem limite)
+FAIXAS_RECARGA = [("0-30 dias", 30), ("31-60 dias", 60), (f"61-{ALERTA_DIAS} dias", ALERTA_DIAS), (f"+{ALERTA_DIAS} dias", None)]
+
+
+def sobre_dim_chip(sql):
+    """Mesma consulta lendo dim_chip direto (fallback barato quando a view passa do orçamento)."""
+    return sql.replace(f"`{PROJECT_ID}.{DATASET}.vw_chips_painel_base`", f"`{PROJECT_ID}.{DATASET}.dim_chip`")
+
+
+# ===========================================================
+# SERVIÇO DE DADOS — RESUMO AGREGADO (O(status) LINHAS)
+# ===========================================================
+def montar_resumo(status_counts_raw, operadoras, ranking, **extras):
+    """Monta o contexto do template a partir das contagens (consulta direta ou agregados)."""
+    # 1) Primeiro, os da ordem (se existirem)
+    status_counts = {st: status_counts_raw[st] for st in STATUS_ORDER if st in status_counts_raw}
+
+    # 2) Depois, qualquer outro status que apareça no banco (não previsto na ordem)
+    extras_status = sorted(
+        [k for k in status_counts_raw if k not in status_counts],
+        key=lambda s: (-status_counts_raw[s], s)
+    )
+    for st in extras_status:
+        status_counts[st] = status_counts_raw[st]
+
+    return {
+        "total_chips": sum(status_counts_raw.values()),
+        "chips_ativos": status_counts_raw.get("ATIVO", 0),
+        "disparando": status_counts_raw.get("DISPARANDO", 0),
+        "banidos": status_counts_raw.get("BANIDO", 0),
+        "status_counts": status_counts,
+        "lista_status": sorted(k for k in status_counts_raw if k != "SEM STATUS"),
+        "lista_operadora": sorted(o["operadora"] for o in operadoras if o["operadora"] != "SEM OPERADORA"),
+        "operadoras_resumo": sorted(operadoras, key=lambda o: (-o["qtd"], o["operadora"])),
+        "ranking_disparos": [
+            {"numero": r["numero"], "status": r["status"], "qt_disparos": r["qt_disparos"]}
+            for r in ranking
+        ],
+        "recarga_faixas": {},
+        "recargas_por_dia": [],
+        "agregados_idade_min": None,
+        **extras,
+    }
+
+
+def carregar_resumo():
+    """KPIs, contagem por status, operadoras e ranking numa única consulta."""
+    sql = f"""
+        WITH base AS (
+            SELECT
+                {STATUS_EXPR} AS status_norm,
+                c.status,
+                NULLIF(TRIM(c.operadora), '') AS operadora,
+                c.numero,
+                COALESCE(c.qt_disparos, 0) AS qt_disparos,
+                COALESCE(c.total_gasto, 0) AS total_gasto
+            FROM `{PROJECT_ID}.{DATASET}.vw_chips_painel_base` c
+        )
+        SELECT 'status' AS secao, status_norm AS chave, COUNT(*) AS qtd,
+               CAST(NULL AS STRING) AS numero, CAST(NULL AS STRING) AS status, CAST(NULL AS INT64) AS qt_disparos,
+               CAST(NULL AS FLOAT64) AS total_gasto
+        FROM base
+        GROUP BY status_norm
+
+        UNION ALL
+        SELECT 'operadora', operadora, COUNT(*), NULL, NULL, NULL, SUM(total_gasto)
+        FROM base
+        WHERE operadora IS NOT NULL
+        GROUP BY operadora
+
+        UNION ALL
+        SELECT 'ranking', CAST(pos AS STRING), NULL, numero, status, qt_disparos, NULL
+        FROM (
+            SELECT numero, status, qt_disparos,
+                   ROW_NUMBER() OVER (ORDER BY qt_disparos DESC, numero) AS pos
+            FROM base
+        )
+        WHERE pos <= 10
+    """
+
+    status_counts_raw, operadoras, ranking = {}, [], []
+    for r in bq.run_rows(sql, cache=True, fallback=sobre_dim_chip(sql)):
+        if r["secao"] == "status":
+            status_counts_raw[r["chave"]] = int(r["qtd"] or 0)
+        elif r["secao"] == "operadora":
+            operadoras.append({"operadora": r["chave"], "qtd": int(r["qtd"] or 0), "total_gasto": float(r["total_gasto"] or 0)})
+        else:
+            ranking.append(r)
+
+    ranking.sort(key=lambda r: int(r["chave"]))
+    return montar_resumo(status_counts_raw, operadoras, ranking)
+
+
+def carregar_resumo_agregado():
+    """Mesmo resumo lido só das tabelas agg_* (sql/rollups), mais faixas de recarga e recargas por dia.
+
+    None quando os agregados ainda não existem ou estão mais velhos que
+    ROLLUP_MAX_STALENESS_SEC (o dashboard volta para carregar_resumo).
+    """
+    sql = f"""
+        SELECT 'atual' AS secao, dimensao, chave, qtd, total_gasto,
+               CAST(NULL AS STRING) AS numero, CAST(NULL AS STRING) AS status, CAST(NULL AS INT64) AS qt_disparos
+        FROM {rollups.table("agg_chip_atual")}
+        WHERE dimensao IN ('status', 'operadora', 'recarga')
+
+        UNION ALL
+        SELECT 'ranking', NULL, CAST(pos AS STRING), NULL, NULL, numero, status, qt_disparos
+        FROM {rollups.table("agg_ranking_disparos")}
+
+        UNION ALL
+        SELECT 'recargas', NULL, CAST(dia AS STRING), qtd, NULL, NULL, NULL, NULL
+        FROM {rollups.table("agg_evento_dia")}
+        WHERE tipo_evento = 'RECARGA'
+          AND dia >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+
+        UNION ALL
+        SELECT 'watermark', NULL, NULL, TIMESTAMP_DIFF(CURRENT_TIMESTAMP(), atualizado_em, SECOND), NULL, NULL, NULL, NULL
+        FROM {rollups.table("agg_watermark")}
+        WHERE rollup = 'chips'
+    """
+
+    status_counts_raw, operadoras, ranking, recargas = {}, [], [], []
+    faixas = {nome: 0 for nome, _ in FAIXAS_RECARGA}
+    faixas["Nunca recarregado"] = 0
+    idade_s = None
+    hoje = date.today()
+
+    for r in bq.run_rows(sql, cache=True, null=None):
+        secao, qtd = r["secao"], int(r["qtd"] or 0)
+        if secao == "watermark":
+            idade_s = qtd
+        elif secao == "ranking":
+            ranking.append(r)
+        elif secao == "recargas":
+            recargas.append({"dia": r["chave"], "qtd": qtd})
+        elif r["dimensao"] == "status":
+            status_counts_raw[r["chave"]] = qtd
+        elif r["dimensao"] == "operadora":
+            operadoras.append({"operadora": r["chave"], "qtd": qtd, "total_gasto": float(r["total_gasto"] or 0)})
+        elif r["chave"] == "NUNCA":
+            faixas["Nunca recarregado"] += qtd
+        else:
+            dias = (hoje - date.fromisoformat(r["chave"])).days
+            faixa = next(nome for nome, limite in FAIXAS_RECARGA if limite is None or dias <= limite)
+            faixas[faixa] += qtd
+
+    if idade_s is None or idade_s > MAX_STALENESS_SEC:
+        return None
+
+    ranking.sort(key=lambda r: int(r["chave"]))
+    recargas.sort(key=lambda r: r["dia"])
+    return montar_resumo(
+        status_counts_raw, operadoras, ranking,
+        recarga_faixas=faixas,
+        recargas_por_dia=recargas,
+        qtd_alerta=faixas[f"+{ALERTA_DIAS} dias"],
+        agregados_idade_min=idade_s // 60,
+    )
+
+
+# ===========================================================
+# SERVIÇO DE DADOS — TABELA DETALHADA (PAGINADA)
+# ===========================================================
+def carregar_tabela(page=1, per_page=50, status=None, busca=None):
+    where, params = ["1=1"], []
+    if status:
+        where.append(f"{STATUS_EXPR} = @status")
+        params.append(bigquery.ScalarQueryParameter("status", "STRING", status.strip().upper()))
+    if busca:
+        where.append("""LOWER(CONCAT(
+            COALESCE(c.numero, ''), ' ', COALESCE(c.operadora, ''), ' ', COALESCE(c.plano, ''), ' ',
+            COALESCE(c.status, ''), ' ', COALESCE(a.marca, ''), ' ', COALESCE(a.modelo, '')
+        )) LIKE @busca""")
+        params.append(bigquery.ScalarQueryParameter("busca", "STRING", f"%{busca.strip().lower()}%"))
 
-    # ===========================================================
-    # QUERY PRINCIPAL — CONTRATO 100% COMPATÍVEL COM O HTML
-    # ===========================================================
     sql = f"""
         SELECT
             c.numero,
@@ -30,98 +222,55 @@ def dashboard():
             c.plano,
             c.status,
             c.ultima_recarga_data,
-            c.qt_disparos,
 
             -- CAMPOS QUE O HTML ESPERA
             a.marca  AS marca_aparelho,
-            a.modelo AS modelo_aparelho
+            a.modelo AS modelo_aparelho,
+
+            COUNT(*) OVER() AS total_count
 
         FROM `{PROJECT_ID}.{DATASET}.vw_chips_painel_base` c
         LEFT JOIN `{PROJECT_ID}.{DATASET}.dim_aparelho` a
             ON a.sk_aparelho = c.sk_aparelho_atual
+        WHERE {' AND '.join(where)}
         ORDER BY c.numero
+        LIMIT @limit OFFSET @offset
     """
-
-    df = sanitize_df(bq.run_df(sql))
-    tabela = df.to_dict(orient="records")
-
-    # ===========================================================
-    # KPIs
-    # ===========================================================
-    total_chips = len(tabela)
-
-    chips_ativos = sum(
-        1 for x in tabela
-        if (x.get("status") or "").strip().upper() == "ATIVO"
-    )
-
-    disparando = sum(
-        1 for x in tabela
-        if (x.get("status") or "").strip().upper() == "DISPARANDO"
-    )
-
-    banidos = sum(
-        1 for x in tabela
-        if (x.get("status") or "").strip().upper() == "BANIDO"
-    )
-
-    # ===========================================================
-    # CONTAGEM POR STATUS (SUBSTITUI GRÁFICOS)
-    # ===========================================================
-    status_counts_raw = Counter(
-        (x.get("status") or "SEM STATUS").strip().upper()
-        for x in tabela
-    )
-
-    # Ordem "inteligente" (você pode ajustar como quiser)
-    status_order = [
-        "ATIVO",
-        "DISPARANDO",
-        "MATURANDO",
-        "DISPONIVEL",
-        "DISPONÍVEL",
-        "RESTRINGIDO",
-        "BANIDO",
-        "CANCELADO",
-        "INATIVO",
-        "SEM STATUS",
+    params += [
+        bigquery.ScalarQueryParameter("limit", "INT64", per_page),
+        bigquery.ScalarQueryParameter("offset", "INT64", (page - 1) * per_page),
     ]
 
-    # Monta dict final respeitando a ordem definida e depois adiciona os "extras"
-    status_counts = {}
+    rows = bq.run_rows(sql, params=params, cache=True, fallback=sobre_dim_chip(sql))
+    total = int(rows[0]["total_count"]) if rows else 0
+    for r in rows:
+        r.pop("total_count", None)
+    return {"rows": rows, "total": total, "page": page, "per_page": per_page}
 
-    # 1) Primeiro, os da ordem (se existirem)
-    for st in status_order:
-        if st in status_counts_raw:
-            status_counts[st] = int(status_counts_raw[st])
 
-    # 2) Depois, qualquer outro status que apareça no banco (não previsto na ordem)
-    extras = sorted(
-        [k for k in status_counts_raw.keys() if k not in status_counts],
-        key=lambda s: (-status_counts_raw[s], s)
-    )
-
-    for st in extras:
-        status_counts[st] = int(status_counts_raw[st])
+@bp_dashboard.route("/")
+@bp_dashboard.route("/dashboard")
+def dashboard():
 
-    # ===========================================================
-    # FILTROS
-    # ===========================================================
-    lista_status = sorted({
-        (x.get("status") or "").strip().upper()
-        for x in tabela
-        if (x.get("status") or "").strip()
-    })
-
-    lista_operadora = sorted({
-        (x.get("operadora") or "").strip()
-        for x in tabela
-        if (x.get("operadora") or "").strip()
-    })
+    # agregados velhos → refresh em segundo plano (esta página não espera)
+    rollups.ensure_fresh()
 
     # ===========================================================
     # ALERTAS — > 80 DIAS SEM RECARGA
     # ===========================================================
+    alerta_agregado_sql = f"""
+        SELECT
+            numero,
+            status,
+            operadora,
+            ultima_recarga_data,
+            DATE_DIFF(CURRENT_DATE(), ultima_recarga_data, DAY) AS dias_sem_recarga
+        FROM {rollups.table("agg_chip_estado")}
+        WHERE ultima_recarga_data < DATE_SUB(CURRENT_DATE(), INTERVAL {ALERTA_DIAS} DAY)
+        ORDER BY ultima_recarga_data, numero
+        LIMIT {ALERTA_LIMITE}
+    """
+
     alerta_sql = f"""
         SELECT
             c.numero,
@@ -139,53 +288,63 @@ def dashboard():
                 CURRENT_DATE(),
                 DATE(c.ultima_recarga_data),
                 DAY
-          ) > 80
+          ) > {ALERTA_DIAS}
         ORDER BY dias_sem_recarga DESC
     """
 
-    alerta_df = sanitize_df(bq.run_df(alerta_sql))
-    alerta_recarga = alerta_df.to_dict(orient="records")
+    # resumo e alertas são independentes → executam em paralelo;
+    # dos agregados quando estão em dia, senão direto da view
+    resumo = None
+    if rollups.enabled:
+        try:
+            results = bq.gather({
+                "resumo": carregar_resumo_agregado,
+                "alerta": lambda: bq.run_rows(alerta_agregado_sql, cache=True),
+            })
+            resumo, alerta_recarga = results["resumo"], results["alerta"]
+        except Exception as e:
+            print("⚠️ Agregados do dashboard indisponíveis, usando consulta direta:", e)
+
+    if resumo is None:
+        results = bq.gather({
+            "resumo": carregar_resumo,
+            "alerta": lambda: bq.run_rows(alerta_sql, cache=True, fallback=sobre_dim_chip(alerta_sql)),
+        })
+        resumo = results["resumo"]
+        alerta_recarga = results["alerta"]
+        resumo["qtd_alerta"] = len(alerta_recarga)
 
-    # ===========================================================
-    # RANKING — TOP 10 CHIPS POR QUANTIDADE DE DISPAROS
-    # ===========================================================
-
-    ranking_disparos = sorted(
-        tabela,
-        key=lambda x: int(x.get("qt_disparos") or 0),
-        reverse=True
-    )[:10]
-    
     # ===========================================================
     # RENDER
     # ===========================================================
     return render_template(
         "dashboard.html",
 
-        tabela=tabela,
-
-        total_chips=total_chips,
-        chips_ativos=chips_ativos,
-        disparando=disparando,
-        banidos=banidos,
-
-        # filtros
-        lista_status=lista_status,
-        lista_operadora=lista_operadora,
+        **resumo,
 
         # alertas
         alerta_recarga=alerta_recarga,
-        qtd_alerta=len(alerta_recarga),
-
-        # NOVO: cards numéricos por status
-        status_counts=status_counts,
-        status_order=status_order,
 
-        ranking_disparos=ranking_disparos,
+        status_order=STATUS_ORDER,
     )
 
 
-
-
-
-
+# ===========================================================
+# TABELA COMPLETA — BUSCA PAGINADA (JSON)
+# ===========================================================
+@bp_dashboard.route("/dashboard/tabela")
+def dashboard_tabela():
+    try:
+        page = max(request.args.get("page", 1, type=int) or 1, 1)
+        per_page = min(max(request.args.get("per_page", 50, type=int) or 50, 10), 200)
+        return jsonify(carregar_tabela(
+            page=page,
+            per_page=per_page,
+            status=request.args.get("status") or None,
+            busca=request.args.get("q") or None,
+        ))
+    except QueryBudgetExceeded as e:
+        return jsonify({"rows": [], "total": 0, "error": f"{e} Refine a busca."}), 400
+    except Exception as e:
+        print("🚨 Erro ao carregar tabela do dashboard:", e)
+        return jsonify({"rows": [], "total": 0, "error": "Erro ao carregar tabela"}), 500
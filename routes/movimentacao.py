@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from flask import Blueprint, render_template, request, jsonify
-from utils.bigquery_client import BigQueryClient
-from utils.sanitizer import sanitize_df
+from utils.bigquery_client import get_bq
+from utils.number_index import get_number_index
 from google.cloud import bigquery
 
 mov_bp = Blueprint("movimentacao", __name__)
-bq = BigQueryClient()
+bq = get_bq()
+numero_index = get_number_index()
 
 
 # ============================================================
@@ -15,13 +16,14 @@ bq = BigQueryClient()
 @mov_bp.route("/movimentacao")
 def movimentacao_home():
     try:
-        chips_df = sanitize_df(
-            bq.get_view("vw_chips_painel")
-        )
+        chips = bq.run_rows(f"""
+            SELECT *
+            FROM `{bq.project}.{bq.dataset}.vw_chips_painel`
+        """, cache=True)
 
         return render_template(
             "movimentacao.html",
-            chips=chips_df.to_dict(orient="records")
+            chips=chips
         )
 
     except Exception as e:
@@ -40,19 +42,8 @@ def buscar_chip():
         if len(termo) < 2:
             return jsonify([])
 
-        df = sanitize_df(
-            bq.get_view("vw_chips_painel")
-        )
-
-        filtrado = df[
-            df["numero"].astype(str).str.contains(termo, case=False, na=False)
-        ]
-
-        return jsonify(
-            filtrado[["sk_chip", "numero", "operadora"]]
-            .drop_duplicates()
-            .to_dict(orient="records")
-        )
+        limite = min(max(request.args.get("limit", 20, type=int), 1), 100)
+        return jsonify(numero_index.search(termo, limit=limite))
 
     except Exception as e:
         print("🚨 Erro no autocomplete:", e)
@@ -82,18 +73,14 @@ def historico_chip(sk_chip):
             ORDER BY data_evento DESC
         """
 
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter(
-                    "sk_chip", "INT64", sk_chip
-                ),
-                bigquery.ScalarQueryParameter(
-                    "origem", "STRING", "Painel"
-                )
-            ]
-        )
-
-        rows = bq.client.query(sql, job_config=job_config).result()
+        rows = bq.run(sql, params=[
+            bigquery.ScalarQueryParameter(
+                "sk_chip", "INT64", sk_chip
+            ),
+            bigquery.ScalarQueryParameter(
+                "origem", "STRING", "Painel"
+            )
+        ])
 
         eventos = []
         for r in rows:
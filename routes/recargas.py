@@ -1,10 +1,10 @@
 from flask import Blueprint, jsonify, render_template, request
 
-from utils.bigquery_client import BigQueryClient
-from utils.sanitizer import sanitize_df
+from utils.bigquery_client import get_bq
+from utils.streaming import stream_rows
 
 recargas_bp = Blueprint("recargas", __name__)
-bq = BigQueryClient()
+bq = get_bq()
 
 
 @recargas_bp.route("/recargas")
@@ -12,13 +12,17 @@ def recargas_page():
     return render_template("recargas.html")
 
 
+def _formato():
+    return "ndjson" if request.args.get("format") == "ndjson" else "json"
+
+
 @recargas_bp.route("/api/chips/listar")
 def listar_chips():
-    df = sanitize_df(bq.get_view("vw_chips_painel"))
-    cols = [c for c in ["sk_chip", "numero", "operadora"] if c in df.columns]
-    if not cols:
-        return jsonify([])
-    return jsonify(df[cols].drop_duplicates().to_dict(orient="records"))
+    rows = bq.iter_rows(f"""
+        SELECT DISTINCT sk_chip, numero, operadora
+        FROM `{bq.project}.{bq.dataset}.vw_chips_painel`
+    """)
+    return stream_rows(rows, _formato())
 
 
 @recargas_bp.route("/api/recargas/listar")
@@ -36,8 +40,7 @@ def listar_recargas():
         WHERE ultima_recarga_data IS NOT NULL
         ORDER BY ultima_recarga_data DESC
     """
-    df = sanitize_df(bq.run_df(sql))
-    return jsonify(df.to_dict(orient="records"))
+    return stream_rows(bq.iter_rows(sql), _formato())
 
 
 @recargas_bp.route("/api/recargas/salvar", methods=["POST"])
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 
 from flask import Blueprint, render_template, request, jsonify
-from utils.bigquery_client import BigQueryClient
-from utils.sanitizer import sanitize_df
+from utils.bigquery_client import get_bq
+from utils.slot_map import get_slot_map
 
 relacionamentos_bp = Blueprint("relacionamentos", __name__)
-bq = BigQueryClient()
+bq = get_bq()
+slots = get_slot_map()
 
 PROJECT = bq.project
 DATASET = bq.dataset
@@ -26,12 +27,68 @@ def to_int(v):
         return None
 
 
-def is_null(v):
-    return (
-        v is None
-        or str(v).strip() == ""
-        or str(v).strip().lower() in ["none", "null", "nan"]
-    )
+def _slots_sql():
+    """Grade de slots pronta por aparelho, montada no BigQuery em uma passada.
+
+    Capacidade (business + normal) gera os slots com GENERATE_ARRAY; a
+    ocupação entra por LEFT JOIN (aparelho, slot). Cada linha já vem com
+    slots = [{slot, chip}] ordenado, chip NULL quando livre e tipo padrão
+    BUSINESS para os primeiros cap_whats_business slots.
+    """
+    return f"""
+        WITH base AS (
+            SELECT
+                SAFE_CAST(sk_aparelho AS INT64) AS sk_aparelho,
+                SAFE_CAST(sk_chip AS INT64) AS sk_chip,
+                SAFE_CAST(slot_whatsapp AS INT64) AS slot,
+                marca, modelo, numero, operadora,
+                IF(LOWER(TRIM(COALESCE(CAST(tipo_whatsapp AS STRING), ''))) IN ('', 'none', 'null', 'nan'), NULL, CAST(tipo_whatsapp AS STRING)) AS tipo_whatsapp,
+                SAFE_CAST(cap_whats_business AS INT64) AS cap_bus,
+                SAFE_CAST(cap_whats_normal AS INT64) AS cap_norm
+            FROM `{PROJECT}.{DATASET}.vw_relacionamentos_whatsapp`
+        ),
+        aparelhos AS (
+            SELECT
+                sk_aparelho,
+                ANY_VALUE(marca) AS marca,
+                ANY_VALUE(modelo) AS modelo,
+                COALESCE(MAX(cap_bus), 0) AS cap_bus,
+                COALESCE(MAX(cap_norm), 0) AS cap_norm
+            FROM base
+            WHERE sk_aparelho IS NOT NULL AND sk_aparelho != 0
+            GROUP BY sk_aparelho
+        ),
+        ocupados AS (
+            SELECT sk_aparelho, slot, ANY_VALUE(STRUCT(sk_chip, numero, operadora, tipo_whatsapp)) AS chip
+            FROM base
+            WHERE sk_chip IS NOT NULL AND sk_chip != 0 AND slot IS NOT NULL AND slot != 0
+            GROUP BY sk_aparelho, slot
+        )
+        SELECT
+            a.sk_aparelho,
+            ANY_VALUE(a.marca) AS marca,
+            ANY_VALUE(a.modelo) AS modelo,
+            ANY_VALUE(a.cap_bus) AS cap_whats_business,
+            ANY_VALUE(a.cap_norm) AS cap_whats_normal,
+            ANY_VALUE(a.cap_bus + a.cap_norm) AS capacidade_total,
+            ARRAY_AGG(
+                IF(s IS NULL, NULL, STRUCT(
+                    s AS slot,
+                    IF(o.chip IS NULL, NULL, STRUCT(
+                        o.chip.sk_chip AS sk_chip,
+                        o.chip.numero AS numero,
+                        o.chip.operadora AS operadora,
+                        COALESCE(o.chip.tipo_whatsapp, IF(s <= a.cap_bus, 'BUSINESS', 'NORMAL')) AS tipo_whatsapp
+                    )) AS chip
+                ))
+                IGNORE NULLS ORDER BY s
+            ) AS slots
+        FROM aparelhos a
+        LEFT JOIN UNNEST(GENERATE_ARRAY(1, a.cap_bus + a.cap_norm)) AS s
+        LEFT JOIN ocupados o ON o.sk_aparelho = a.sk_aparelho AND o.slot = s
+        GROUP BY a.sk_aparelho
+        ORDER BY a.sk_aparelho
+    """
 
 
 # ============================================================
@@ -40,121 +97,30 @@ def is_null(v):
 @relacionamentos_bp.route("/relacionamentos")
 def relacionamentos_home():
     try:
-        # ====================================================
-        # 1) VIEW RELACIONAMENTOS
-        # ====================================================
-        df = sanitize_df(
-            bq.run_df(f"""
-                SELECT *
-                FROM `{PROJECT}.{DATASET}.vw_relacionamentos_whatsapp`
-            """)
-        )
-
-        # ====================================================
-        # 2) CHIPS LIVRES
-        # ====================================================
-        chips_livres_df = bq.run_df(f"""
-            SELECT
-                sk_chip,
-                numero,
-                operadora,
-                tipo_whatsapp
-            FROM `{PROJECT}.{DATASET}.dim_chip`
-            WHERE ativo = TRUE
-              AND sk_aparelho_atual IS NULL
-            ORDER BY numero
-        """)
-
-        chips_livres = []
-        if not chips_livres_df.empty:
-            for _, r in chips_livres_df.iterrows():
-                chips_livres.append({
-                    "sk_chip": to_int(r["sk_chip"]),
-                    "numero": r["numero"],
-                    "operadora": r["operadora"],
-                    "tipo_whatsapp": r.get("tipo_whatsapp") or "A DEFINIR",
-                })
-
-        # ====================================================
-        # SE NÃO EXISTIR APARELHO
-        # ====================================================
-        if df.empty:
-            return render_template(
-                "relacionamentos.html",
-                aparelhos=[],
-                chips_livres=chips_livres
-            )
-
-        # ====================================================
-        # 3) AGRUPAR POR APARELHO
-        # ====================================================
-        aparelhos = []
-
-        for sk_aparelho, g in df.groupby("sk_aparelho"):
-            sk_aparelho = to_int(sk_aparelho)
-            if not sk_aparelho:
-                continue
-
-            marca = g["marca"].iloc[0]
-            modelo = g["modelo"].iloc[0]
-
-            cap_bus = (
-                to_int(g["cap_whats_business"].iloc[0])
-                if "cap_whats_business" in g.columns
-                else 0
-            )
-
-            cap_norm = (
-                to_int(g["cap_whats_normal"].iloc[0])
-                if "cap_whats_normal" in g.columns
-                else 0
-            )
-
-            capacidade_total = cap_bus + cap_norm
-
-            # ------------------------------------------------
-            # CRIA TODOS OS SLOTS VAZIOS
-            # ------------------------------------------------
-            slots = {i: None for i in range(1, capacidade_total + 1)}
-
-            # ------------------------------------------------
-            # PREENCHE SLOTS OCUPADOS
-            # ------------------------------------------------
-            for _, r in g.iterrows():
-                sk_chip = to_int(r.get("sk_chip"))
-                slot = to_int(r.get("slot_whatsapp"))
-
-                if not sk_chip or not slot or slot not in slots:
-                    continue
-
-                tipo = r.get("tipo_whatsapp")
-                if is_null(tipo):
-                    tipo = "BUSINESS" if slot <= cap_bus else "NORMAL"
-
-                slots[slot] = {
-                    "sk_chip": sk_chip,
-                    "numero": r.get("numero"),
-                    "operadora": r.get("operadora"),
-                    "tipo_whatsapp": tipo,
-                }
-
-            aparelhos.append({
-                "sk_aparelho": sk_aparelho,
-                "marca": marca,
-                "modelo": modelo,
-                "capacidade_total": capacidade_total,
-                "cap_whats_business": cap_bus,
-                "cap_whats_normal": cap_norm,
-                "slots": [
-                    {"slot": s, "chip": slots[s]}
-                    for s in range(1, capacidade_total + 1)
-                ],
-            })
+        # grade de slots e chips livres em paralelo, as duas já no formato do template
+        results = bq.gather({
+            "aparelhos": lambda: bq.run_rows(_slots_sql(), null=None),
+            "chips_livres": lambda: bq.run_rows(f"""
+                SELECT
+                    sk_chip,
+                    numero,
+                    operadora,
+                    COALESCE(tipo_whatsapp, 'A DEFINIR') AS tipo_whatsapp
+                FROM `{PROJECT}.{DATASET}.dim_chip`
+                WHERE ativo = TRUE
+                  AND sk_aparelho_atual IS NULL
+                ORDER BY numero
+            """, null=None),
+        })
+
+        aparelhos = results["aparelhos"]
+        for a in aparelhos:
+            a["slots"] = a["slots"] or []
 
         return render_template(
             "relacionamentos.html",
             aparelhos=aparelhos,
-            chips_livres=chips_livres
+            chips_livres=results["chips_livres"]
         )
 
     except Exception as e:
@@ -174,9 +140,19 @@ def relacionamentos_vincular():
         sk_aparelho = to_int(data.get("sk_aparelho"))
         slot = to_int(data.get("slot"))
 
+        # sem slot informado: primeiro livre do tipo pedido
+        if sk_aparelho and not slot and data.get("tipo"):
+            slot = slots.next_free(sk_aparelho, data.get("tipo"))
+
         if not sk_chip or not sk_aparelho or not slot:
             return jsonify({"ok": False, "error": "Dados inválidos"}), 400
 
+        conflito = slots.check(sk_aparelho, slot, sk_chip)
+        if conflito and conflito[0] == "slot_taken":
+            return jsonify({"ok": False, "error": f"Slot {slot} já ocupado (SK {conflito[1]})"}), 409
+        if conflito:
+            return jsonify({"ok": False, "error": f"Slot {slot} fora da capacidade do aparelho"}), 400
+
         bq.run(f"""
             CALL `{PROJECT}.{DATASET}.sp_vincular_aparelho_chip`(
                 {sk_chip},
@@ -186,8 +162,9 @@ def relacionamentos_vincular():
                 'Vínculo WhatsApp'
             )
         """)
+        slots.occupy(sk_aparelho, slot, sk_chip)
 
-        return jsonify({"ok": True})
+        return jsonify({"ok": True, "slot": slot})
 
     except Exception as e:
         print("🚨 ERRO VINCULAR:", e)
@@ -213,9 +190,22 @@ def relacionamentos_desvincular():
                 'Desvinculação de aparelho'
             )
         """)
+        slots.release(sk_chip)
 
         return jsonify({"ok": True})
 
     except Exception as e:
         print("🚨 ERRO DESVINCULAR:", e)
         return jsonify({"ok": False, "error": str(e)}), 500
+
+
+# ============================================================
+# PRÓXIMO SLOT LIVRE (MAPA EM MEMÓRIA, SEM JOB)
+# ============================================================
+@relacionamentos_bp.route("/relacionamentos/proximo-slot")
+def relacionamentos_proximo_slot():
+    sk_aparelho = to_int(request.args.get("sk_aparelho"))
+    if not sk_aparelho:
+        return jsonify({"ok": False, "error": "sk_aparelho inválido"}), 400
+    slot = slots.next_free(sk_aparelho, request.args.get("tipo"))
+    return jsonify({"ok": slot is not None, "slot": slot})
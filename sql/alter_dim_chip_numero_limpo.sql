@@ -0,0 +1,9 @@
+ALTER TABLE `painel-universidade.marts.dim_chip`
+ADD COLUMN IF NOT EXISTS numero_limpo STRING;
+
+UPDATE `painel-universidade.marts.dim_chip`
+SET numero_limpo = REGEXP_REPLACE(numero, r'[^0-9]', '')
+WHERE numero_limpo IS NULL OR numero_limpo != REGEXP_REPLACE(numero, r'[^0-9]', '');
+
+-- cluster por numero_limpo para o lookup de duplicado podar blocos:
+-- bq update --clustering_fields=numero_limpo painel-universidade:marts.dim_chip
@@ -0,0 +1,96 @@
+-- Formato das tabelas/views do marts para o motor local (DuckDB).
+-- Usado pelo BQ_BACKEND=local e pelo benchmark de rotas; no BigQuery valem os objetos reais.
+
+CREATE TABLE IF NOT EXISTS dim_aparelho (
+    sk_aparelho BIGINT,
+    id_aparelho VARCHAR,
+    marca VARCHAR,
+    modelo VARCHAR,
+    imei VARCHAR,
+    status VARCHAR,
+    cap_whats_business BIGINT,
+    cap_whats_normal BIGINT,
+    ativo BOOLEAN,
+    created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS dim_chip (
+    sk_chip BIGINT,
+    id_chip VARCHAR,
+    numero VARCHAR,
+    numero_limpo VARCHAR,
+    operadora VARCHAR,
+    plano VARCHAR,
+    status VARCHAR,
+    operador VARCHAR,
+    observacao VARCHAR,
+    origem VARCHAR,
+    tipo_whatsapp VARCHAR,
+    slot_whatsapp BIGINT,
+    sk_aparelho_atual BIGINT,
+    ultima_recarga_valor DOUBLE,
+    ultima_recarga_data DATE,
+    total_gasto DOUBLE,
+    qt_disparos BIGINT,
+    qt_banimentos BIGINT,
+    dt_banimentos DATE,
+    data_status DATE,
+    dt_inicio DATE,
+    maturando_em TIMESTAMPTZ,
+    ativo BOOLEAN,
+    created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS f_chip_evento (
+    sk_chip BIGINT,
+    tipo_evento VARCHAR,
+    origem VARCHAR,
+    observacao VARCHAR,
+    created_at TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS f_chip_aparelho (
+    sk_chip BIGINT,
+    sk_aparelho BIGINT,
+    slot_whatsapp BIGINT,
+    origem VARCHAR,
+    observacao VARCHAR,
+    dt_inicio TIMESTAMPTZ,
+    dt_fim TIMESTAMPTZ
+);
+
+CREATE OR REPLACE VIEW vw_chips_painel_base AS
+SELECT * FROM dim_chip;
+
+CREATE OR REPLACE VIEW vw_chips_painel AS
+SELECT c.*, a.marca AS aparelho_marca, a.modelo AS aparelho_modelo
+FROM dim_chip c
+LEFT JOIN dim_aparelho a ON a.sk_aparelho = c.sk_aparelho_atual;
+
+CREATE OR REPLACE VIEW vw_relacionamentos_whatsapp AS
+SELECT
+    a.sk_aparelho, a.marca, a.modelo, a.cap_whats_business, a.cap_whats_normal,
+    c.sk_chip, c.numero, c.operadora, c.tipo_whatsapp, c.slot_whatsapp
+FROM dim_aparelho a
+LEFT JOIN dim_chip c ON c.sk_aparelho_atual = a.sk_aparelho AND COALESCE(c.ativo, TRUE);
+
+CREATE OR REPLACE VIEW vw_aparelhos AS
+SELECT a.*, COUNT(c.sk_chip) AS qtd_chips
+FROM dim_aparelho a
+LEFT JOIN dim_chip c ON c.sk_aparelho_atual = a.sk_aparelho AND COALESCE(c.ativo, TRUE)
+GROUP BY ALL;
+
+CREATE OR REPLACE VIEW vw_chip_timeline AS
+SELECT
+    sk_chip,
+    'EVENTO' AS categoria,
+    tipo_evento AS tipo,
+    CAST(NULL AS VARCHAR) AS valor_antigo,
+    CAST(NULL AS VARCHAR) AS valor_novo,
+    origem,
+    observacao,
+    created_at AS data_evento,
+    strftime(created_at, '%d/%m/%Y %H:%M') AS data_fmt
+FROM f_chip_evento;
@@ -0,0 +1,60 @@
+-- Tabelas de agregados lidas pelo dashboard (mantidas por refresh_chips.sql e refresh_eventos.sql).
+-- utils/rollups.py roda este arquivo antes do primeiro refresh, com o projeto/dataset configurados.
+
+-- estado de cada chip na última vez que entrou nos agregados (base do delta)
+CREATE TABLE IF NOT EXISTS `painel-universidade.marts.agg_chip_estado` (
+    sk_chip INT64,
+    numero STRING,
+    status STRING,
+    operadora STRING,
+    sk_aparelho INT64,
+    ultima_recarga_data DATE,
+    total_gasto FLOAT64,
+    qt_disparos INT64,
+    ativo BOOL,
+    updated_at TIMESTAMP
+)
+CLUSTER BY ultima_recarga_data;
+
+-- contagens atuais por dimensão: status, operadora, aparelho e recarga (chave = data da última recarga ou NUNCA)
+CREATE TABLE IF NOT EXISTS `painel-universidade.marts.agg_chip_atual` (
+    dimensao STRING,
+    chave STRING,
+    qtd INT64,
+    ativos INT64,
+    total_gasto FLOAT64,
+    qt_disparos INT64
+);
+
+-- foto diária de agg_chip_atual (sem a dimensão recarga)
+CREATE TABLE IF NOT EXISTS `painel-universidade.marts.agg_chip_dia` (
+    dia DATE,
+    dimensao STRING,
+    chave STRING,
+    qtd INT64,
+    ativos INT64,
+    total_gasto FLOAT64,
+    qt_disparos INT64
+)
+PARTITION BY dia;
+
+-- eventos por dia e tipo (recargas, status, vínculos...)
+CREATE TABLE IF NOT EXISTS `painel-universidade.marts.agg_evento_dia` (
+    dia DATE,
+    tipo_evento STRING,
+    qtd INT64
+)
+PARTITION BY dia;
+
+CREATE TABLE IF NOT EXISTS `painel-universidade.marts.agg_ranking_disparos` (
+    pos INT64,
+    numero STRING,
+    status STRING,
+    qt_disparos INT64
+);
+
+CREATE TABLE IF NOT EXISTS `painel-universidade.marts.agg_watermark` (
+    rollup STRING,
+    watermark TIMESTAMP,
+    atualizado_em TIMESTAMP
+);
@@ -0,0 +1,120 @@
+-- Refresh incremental dos agregados de chips (rodado por utils/rollups.py).
+-- Lê só os chips com updated_at depois do watermark (com 10 minutos de folga para
+-- escritas que ainda estavam em andamento). O delta de cada chip é o estado novo
+-- menos o guardado em agg_chip_estado, então reprocessar um chip soma zero.
+-- Entram todos os chips, inativos inclusive, como na consulta direta do dashboard;
+-- ativo vai junto e alimenta a coluna ativos.
+-- A transação faz dois refreshes simultâneos conflitarem em vez de somarem o delta duas vezes.
+
+DECLARE wm TIMESTAMP DEFAULT (
+    SELECT MAX(watermark) FROM `painel-universidade.marts.agg_watermark` WHERE rollup = 'chips'
+);
+
+BEGIN TRANSACTION;
+
+CREATE OR REPLACE TEMP TABLE chips_mudou AS
+SELECT
+    sk_chip,
+    numero,
+    COALESCE(NULLIF(UPPER(TRIM(status)), ''), 'SEM STATUS') AS status,
+    NULLIF(TRIM(operadora), '') AS operadora,
+    sk_aparelho_atual AS sk_aparelho,
+    DATE(ultima_recarga_data) AS ultima_recarga_data,
+    CAST(COALESCE(total_gasto, 0) AS FLOAT64) AS total_gasto,
+    COALESCE(qt_disparos, 0) AS qt_disparos,
+    COALESCE(ativo, TRUE) AS ativo,
+    updated_at
+FROM `painel-universidade.marts.dim_chip`
+WHERE wm IS NULL
+   OR updated_at > TIMESTAMP_SUB(wm, INTERVAL 10 MINUTE);
+
+CREATE OR REPLACE TEMP TABLE chips_delta AS
+WITH lados AS (
+    SELECT -1 AS sinal, e.status, e.operadora, e.sk_aparelho, e.ultima_recarga_data, e.total_gasto, e.qt_disparos, e.ativo
+    FROM `painel-universidade.marts.agg_chip_estado` e
+    WHERE e.sk_chip IN (SELECT sk_chip FROM chips_mudou)
+
+    UNION ALL
+    SELECT 1, m.status, m.operadora, m.sk_aparelho, m.ultima_recarga_data, m.total_gasto, m.qt_disparos, m.ativo
+    FROM chips_mudou m
+),
+linhas AS (
+    SELECT 'status' AS dimensao, status AS chave, sinal, ativo, total_gasto, qt_disparos FROM lados
+    UNION ALL
+    SELECT 'operadora', COALESCE(operadora, 'SEM OPERADORA'), sinal, ativo, total_gasto, qt_disparos FROM lados
+    UNION ALL
+    SELECT 'aparelho', COALESCE(CAST(sk_aparelho AS STRING), 'SEM APARELHO'), sinal, ativo, total_gasto, qt_disparos FROM lados
+    UNION ALL
+    SELECT 'recarga', COALESCE(CAST(ultima_recarga_data AS STRING), 'NUNCA'), sinal, ativo, total_gasto, qt_disparos FROM lados
+)
+SELECT
+    dimensao,
+    chave,
+    SUM(sinal) AS qtd,
+    SUM(IF(ativo, sinal, 0)) AS ativos,
+    SUM(sinal * total_gasto) AS total_gasto,
+    SUM(sinal * qt_disparos) AS qt_disparos
+FROM linhas
+GROUP BY dimensao, chave;
+
+MERGE `painel-universidade.marts.agg_chip_atual` T
+USING chips_delta D
+ON T.dimensao = D.dimensao AND T.chave = D.chave
+WHEN MATCHED THEN UPDATE SET
+    qtd = T.qtd + D.qtd,
+    ativos = T.ativos + D.ativos,
+    total_gasto = T.total_gasto + D.total_gasto,
+    qt_disparos = T.qt_disparos + D.qt_disparos
+WHEN NOT MATCHED THEN
+    INSERT (dimensao, chave, qtd, ativos, total_gasto, qt_disparos)
+    VALUES (D.dimensao, D.chave, D.qtd, D.ativos, D.total_gasto, D.qt_disparos);
+
+DELETE FROM `painel-universidade.marts.agg_chip_atual` WHERE qtd = 0;
+
+MERGE `painel-universidade.marts.agg_chip_estado` T
+USING chips_mudou S
+ON T.sk_chip = S.sk_chip
+WHEN MATCHED THEN UPDATE SET
+    numero = S.numero,
+    status = S.status,
+    operadora = S.operadora,
+    sk_aparelho = S.sk_aparelho,
+    ultima_recarga_data = S.ultima_recarga_data,
+    total_gasto = S.total_gasto,
+    qt_disparos = S.qt_disparos,
+    ativo = S.ativo,
+    updated_at = S.updated_at
+WHEN NOT MATCHED THEN
+    INSERT (sk_chip, numero, status, operadora, sk_aparelho, ultima_recarga_data, total_gasto, qt_disparos, ativo, updated_at)
+    VALUES (S.sk_chip, S.numero, S.status, S.operadora, S.sk_aparelho, S.ultima_recarga_data, S.total_gasto, S.qt_disparos, S.ativo, S.updated_at);
+
+-- ranking e foto do dia saem das tabelas pequenas, não de dim_chip
+DELETE FROM `painel-universidade.marts.agg_ranking_disparos` WHERE TRUE;
+
+INSERT INTO `painel-universidade.marts.agg_ranking_disparos` (pos, numero, status, qt_disparos)
+SELECT pos, numero, status, qt_disparos
+FROM (
+    SELECT numero, status, qt_disparos,
+           ROW_NUMBER() OVER (ORDER BY qt_disparos DESC, numero) AS pos
+    FROM `painel-universidade.marts.agg_chip_estado`
+)
+WHERE pos <= 10;
+
+DELETE FROM `painel-universidade.marts.agg_chip_dia` WHERE dia = CURRENT_DATE();
+
+INSERT INTO `painel-universidade.marts.agg_chip_dia` (dia, dimensao, chave, qtd, ativos, total_gasto, qt_disparos)
+SELECT CURRENT_DATE(), dimensao, chave, qtd, ativos, total_gasto, qt_disparos
+FROM `painel-universidade.marts.agg_chip_atual`
+WHERE dimensao != 'recarga';
+
+MERGE `painel-universidade.marts.agg_watermark` T
+USING (SELECT 'chips' AS rollup, (SELECT MAX(updated_at) FROM chips_mudou) AS watermark) S
+ON T.rollup = S.rollup
+WHEN MATCHED THEN UPDATE SET
+    watermark = IF(S.watermark IS NULL OR S.watermark < T.watermark, T.watermark, S.watermark),
+    atualizado_em = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED THEN
+    INSERT (rollup, watermark, atualizado_em)
+    VALUES (S.rollup, S.watermark, CURRENT_TIMESTAMP());
+
+COMMIT TRANSACTION;
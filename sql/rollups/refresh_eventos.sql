@@ -0,0 +1,33 @@
+-- Refresh incremental de agg_evento_dia (rodado por utils/rollups.py).
+-- f_chip_evento só recebe inserções: recalcula inteiros os dias a partir do watermark de
+-- created_at (com 1 hora de folga para eventos que chegam atrasados pela fila de escrita).
+
+DECLARE wm TIMESTAMP DEFAULT (
+    SELECT MAX(watermark) FROM `painel-universidade.marts.agg_watermark` WHERE rollup = 'eventos'
+);
+DECLARE desde DATE DEFAULT DATE(TIMESTAMP_SUB(COALESCE(wm, TIMESTAMP('1970-01-01')), INTERVAL 1 HOUR));
+
+BEGIN TRANSACTION;
+
+DELETE FROM `painel-universidade.marts.agg_evento_dia` WHERE dia >= desde;
+
+INSERT INTO `painel-universidade.marts.agg_evento_dia` (dia, tipo_evento, qtd)
+SELECT DATE(created_at) AS dia, COALESCE(UPPER(tipo_evento), 'SEM TIPO') AS tipo_evento, COUNT(*) AS qtd
+FROM `painel-universidade.marts.f_chip_evento`
+WHERE created_at >= CAST(desde AS TIMESTAMP)
+GROUP BY 1, 2;
+
+MERGE `painel-universidade.marts.agg_watermark` T
+USING (
+    SELECT 'eventos' AS rollup,
+           (SELECT MAX(created_at) FROM `painel-universidade.marts.f_chip_evento` WHERE created_at >= CAST(desde AS TIMESTAMP)) AS watermark
+) S
+ON T.rollup = S.rollup
+WHEN MATCHED THEN UPDATE SET
+    watermark = IF(S.watermark IS NULL OR S.watermark < T.watermark, T.watermark, S.watermark),
+    atualizado_em = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED THEN
+    INSERT (rollup, watermark, atualizado_em)
+    VALUES (S.rollup, S.watermark, CURRENT_TIMESTAMP());
+
+COMMIT TRANSACTION;
@@ -116,6 +116,45 @@ document.querySelectorAll(".open-new-chip-modal").forEach(btn => btn.addEventLis
 document.getElementById("closeNewChipModal")?.addEventListener("click", closeNewChipModal);
 document.querySelector("[data-close-new-chip]")?.addEventListener("click", closeNewChipModal);
 
+/* ============================================================
+   IMPORTAÇÃO EM LOTE (CSV/XLSX)
+============================================================ */
+function resumoImportacao(r) {
+    const linhas = [`Linhas lidas: ${r.linhas}`, `Prontos para cadastro: ${r.validos}`, `Cadastrados: ${r.inseridos}`];
+    if (r.duplicados.length) linhas.push(`Já cadastrados (${r.duplicados.length}):`, ...r.duplicados.map(d => `  linha ${d.linha}: ${d.numero} (SK ${d.sk_chip})`));
+    if (r.invalidos.length) linhas.push(`Inválidos (${r.invalidos.length}):`, ...r.invalidos.map(i => `  linha ${i.linha}: ${i.numero ?? ""} — ${i.motivo}`));
+    return linhas.join("\n");
+}
+async function enviarImportacao(simular) {
+    const form = document.getElementById("importForm");
+    const resumo = document.getElementById("importResumo");
+    if (!form.arquivo.files.length) { notify("Selecione o arquivo", "error"); return; }
+    const btn = document.getElementById(simular ? "importSimularBtn" : "importEnviarBtn");
+    const oldText = btn.innerHTML;
+    btn.disabled = true;
+    btn.innerHTML = 'Processando <span class="spinner"></span>';
+    try {
+        const res = await fetch(`/chips/import${simular ? "?simular=1" : ""}`, { method: "POST", body: new FormData(form) });
+        const r = await res.json();
+        if (!r.success) { notify(r.error || "Erro na importação", "error"); resumo.textContent = r.error || ""; return; }
+        resumo.textContent = resumoImportacao(r);
+        if (!simular && r.inseridos) { notify(`${r.inseridos} chip(s) importado(s)`, "success"); setTimeout(() => location.reload(), 1200); }
+    } catch (e) {
+        console.error("[Chips] Erro na importação", e);
+        notify("Falha de rede na importação", "error");
+    } finally {
+        btn.disabled = false; btn.innerHTML = oldText;
+    }
+}
+document.getElementById("openImportModal")?.addEventListener("click", () => {
+    document.getElementById("importForm")?.reset();
+    document.getElementById("importResumo").textContent = "";
+    showModal("importModal");
+});
+document.querySelector("[data-close-import]")?.addEventListener("click", () => hideModal("importModal"));
+document.getElementById("importSimularBtn")?.addEventListener("click", () => enviarImportacao(true));
+document.getElementById("importForm")?.addEventListener("submit", e => { e.preventDefault(); enviarImportacao(false); });
+
 /* ============================================================
    SELECTS E MODAL DE EDIÇÃO
 ============================================================ */
@@ -178,42 +217,161 @@ function renderRows(lista) {
     const tbody = document.getElementById("tableBody");
     if (!tbody) return;
     if (!lista.length) {
-        tbody.innerHTML = `<tr><td colspan="18" class="empty-message">Nenhum chip encontrado com os filtros aplicados.</td></tr>`;
+        tbody.innerHTML = `<tr><td colspan="19" class="empty-message">Nenhum chip encontrado com os filtros aplicados.</td></tr>`;
         return;
     }
-    tbody.innerHTML = lista.map(c => {
-        const status = c.status || "-";
-        const aparelho = c.aparelho_modelo ? `${escapeHtml(c.aparelho_modelo)} ${c.aparelho_marca ? '(' + escapeHtml(c.aparelho_marca) + ')' : ''}` : (c.sk_aparelho_atual ? `SK ${c.sk_aparelho_atual}` : "Sem aparelho");
-        const rowClass = String(status).toUpperCase() === "BANIDO" ? "row-danger" : (!c.sk_aparelho_atual ? "row-warning" : "");
-        return `<tr class="${rowClass}">
-            <td class="quick-actions">
-              <button class="action-btn edit-btn" title="Editar" data-sk="${c.sk_chip}"><i class="fas fa-edit"></i></button>
-              <button class="action-btn recarga-btn" title="Recarregar" data-sk="${c.sk_chip}"><i class="fas fa-bolt"></i></button>
-              <button class="action-btn banir-btn" title="Banir" data-sk="${c.sk_chip}"><i class="fas fa-ban"></i></button>
-              <button class="action-btn timeline-btn" title="Histórico" data-sk="${c.sk_chip}"><i class="fas fa-clock"></i></button>
-            </td>
-            <td>${escapeHtml(c.numero || "—")}</td>
-            <td>${escapeHtml(c.operadora || "—")}</td>
-            <td><span class="status-badge status-${String(status).toLowerCase().replace(/\s+/g, "_")}">${escapeHtml(status)}</span></td>
-            <td>${renderMaturacaoBar(c)}</td>
-            <td>${escapeHtml(c.operador || "—")}</td>
-            <td>${escapeHtml(c.plano || "—")}</td>
-            <td>${escapeHtml(c.tipo_whatsapp || "—")}${c.slot_whatsapp ? ` · Slot ${escapeHtml(c.slot_whatsapp)}` : ""}</td>
-            <td>${c.qt_disparos ?? 0}</td>
-            <td>${c.qt_banimentos ?? 0}</td>
-            <td>${formatBRDate(c.ultima_recarga_data)}<br><small>${formatBRL(c.ultima_recarga_valor)}</small></td>
-            <td>${formatBRL(c.total_gasto)}</td>
-            <td>${aparelho}</td>
-            <td>${formatBRDate(c.updated_at || c.data_status)}</td>
-            <td>${formatBRDate(c.created_at || c.dt_inicio)}</td>
-            <td class="obs-cell" title="${escapeHtml(c.observacao || '')}">${c.observacao ? escapeHtml(c.observacao) : '—'}</td>
-            <td>${escapeHtml(c.id_chip || "—")}</td>
-            <td>${c.sk_chip ?? "—"}</td>
-        </tr>`;
-    }).join("");
+    tbody.innerHTML = lista.map(renderRow).join("");
+    bindRowActions();
+}
+function renderRow(c) {
+    const status = c.status || "-";
+    const aparelho = c.aparelho_modelo ? `${escapeHtml(c.aparelho_modelo)} ${c.aparelho_marca ? '(' + escapeHtml(c.aparelho_marca) + ')' : ''}` : (c.sk_aparelho_atual ? `SK ${c.sk_aparelho_atual}` : "Sem aparelho");
+    const rowClass = String(status).toUpperCase() === "BANIDO" ? "row-danger" : (!c.sk_aparelho_atual ? "row-warning" : "");
+    return `<tr class="${rowClass}" data-sk="${c.sk_chip}">
+        <td><input type="checkbox" class="chip-select" value="${c.sk_chip}" ${SELECTED.has(Number(c.sk_chip)) ? "checked" : ""}></td>
+        <td class="quick-actions">
+          <button class="action-btn edit-btn" title="Editar" data-sk="${c.sk_chip}"><i class="fas fa-edit"></i></button>
+          <button class="action-btn recarga-btn" title="Recarregar" data-sk="${c.sk_chip}"><i class="fas fa-bolt"></i></button>
+          <button class="action-btn banir-btn" title="Banir" data-sk="${c.sk_chip}"><i class="fas fa-ban"></i></button>
+          <button class="action-btn timeline-btn" title="Histórico" data-sk="${c.sk_chip}"><i class="fas fa-clock"></i></button>
+        </td>
+        <td>${escapeHtml(c.numero || "—")}</td>
+        <td>${escapeHtml(c.operadora || "—")}</td>
+        <td><span class="status-badge status-${String(status).toLowerCase().replace(/\s+/g, "_")}">${escapeHtml(status)}</span></td>
+        <td>${renderMaturacaoBar(c)}</td>
+        <td>${escapeHtml(c.operador || "—")}</td>
+        <td>${escapeHtml(c.plano || "—")}</td>
+        <td>${escapeHtml(c.tipo_whatsapp || "—")}${c.slot_whatsapp ? ` · Slot ${escapeHtml(c.slot_whatsapp)}` : ""}</td>
+        <td>${c.qt_disparos ?? 0}</td>
+        <td>${c.qt_banimentos ?? 0}</td>
+        <td>${formatBRDate(c.ultima_recarga_data)}<br><small>${formatBRL(c.ultima_recarga_valor)}</small></td>
+        <td>${formatBRL(c.total_gasto)}</td>
+        <td>${aparelho}</td>
+        <td>${formatBRDate(c.updated_at || c.data_status)}</td>
+        <td>${formatBRDate(c.created_at || c.dt_inicio)}</td>
+        <td class="obs-cell" title="${escapeHtml(c.observacao || '')}">${c.observacao ? escapeHtml(c.observacao) : '—'}</td>
+        <td>${escapeHtml(c.id_chip || "—")}</td>
+        <td>${c.sk_chip ?? "—"}</td>
+    </tr>`;
+}
+function bindRowActions() {
     bindEditButtons();
     bindQuickActions();
+    bindSelection();
+}
+
+/* ============================================================
+   DELTA SYNC — SÓ O QUE MUDOU DESDE O ÚLTIMO WATERMARK
+============================================================ */
+const CHANGES_POLL_MS = 30000;
+let changesSince = window.chipsWatermark || null;
+let sincronizando = false;
+let sincronizarDeNovo = false;
+
+function aplicarAlteracoes(chips, removidos) {
+    const porSk = new Map(chips.map(c => [Number(c.sk_chip), c]));
+    const fora = new Set(removidos.map(Number));
+    for (let i = ALL_CHIPS.length - 1; i >= 0; i--) {
+        const sk = Number(ALL_CHIPS[i].sk_chip);
+        if (fora.has(sk)) ALL_CHIPS.splice(i, 1);
+        else if (porSk.has(sk)) ALL_CHIPS[i] = { ...ALL_CHIPS[i], ...porSk.get(sk) };
+    }
+    // só as linhas afetadas são trocadas; chips fora desta página ficam para a próxima navegação
+    let mudou = false;
+    document.querySelectorAll("#tableBody tr[data-sk]").forEach(tr => {
+        const sk = Number(tr.dataset.sk);
+        if (fora.has(sk)) { SELECTED.delete(sk); tr.remove(); mudou = true; }
+        else if (porSk.has(sk)) { tr.outerHTML = renderRow(ALL_CHIPS.find(c => Number(c.sk_chip) === sk) || porSk.get(sk)); mudou = true; }
+    });
+    if (mudou) { bindRowActions(); atualizarBarraLote(); }
+    return mudou;
+}
+async function sincronizarAlteracoes() {
+    if (!changesSince) return;
+    // pedido durante outra sincronização (ex.: logo depois de salvar) roda em seguida
+    if (sincronizando) { sincronizarDeNovo = true; return; }
+    sincronizando = true;
+    try {
+        const res = await fetch(`/api/chips/changes?since=${encodeURIComponent(changesSince)}`);
+        if (!res.ok) return;
+        const r = await res.json();
+        if (r.recarregar) { location.reload(); return; }
+        aplicarAlteracoes(r.chips || [], r.removidos || []);
+        changesSince = r.watermark;
+    } catch (e) {
+        console.warn("[Chips] Delta sync falhou", e);
+    } finally {
+        sincronizando = false;
+        if (sincronizarDeNovo) { sincronizarDeNovo = false; sincronizarAlteracoes(); }
+    }
+}
+setInterval(() => { if (!document.hidden) sincronizarAlteracoes(); }, CHANGES_POLL_MS);
+document.addEventListener("visibilitychange", () => { if (!document.hidden) sincronizarAlteracoes(); });
+
+/* ============================================================
+   SELEÇÃO MÚLTIPLA E AÇÕES EM LOTE
+============================================================ */
+const SELECTED = new Set();
+function atualizarBarraLote() {
+    const bar = document.getElementById("bulkActions");
+    if (!bar) return;
+    bar.hidden = SELECTED.size === 0;
+    document.getElementById("bulkCount").textContent = SELECTED.size;
+    const acao = document.getElementById("bulkAcao").value;
+    document.getElementById("bulkStatus").hidden = acao !== "status";
+    document.getElementById("bulkValor").hidden = acao !== "recarga";
 }
+function bindSelection() {
+    document.querySelectorAll(".chip-select").forEach(box => box.onchange = () => {
+        const sk = Number(box.value);
+        if (box.checked) SELECTED.add(sk); else SELECTED.delete(sk);
+        atualizarBarraLote();
+    });
+}
+document.getElementById("selectAllChips")?.addEventListener("change", e => {
+    document.querySelectorAll(".chip-select").forEach(box => {
+        box.checked = e.target.checked;
+        if (box.checked) SELECTED.add(Number(box.value)); else SELECTED.delete(Number(box.value));
+    });
+    atualizarBarraLote();
+});
+document.getElementById("bulkAcao")?.addEventListener("change", atualizarBarraLote);
+document.getElementById("bulkClearBtn")?.addEventListener("click", () => {
+    SELECTED.clear();
+    document.querySelectorAll(".chip-select, #selectAllChips").forEach(box => { box.checked = false; });
+    atualizarBarraLote();
+});
+document.getElementById("bulkApplyBtn")?.addEventListener("click", async () => {
+    const acao = document.getElementById("bulkAcao").value;
+    const payload = { acao, sk_chips: [...SELECTED] };
+    if (acao === "status") payload.status = document.getElementById("bulkStatus").value;
+    if (acao === "recarga") {
+        payload.valor = Number(document.getElementById("bulkValor").value || 0);
+        if (!payload.valor) return notify("Informe o valor da recarga", "error");
+    }
+    const rotulo = document.getElementById("bulkAcao").selectedOptions[0].textContent;
+    if (!confirm(`${rotulo}: ${SELECTED.size} chip(s). Confirmar?`)) return;
+    const btn = document.getElementById("bulkApplyBtn");
+    const oldText = btn.innerHTML;
+    btn.disabled = true;
+    btn.innerHTML = 'Aplicando <span class="spinner"></span>';
+    try {
+        const res = await fetch("/chips/bulk", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify(payload) });
+        const r = await res.json();
+        if (!r.success) return notify(r.error || "Erro na ação em lote", "error");
+        const falhas = r.resultados.filter(item => item.resultado !== "ok");
+        notify(`${r.aplicados} chip(s) atualizados${falhas.length ? `, ${falhas.length} sem alteração` : ""}`, falhas.length ? "info" : "success");
+        SELECTED.clear();
+        document.querySelectorAll(".chip-select, #selectAllChips").forEach(box => { box.checked = false; });
+        atualizarBarraLote();
+        sincronizarAlteracoes();
+    } catch (e) {
+        console.error("[Chips] Erro na ação em lote", e);
+        notify("Falha de rede na ação em lote", "error");
+    } finally {
+        btn.disabled = false; btn.innerHTML = oldText;
+    }
+});
 
 function bindQuickActions() {
     document.querySelectorAll(".recarga-btn").forEach(btn => btn.onclick = async () => {
@@ -223,7 +381,7 @@ function bindQuickActions() {
         try {
             const res = await fetch("/chips/recarga", { method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({sk_chip:Number(btn.dataset.sk), valor}) });
             const out = await res.json();
-            if (out.success) { notify("Recarga registrada com sucesso", "success"); setTimeout(() => location.reload(), 500); }
+            if (out.success) { notify("Recarga registrada com sucesso", "success"); sincronizarAlteracoes(); }
             else { notify(out.error || "Erro ao recarregar", "error"); btn.disabled = false; }
         } catch (e) { notify("Falha de rede ao recarregar", "error"); btn.disabled = false; }
     });
@@ -233,7 +391,7 @@ function bindQuickActions() {
         try {
             const res = await fetch("/chips/banir", { method:"POST", headers:{"Content-Type":"application/json"}, body: JSON.stringify({sk_chip:Number(btn.dataset.sk)}) });
             const out = await res.json();
-            if (out.success) { notify("Chip banido", "success"); setTimeout(() => location.reload(), 500); }
+            if (out.success) { notify("Chip banido", "success"); sincronizarAlteracoes(); }
             else { notify(out.error || "Erro ao banir", "error"); btn.disabled = false; }
         } catch (e) { notify("Falha de rede ao banir", "error"); btn.disabled = false; }
     });
@@ -274,7 +432,7 @@ document.getElementById("modalSaveBtn")?.addEventListener("click", async () => {
     try {
         const res = await fetch("/chips/update-json", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify(data) });
         const r = await res.json();
-        if (r.success) { notify("Chip atualizado com sucesso", "success"); setTimeout(() => location.reload(), 400); }
+        if (r.success) { notify("Chip atualizado com sucesso", "success"); closeEditModal(); sincronizarAlteracoes(); }
         else notify(r.error || "Erro ao salvar", "error");
     } catch (e) {
         console.error("[Chips] Erro ao salvar", e);
@@ -295,6 +453,7 @@ document.addEventListener("keydown", e => {
     closeNewChipModal();
     closeEditModal();
     hideModal("timelineModal");
+    hideModal("importModal");
 });
 document.querySelectorAll(".modal-overlay").forEach(modal => {
     modal.addEventListener("click", event => {
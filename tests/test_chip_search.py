@@ -0,0 +1,74 @@
+# tests/test_chip_search.py
+# -*- coding: utf-8 -*-
+
+# O índice de busca tem de devolver o mesmo que o filtro SQL que ele
+# substitui (ou None, para a rota usar o SQL). Roda sobre o motor local.
+
+import pytest
+
+pytest.importorskip("duckdb")
+
+from utils.bigquery_client import BigQueryClient
+from utils.chip_search import ChipSearchIndex, filtro_sql
+from utils.local_engine import LocalEngine
+
+EXPRS = {"numero": "numero", "id_chip": "id_chip", "operador": "operador"}
+
+TERMOS = [
+    "(11)", "DDD 11", "operador 1", "operador 12", "11", "9", "(21) 9",
+    "chip-00", "chip-004", "CHIP-0042", "x7", "1-2", "98765", "(11) 98765", "11 98",
+    "operador", "sem número", "abc", "7777", "42a",
+]
+
+
+@pytest.fixture(scope="module")
+def frota():
+    engine = LocalEngine()
+    cur = engine.cursor()
+    cur.execute("DELETE FROM dim_chip")
+    cur.execute("""
+        INSERT INTO dim_chip (sk_chip, id_chip, numero, operador, ativo, updated_at)
+        SELECT
+            i,
+            IF(i % 9 = 0, NULL, 'CHIP-' || lpad(CAST(i AS VARCHAR), 4, '0')),
+            CASE i % 4
+                WHEN 0 THEN '(' || (11 + i % 3 * 10) || ') 9' || lpad(CAST(8765 * i % 10000 AS VARCHAR), 4, '0') || '-' || lpad(CAST(i AS VARCHAR), 4, '0')
+                WHEN 1 THEN CAST(11900000000 + i * 7777 AS VARCHAR)
+                WHEN 2 THEN '+55 ' || (21 + i % 2) || ' 9' || lpad(CAST(i * 13 AS VARCHAR), 8, '0')
+                ELSE NULL
+            END,
+            IF(i % 5 = 0, NULL, 'Operador ' || (i % 15)),
+            TRUE,
+            current_timestamp
+        FROM range(1, 401) t(i)
+    """)
+    bq = BigQueryClient(backend=engine)
+    rows = bq.run_rows("SELECT sk_chip, numero, id_chip, operador, updated_at FROM `p.d.dim_chip`", null=None)
+    index = ChipSearchIndex(lambda since: rows if since is None else [], refresh_sec=3600, max_ids=10**6)
+    index.refresh()
+    return bq, index
+
+
+def _sql(bq, q):
+    where, params = filtro_sql(q, EXPRS)
+    return {r["sk_chip"] for r in bq.run_rows(f"SELECT sk_chip FROM `p.d.dim_chip` WHERE {where}", params)}
+
+
+@pytest.mark.parametrize("q", TERMOS)
+def test_indice_igual_ao_filtro_sql(frota, q):
+    bq, index = frota
+    found = index.resolve(q)
+    if found is not None:
+        assert set(found) == _sql(bq, q)
+
+
+@pytest.mark.parametrize("q", ["(11)", "DDD 11", "operador 1", "x7", "42a", "chip-00"])
+def test_termo_com_poucos_digitos_volta_para_o_sql(frota, q):
+    _, index = frota
+    assert index.resolve(q) is None
+
+
+@pytest.mark.parametrize("q", ["chip-004", "operador", "98765", "(11) 98765", "(21) 9", "abc"])
+def test_indice_responde_texto_e_digitos(frota, q):
+    _, index = frota
+    assert index.resolve(q) is not None
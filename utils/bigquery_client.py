@@ -1,60 +1,188 @@
 # -*- coding: utf-8 -*-
 
+import contextvars
 import os
-import pandas as pd
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.cloud import bigquery
+from requests.adapters import HTTPAdapter
+
+from utils.local_replica import REPLICA_ENABLED, REPLICA_MAX_STALENESS_SEC, LocalReplica, ReplicaMiss
+from utils.sanitizer import format_value, normalize_nulls, sanitize_df
+from utils.query_cache import QueryResultCache, cache_key, cache_tags, referenced_tables
+from utils.query_guard import QueryGuard
+from utils.query_metrics import get_query_metrics
 
 PROJECT  = os.getenv("GCP_PROJECT_ID", "painel-universidade")
 DATASET  = os.getenv("BQ_DATASET", "marts")
 LOCATION = os.getenv("BQ_LOCATION", "us")
+# "bigquery" (padrão) ou "local": motor DuckDB em memória (utils/local_engine.py), sem GCP
+BACKEND  = os.getenv("BQ_BACKEND", "bigquery").lower()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+# Tamanho fixo do pool HTTP (keep-alive) compartilhado pelas threads do worker
+POOL_SIZE = _env_int("BQ_POOL_SIZE", 16)
+
+# Linhas por página ao iterar resultados sem DataFrame (streaming)
+STREAM_PAGE_SIZE = _env_int("BQ_STREAM_PAGE_SIZE", 2000)
+
+# Máximo de consultas simultâneas disparadas por gather() no processo
+MAX_PARALLEL = _env_int("BQ_MAX_PARALLEL", 8)
+
+# Cache de resultados (opt-in por chamada de run_df)
+# A invalidação por escrita é só do worker que escreveu: nos outros, uma edição
+# aparece quando o TTL vence. Por isso o TTL é curto (as páginas com cache=True,
+# /chips, dashboard e movimentação, são as que os usuários editam).
+CACHE_MAX_BYTES = _env_int("BQ_CACHE_MAX_MB", 64) * 1024 * 1024
+CACHE_TTL_SEC = _env_int("BQ_CACHE_TTL_SEC", 30)
+
+_WRITE_SQL = re.compile(r"^\s*(INSERT|UPDATE|DELETE|MERGE|ALTER|CREATE|DROP|TRUNCATE|CALL|BEGIN|DECLARE)\b", re.I)
+
+BQ_SCOPES = (
+    "https://www.googleapis.com/auth/bigquery",
+    "https://www.googleapis.com/auth/cloud-platform",
+)
+
+
+# ============================================================
+# REGISTRO DE CLIENTES — UM bigquery.Client POR PROCESSO
+# ============================================================
+_clients = {}
+_clients_lock = threading.Lock()
+_shared_bq = None
+_executor = None
+
+
+def _build_http_session():
+    """Sessão HTTP autenticada com pool de conexões fixo e token já renovado."""
+    credentials, _ = google.auth.default(scopes=BQ_SCOPES)
+    try:
+        # refresh antecipado: o primeiro request do worker não paga a busca do token
+        credentials.refresh(Request())
+    except Exception as exc:
+        print(f"[BigQuery] Aviso: refresh antecipado de credenciais falhou: {exc}")
+
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=3)
+    session.mount("https://", adapter)
+    return credentials, session
+
+
+def get_bigquery_client(project: str = PROJECT, location: str = LOCATION):
+    """Retorna o bigquery.Client compartilhado do processo para (projeto, região)."""
+    key = (project, location)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            credentials, session = _build_http_session()
+            client = bigquery.Client(
+                project=project,
+                location=location,
+                credentials=credentials,
+                _http=session,
+            )
+            _clients[key] = client
+    return client
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _clients_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL, thread_name_prefix="bq-gather")
+    return _executor
+
+
+def get_bq():
+    """Retorna o BigQueryClient único do processo (usado por todos os blueprints)."""
+    global _shared_bq
+    if _shared_bq is None:
+        with _clients_lock:
+            if _shared_bq is None:
+                backend = None
+                if BACKEND == "local":
+                    from utils.local_engine import get_local_engine
+                    backend = get_local_engine()
+                _shared_bq = BigQueryClient(backend=backend)
+    return _shared_bq
 
 
 # ============================================================
 # BIGQUERY CLIENT — LEITURA + EXECUÇÃO DE SPs
 # ============================================================
 class BigQueryClient:
-    def __init__(self):
-        self.client = None
+    """Fachada de consultas do painel.
+
+    backend: objeto com a interface do bigquery.Client usada aqui
+    (query(sql, job_config).result(), load_table_from_json). None = o
+    bigquery.Client compartilhado; o LocalEngine (DuckDB) roda o painel e
+    o benchmark de rotas sem projeto GCP.
+    """
+
+    def __init__(self, backend=None):
         self.project = PROJECT
         self.dataset = DATASET
+        self.backend = backend
+        self.cache = QueryResultCache(CACHE_MAX_BYTES, CACHE_TTL_SEC)
+        self.metrics = get_query_metrics()
+        self.origem = "local" if backend is not None else "bigquery"
+        # motor local não tem dry run: ficam só os limites por rota
+        self.guard = QueryGuard(self._dry_run if backend is None else None)
+        self.replica_enabled = REPLICA_ENABLED and backend is None
+        self._replica = None
+        self._replica_pid = None
 
-    def _get_client(self):
-        if self.client is None:
-            self.client = bigquery.Client(
-                project=self.project,
-                location=LOCATION
-            )
-        return self.client
+    @property
+    def client(self):
+        return get_bigquery_client(self.project, LOCATION)
 
-    # ========================================================
-    # EXECUÇÃO GENÉRICA (SEM DATAFRAME)
-    # ========================================================
-    def run(self, sql: str, params=None):
-        print("\n🔥 EXECUTANDO SQL:\n", sql, "\n" + "=" * 80)
-        job_config = None
-        if params is not None:
-            job_config = bigquery.QueryJobConfig(query_parameters=params)
-        return self._get_client().query(sql, job_config=job_config).result()
+    def _get_client(self):
+        return self.backend if self.backend is not None else self.client
 
     # ========================================================
-    # EXECUÇÃO COM DATAFRAME (LEITURA) — SUPORTE TOTAL A PARAMS
+    # PARAMS → QueryJobConfig
     # ========================================================
-    def run_df(self, sql: str, params=None):
-        print("\n🔥 EXECUTANDO SQL (DF):\n", sql, "\n" + "=" * 80)
-
-        job_config = None
+    @staticmethod
+    def _job_config(params, max_bytes=None, timeout_sec=None):
+        config = BigQueryClient._params_config(params)
+        if max_bytes or timeout_sec:
+            config = config or bigquery.QueryJobConfig()
+            if max_bytes:
+                config.maximum_bytes_billed = int(max_bytes)
+            if timeout_sec:
+                config.job_timeout_ms = int(timeout_sec * 1000)
+        return config
 
+    @staticmethod
+    def _params_config(params):
         # --------------------------------------------
         # params como LISTA de ScalarQueryParameter
         # --------------------------------------------
         if isinstance(params, list):
-            job_config = bigquery.QueryJobConfig(query_parameters=params)
+            return bigquery.QueryJobConfig(query_parameters=params)
 
         # --------------------------------------------
         # params como DICT simples
         # --------------------------------------------
-        elif isinstance(params, dict):
-            job_config = bigquery.QueryJobConfig(
+        if isinstance(params, dict):
+            return bigquery.QueryJobConfig(
                 query_parameters=[
                     bigquery.ScalarQueryParameter(
                         name=k,
@@ -68,26 +196,284 @@ class BigQueryClient:
         # --------------------------------------------
         # params None → query simples
         # --------------------------------------------
-        elif params is None:
-            job_config = None
+        if params is None:
+            return None
+
+        raise TypeError("params deve ser dict, list[ScalarQueryParameter] ou None")
+
+    # ========================================================
+    # INVALIDAÇÃO DO CACHE APÓS ESCRITAS
+    # ========================================================
+    def _invalidate_for(self, sql: str, tables=None):
+        match = _WRITE_SQL.match(sql or "")
+        if not match and tables is None:
+            return
+        if tables is not None:
+            # o chamador sabe o que o script escreve (ex.: refresh dos agregados)
+            self.cache.invalidate(tables)
+            if self._replica is not None:
+                self._replica.mark_dirty(tables)
+            return
+        tables = referenced_tables(sql)
+        # SPs e scripts podem tocar qualquer tabela do dataset → limpa tudo
+        if match.group(1).upper() in ("CALL", "BEGIN", "DECLARE") or not tables:
+            self.cache.invalidate()
+            tables = None
+        else:
+            self.cache.invalidate(tables)
+        if self._replica is not None:
+            self._replica.mark_dirty(tables)
+
+    # ========================================================
+    # RÉPLICA LOCAL (OPCIONAL) — LEITURAS SEM IR AO BIGQUERY
+    # ========================================================
+    @property
+    def replica(self):
+        """LocalReplica do processo (BQ_REPLICA_ENABLED=1), criada depois do fork; None se desligada."""
+        if not self.replica_enabled:
+            return None
+        if self._replica is None or self._replica_pid != os.getpid():
+            with _clients_lock:
+                if self._replica is None or self._replica_pid != os.getpid():
+                    try:
+                        self._replica = LocalReplica(self._replica_fetch).start()
+                    except Exception as exc:
+                        print(f"[BigQuery] Aviso: réplica local desligada: {exc}")
+                        self.replica_enabled = False
+                        return None
+                    self._replica_pid = os.getpid()
+        return self._replica
+
+    def read_lag_sec(self, cache=False):
+        """Atraso máximo de uma leitura de run_df/run_rows em relação ao BigQuery (TTL do cache + réplica)."""
+        lag = self.cache.ttl_sec if cache else 0
+        if self.replica_enabled:
+            lag += REPLICA_MAX_STALENESS_SEC
+        return lag
+
+    def _replica_fetch(self, table, coluna=None, watermark=None):
+        sql = f"SELECT * FROM `{self.project}.{self.dataset}.{table}`"
+        params = None
+        if coluna and watermark is not None:
+            sql += f" WHERE {coluna} > @watermark"
+            params = [bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark)]
+        def fetch(job):
+            table = job.result().to_arrow(create_bqstorage_client=False)
+            return table, table.num_rows
+
+        return self._query(sql, params, "replica_sync", fetch)
+
+    def _from_replica(self, sql, params, df=False):
+        replica = self.replica
+        if replica is None:
+            return None
+        started = time.perf_counter()
+        try:
+            result = replica.query_df(sql, params) if df else replica.query(sql, params)
+        except ReplicaMiss:
+            return None
+        self.metrics.record(sql, "df" if df else "rows", "replica", time.perf_counter() - started, rows=len(result))
+        return result
 
+    # ========================================================
+    # JOB INSTRUMENTADO (MÉTRICAS POR ROTA/FINGERPRINT)
+    # ========================================================
+    def _query(self, sql, params, kind, fetch, fallback=None):
+        """Roda o job e devolve fetch(job) → (resultado, linhas), registrando tempo, bytes e slot-ms.
+
+        O job sai com o teto de bytes e o timeout da rota (QueryGuard). Leitura
+        estimada acima do orçamento troca para `fallback` (mesmos params) ou
+        levanta QueryBudgetExceeded.
+        """
+        started = time.perf_counter()
+        job = None
+        try:
+            sql, max_bytes, timeout = self.guard.choose(sql, params, fallback)
+            job = self._get_client().query(sql, job_config=self._job_config(params, max_bytes, timeout))
+            result, rows = fetch(job)
+        except Exception as exc:
+            self.metrics.record(sql, kind, self.origem, time.perf_counter() - started, job, error=exc)
+            raise
+        self.metrics.record(sql, kind, self.origem, time.perf_counter() - started, job, rows=rows)
+        return result
+
+    def _dry_run(self, sql, params):
+        config = self._params_config(params) or bigquery.QueryJobConfig()
+        config.dry_run = True
+        config.use_query_cache = False
+        return self.client.query(sql, job_config=config).total_bytes_processed
+
+    def _cached(self, sql, kind, key):
+        started = time.perf_counter()
+        value = self.cache.get(key)
+        if value is not None:
+            self.metrics.record(sql, kind, "cache", time.perf_counter() - started, rows=len(value))
+        return value
+
+    # ========================================================
+    # EXECUÇÃO GENÉRICA (SEM DATAFRAME)
+    # ========================================================
+    def run(self, sql: str, params=None, writes=None):
+        """Executa o SQL (statement ou script). writes: tabelas que o script escreve, para invalidar só elas."""
+        def fetch(job):
+            result = job.result()
+            return result, result.total_rows
+
+        try:
+            return self._query(sql, params, "run", fetch)
+        finally:
+            self._invalidate_for(sql, writes)
+
+    # ========================================================
+    # EXECUÇÃO COM DATAFRAME (LEITURA) — SUPORTE TOTAL A PARAMS
+    # ========================================================
+    def run_df(self, sql: str, params=None, cache: bool = False, sanitize: bool = False, fallback: str = None):
+        """Executa um SELECT e devolve DataFrame com NaN → None.
+
+        sanitize=True já devolve no formato do sanitize_df (nulos → "",
+        datas → YYYY-MM-DD) na mesma passada, sem normalizar duas vezes.
+        cache=True usa o cache de resultados do processo (LRU + TTL),
+        invalidado por tabela sempre que run/call_sp escreve nela.
+        fallback: SQL mais barato (mesmos params) usado quando a estimativa
+        passa do orçamento de bytes da rota.
+        """
+        key = generation = None
+        if cache:
+            key = ("sanitized|" if sanitize else "") + cache_key(sql, params)
+            cached = self._cached(sql, "df", key)
+            if cached is not None:
+                return cached
+            generation = self.cache.generation()
+
+        df = self._from_replica(sql, params, df=True)
+        if df is None:
+            def fetch(job):
+                frame = job.result().to_dataframe(create_bqstorage_client=False)
+                return frame, len(frame)
+
+            df = self._query(sql, params, "df", fetch, fallback)
+
+        # normaliza NaN -> None (pra JSON / Jinja) ou direto para o formato do sanitize_df
+        if sanitize:
+            df = sanitize_df(df, inplace=True)
+        else:
+            df = normalize_nulls(df, fill=None, format_dates=False, inplace=True)
+        if key is not None:
+            self.cache.put(key, df, cache_tags(sql), generation)
+        return df
+
+    # ========================================================
+    # LEITURA SEM PANDAS — LISTA DE DICTS
+    # ========================================================
+    def run_rows(self, sql: str, params=None, cache: bool = False, null="", fallback: str = None, replica: bool = True):
+        """Executa um SELECT e devolve list[dict] direto do RowIterator.
+
+        Caminho rápido para rotas: sem DataFrame, sem cópia do sanitize_df e
+        sem to_dict(). Valores no formato do sanitize_df: nulos viram `null`
+        ("" por padrão; use null=None para manter None) e DATE/TIMESTAMP
+        viram YYYY-MM-DD. Com cache=True cada
+        chamada recebe cópias rasas das linhas, então pode alterá-las.
+        fallback: como em run_df. replica=False lê sempre do BigQuery
+        (consultas que não podem ver uma cópia atrasada, como o delta sync).
+        """
+        key = generation = None
+        if cache:
+            key = "rows|" + repr(null) + "|" + cache_key(sql, params)
+            cached = self._cached(sql, "rows", key)
+            if cached is not None:
+                return [dict(r) for r in cached]
+            generation = self.cache.generation()
+
+        replica_rows = self._from_replica(sql, params) if replica else None
+        if replica_rows is not None:
+            rows = [{k: format_value(v, null) for k, v in row.items()} for row in replica_rows]
         else:
-            raise TypeError("params deve ser dict, list[ScalarQueryParameter] ou None")
+            def fetch(job):
+                linhas = [
+                    {k: format_value(v, null) for k, v in row.items()}
+                    for row in job.result()
+                ]
+                return linhas, len(linhas)
+
+            rows = self._query(sql, params, "rows", fetch, fallback)
+        if key is not None:
+            self.cache.put(key, rows, cache_tags(sql), generation)
+            return [dict(r) for r in rows]
+        return rows
+
+    # ========================================================
+    # ITERAÇÃO PÁGINA A PÁGINA (STREAMING, SEM DATAFRAME)
+    # ========================================================
+    def iter_rows(self, sql: str, params=None, page_size: int = STREAM_PAGE_SIZE):
+        """Itera um dict por linha direto do RowIterator, buscando página a página.
+
+        A consulta roda (e falha, se for o caso) já na chamada; as páginas só
+        são baixadas conforme o iterador é consumido. Memória ~ uma página.
+        """
+        def fetch(job):
+            pages = job.result(page_size=page_size)
+            return pages, pages.total_rows
+
+        result = self._query(sql, params, "stream", fetch)
+
+        def _rows():
+            for page in result.pages:
+                for row in page:
+                    yield dict(row.items())
 
-        job = self._get_client().query(sql, job_config=job_config)
-        df = job.result().to_dataframe(create_bqstorage_client=False)
+        return _rows()
 
-        # normaliza NaN -> None (pra JSON / Jinja)
-        return df.astype(object).where(pd.notnull(df), None)
+    # ========================================================
+    # CONSULTAS INDEPENDENTES EM PARALELO
+    # ========================================================
+    def gather(self, jobs: dict, return_exceptions: bool = False):
+        """Executa chamadas independentes ao mesmo tempo e espera todas.
+
+        jobs: {nome: função sem argumentos}, ex.:
+            bq.gather({
+                "lista": lambda: bq.run_df(sql_lista),
+                "aparelhos": lambda: bq.run_df(sql_aparelhos),
+            })
+
+        Retorna {nome: resultado}. A primeira função roda na thread atual e
+        as demais no pool do processo (BQ_MAX_PARALLEL), então a latência
+        fica ~max(consultas) em vez da soma. Com return_exceptions=True a
+        exceção de cada job vira o seu resultado; senão, a primeira falha
+        (na ordem de jobs) é relançada depois que todos terminam.
+        """
+        items = list(jobs.items())
+        if not items:
+            return {}
+        executor = _get_executor()
+        # cada job leva uma cópia do contexto (rota atual nas métricas)
+        futures = {name: executor.submit(contextvars.copy_context().run, fn) for name, fn in items[1:]}
+
+        results, errors = {}, []
+        first_name, first_fn = items[0]
+        try:
+            results[first_name] = first_fn()
+        except Exception as exc:
+            results[first_name] = exc
+            errors.append(exc)
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as exc:
+                results[name] = exc
+                errors.append(exc)
+
+        if errors and not return_exceptions:
+            raise errors[0]
+        return {name: results[name] for name, _ in items}
 
     # ========================================================
     # LEITURA DE VIEWS (PADRÃO DO PAINEL)
     # ========================================================
-    def get_view(self, view_name: str):
+    def get_view(self, view_name: str, cache: bool = False):
         return self.run_df(f"""
             SELECT *
             FROM `{self.project}.{self.dataset}.{view_name}`
-        """)
+        """, cache=cache)
 
     # ========================================================
     # 🔧 EXECUTAR STORED PROCEDURE (UTIL DO PAINEL)
@@ -110,6 +496,31 @@ class BigQueryClient:
         sql = f"CALL `{self.project}.{self.dataset}.{sp_name}`({params})"
         return self.run(sql)
 
+    # ========================================================
+    # LOAD JOB (CARGA EM LOTE, SEM DML)
+    # ========================================================
+    def load_rows(self, table_name: str, rows: list, schema: list, write_disposition: str = "WRITE_TRUNCATE"):
+        """Grava uma lista de dicts numa tabela do dataset com um único load job.
+
+        Usado para staging de importações: um load job não consome cota de
+        DML e substitui centenas de INSERTs. schema é uma lista de
+        bigquery.SchemaField.
+        """
+        table_id = f"{self.project}.{self.dataset}.{table_name}"
+        job_config = bigquery.LoadJobConfig(schema=schema, write_disposition=write_disposition)
+        # fingerprint pelo schema: tabelas de staging têm nome único por carga
+        label = "LOAD " + ",".join(f.name for f in schema)
+        started = time.perf_counter()
+        try:
+            result = self._get_client().load_table_from_json(rows, table_id, job_config=job_config).result()
+            self.metrics.record(label, "load", self.origem, time.perf_counter() - started, rows=len(rows))
+            return result
+        except Exception as exc:
+            self.metrics.record(label, "load", self.origem, time.perf_counter() - started, error=exc)
+            raise
+        finally:
+            self.cache.invalidate([table_name])
+
     # ========================================================
     # ⚠️ BLOQUEIO EXPLÍCITO — PROTEÇÃO DE ARQUITETURA
     # ========================================================
@@ -0,0 +1,133 @@
+# utils/chip_import.py
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import os
+import re
+import unicodedata
+
+import pandas as pd
+
+MAX_LINHAS = int(os.getenv("CHIPS_IMPORT_MAX_LINHAS", "5000"))
+
+# cabeçalho da planilha (normalizado) → campo da dim_chip
+COLUNAS = {
+    "numero": "numero", "linha": "numero", "telefone": "numero", "msisdn": "numero",
+    "operadora": "operadora", "carrier": "operadora",
+    "plano": "plano",
+    "status": "status", "situacao": "status",
+    "operador": "operador", "responsavel": "operador",
+    "observacao": "observacao", "obs": "observacao",
+    "id_chip": "id_chip", "id": "id_chip",
+    "tipo_whatsapp": "tipo_whatsapp",
+}
+OPERADORAS = {"VIVO", "TIM", "CLARO", "OI", "OUTRA"}
+
+
+def _digits(value):
+    return re.sub(r"\D+", "", str(value or ""))
+
+
+def _header(value):
+    value = unicodedata.normalize("NFD", str(value or ""))
+    value = "".join(ch for ch in value if unicodedata.category(ch) != "Mn")
+    return re.sub(r"[^a-z0-9]+", "_", value.lower()).strip("_")
+
+
+def _text(value):
+    value = str(value or "").strip()
+    return value or None
+
+
+def normalizar_numero(numero):
+    """Número só com dígitos na forma gravada (DDD + número): tira o DDI 55 se vier na frente."""
+    numero = _digits(numero)
+    return numero[2:] if len(numero) in (12, 13) and numero.startswith("55") else numero
+
+
+def validar_numero(numero):
+    """Motivo de rejeição do número (já normalizado) ou None se válido.
+
+    Aceita DDD + número (10/11 dígitos); o DDI 55 sai antes, em normalizar_numero.
+    """
+    if not numero:
+        return "número vazio"
+    if len(numero) not in (10, 11):
+        return "número deve ter DDD + 8 ou 9 dígitos"
+    if numero[0] == "0" or numero[1] == "0":
+        return "DDD inválido"
+    if len(numero) == 11 and numero[2] != "9":
+        return "celular com 9 dígitos deve começar com 9"
+    return None
+
+
+def ler_planilha(arquivo):
+    """Lê um upload CSV/XLSX como lista de dicts com cabeçalhos normalizados."""
+    nome = (getattr(arquivo, "filename", "") or "").lower()
+    conteudo = arquivo.read()
+    if nome.endswith(".xls"):
+        # .xls (Excel 97-2003) precisaria do xlrd, que não é dependência do painel
+        raise ValueError("Formato .xls não suportado: salve a planilha como .xlsx ou .csv.")
+    if nome.endswith(".xlsx"):
+        try:
+            df = pd.read_excel(io.BytesIO(conteudo), dtype=str)
+        except ImportError as exc:
+            raise ValueError("Leitura de XLSX indisponível no servidor (instale openpyxl).") from exc
+    else:
+        df = _ler_csv(conteudo.decode("utf-8-sig", errors="replace"))
+    df = df.rename(columns=lambda c: COLUNAS.get(_header(c), _header(c)))
+    if "numero" not in df.columns:
+        raise ValueError("Planilha sem coluna de número (numero/linha/telefone).")
+    df = df.loc[:, ~df.columns.duplicated()]
+    return df.where(pd.notnull(df), None).to_dict("records")
+
+
+def _ler_csv(texto):
+    # só ";", "," ou tab contam como separador (planilhas em pt-BR costumam exportar com ";");
+    # sem nenhum deles o arquivo é uma coluna só (ex.: cabeçalho numero e um número por linha)
+    amostra = "\n".join(texto.splitlines()[:50])
+    try:
+        sep = csv.Sniffer().sniff(amostra, delimiters=";,\t").delimiter
+    except csv.Error:
+        linhas = [l.strip() for l in texto.splitlines() if l.strip()]
+        if not linhas:
+            return pd.DataFrame()
+        return pd.DataFrame({linhas[0]: linhas[1:]}, dtype=str)
+    return pd.read_csv(io.StringIO(texto), dtype=str, sep=sep)
+
+
+def normalizar_linhas(linhas, operadora_padrao=None, status_padrao="DISPONIVEL"):
+    """Valida e normaliza as linhas localmente, sem consultar o BigQuery.
+
+    Devolve (validas, invalidas). Números repetidos dentro do próprio
+    arquivo são rejeitados aqui (conjunto em memória); a checagem contra a
+    base fica para uma única consulta em lote na rota.
+    """
+    validas, invalidas, vistos = [], [], {}
+    for pos, linha in enumerate(linhas, start=2):  # linha 1 = cabeçalho
+        numero = normalizar_numero(linha.get("numero"))
+        motivo = validar_numero(numero)
+        operadora = (_text(linha.get("operadora")) or operadora_padrao or "").upper()
+        if not motivo and not operadora:
+            motivo = "operadora obrigatória"
+        elif not motivo and operadora not in OPERADORAS:
+            motivo = f"operadora desconhecida: {operadora}"
+        elif not motivo and numero in vistos:
+            motivo = f"número repetido no arquivo (linha {vistos[numero]})"
+        if motivo:
+            invalidas.append({"linha": pos, "numero": linha.get("numero"), "motivo": motivo})
+            continue
+        vistos[numero] = pos
+        validas.append({
+            "linha": pos,
+            "id_chip": _text(linha.get("id_chip")),
+            "numero": numero,
+            "operadora": operadora,
+            "plano": _text(linha.get("plano")) or "",
+            "status": (_text(linha.get("status")) or status_padrao).upper(),
+            "operador": _text(linha.get("operador")),
+            "observacao": _text(linha.get("observacao")) or "",
+            "tipo_whatsapp": (_text(linha.get("tipo_whatsapp")) or "").upper() or None,
+        })
+    return validas, invalidas
@@ -0,0 +1,179 @@
+# utils/chip_search.py
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+from google.cloud import bigquery
+
+REFRESH_SEC = int(os.getenv("CHIPS_SEARCH_REFRESH_SEC", "60"))
+# acima disso a lista de sk_chips pesa mais que o LIKE: a rota volta para o filtro SQL
+MAX_IDS = int(os.getenv("CHIPS_SEARCH_MAX_IDS", "20000"))
+CAMPOS = ("numero", "id_chip", "operador")
+GRAM = 3
+
+
+def _digits(value):
+    return re.sub(r"\D+", "", str(value or ""))
+
+
+def _grams(text, n=GRAM):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def filtro_sql(q, exprs):
+    """Filtro SQL do termo livre (o que o índice substitui): (condição, params).
+
+    numero, id_chip ou operador contém q, ou o número só com dígitos
+    contém os dígitos de q (basta um dígito no termo).
+    """
+    partes = [f"LOWER(COALESCE({exprs[campo]},'')) LIKE @q" for campo in CAMPOS]
+    params = [bigquery.ScalarQueryParameter("q", "STRING", f"%{q.lower()}%")]
+    digits = _digits(q)
+    if digits:
+        partes.append(f"REGEXP_REPLACE(COALESCE({exprs['numero']},''), r'[^0-9]', '') LIKE @q_digits")
+        params.append(bigquery.ScalarQueryParameter("q_digits", "STRING", f"%{digits}%"))
+    return f"({' OR '.join(partes)})", params
+
+
+# ============================================================
+# ÍNDICE DE BUSCA LIVRE DOS CHIPS (FILTRO q)
+# ============================================================
+class ChipSearchIndex:
+    """Trigramas de numero, id_chip e operador (minúsculos) → sk_chip, em memória (por worker).
+
+    resolve(q) devolve os sk_chips cujo numero/id_chip/operador contém q
+    (ou cujo número só com dígitos contém os dígitos de q), com a mesma
+    semântica de filtro_sql; a rota filtra a consulta principal por
+    sk_chip IN UNNEST(...) em vez de varrer a frota com LIKE/REGEXP.
+    Devolve None quando o índice não sabe responder (termo com menos de 3
+    caracteres ou com só 1–2 dígitos, carga falhou, resultado grande
+    demais) e a rota usa o SQL.
+    O loader recebe o watermark (updated_at máximo já visto, ou None) e
+    devolve dicts com sk_chip, numero, id_chip, operador e updated_at;
+    chips inativos continuam no índice (a lista filtra ativo à parte).
+    """
+
+    def __init__(self, loader, refresh_sec=REFRESH_SEC, max_ids=MAX_IDS):
+        self._loader = loader
+        self.refresh_sec = refresh_sec
+        self.max_ids = max_ids
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._docs = {}                 # sk_chip → (textos minúsculos, dígitos do número, trigramas)
+        self._grams = defaultdict(set)  # trigrama → sk_chips
+        self._watermark = None
+        self._refreshed_at = 0.0
+        self._built = False
+        self.last_error = None
+
+    # --------------------------------------------------------
+    # MANUTENÇÃO
+    # --------------------------------------------------------
+    def upsert(self, sk_chip, numero=None, id_chip=None, operador=None):
+        if sk_chip is None:
+            return
+        sk_chip = int(sk_chip)
+        textos = tuple(str(v or "").lower() for v in (numero, id_chip, operador))
+        digits = _digits(numero)
+        grams = set().union(*(_grams(t) for t in textos), _grams(digits))
+        with self._lock:
+            self._remove(sk_chip)
+            self._docs[sk_chip] = (textos, digits, grams)
+            for gram in grams:
+                self._grams[gram].add(sk_chip)
+
+    def patch(self, sk_chip, **campos):
+        """Atualiza só os campos informados (os demais ficam como estão no índice)."""
+        with self._lock:
+            doc = self._docs.get(int(sk_chip))
+        atual = dict(zip(CAMPOS, doc[0])) if doc else {}
+        atual.update({k: v for k, v in campos.items() if k in CAMPOS})
+        self.upsert(sk_chip, **atual)
+
+    def _remove(self, sk_chip):
+        doc = self._docs.pop(sk_chip, None)
+        if doc is None:
+            return
+        for gram in doc[2]:
+            bucket = self._grams.get(gram)
+            if bucket is not None:
+                bucket.discard(sk_chip)
+                if not bucket:
+                    del self._grams[gram]
+
+    def refresh(self):
+        """Aplica as linhas alteradas desde o último watermark."""
+        with self._refresh_lock:
+            for row in self._loader(self._watermark):
+                self.upsert(row.get("sk_chip"), *(row.get(c) for c in CAMPOS))
+                updated_at = row.get("updated_at")
+                if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+                    self._watermark = updated_at
+            self._refreshed_at = time.monotonic()
+            self._built = True
+            self.last_error = None
+
+    def _ensure_fresh(self):
+        if not self._built:
+            if self._refresh_lock.locked() or (self.last_error and time.monotonic() - self._refreshed_at < self.refresh_sec):
+                return
+            try:
+                self.refresh()
+            except Exception as exc:
+                # sem índice a rota cai no LIKE; nova carga só depois de refresh_sec
+                self.last_error = str(exc)
+                self._refreshed_at = time.monotonic()
+                print(f"[ChipSearch] Aviso: carga inicial falhou: {exc}")
+            return
+        if time.monotonic() - self._refreshed_at < self.refresh_sec or self._refresh_lock.locked():
+            return
+        self._refreshed_at = time.monotonic()
+        threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as exc:
+            self.last_error = str(exc)
+            print(f"[ChipSearch] Aviso: refresh incremental falhou: {exc}")
+
+    # --------------------------------------------------------
+    # BUSCA
+    # --------------------------------------------------------
+    def resolve(self, q):
+        """Lista ordenada de sk_chips que casam com q, ou None para a rota usar o filtro SQL."""
+        termo = str(q or "").strip().lower()
+        digits = _digits(termo)
+        # 1–2 dígitos ("(11)", "operador 1"): no SQL casam com qualquer número que os contenha,
+        # e trigramas não respondem isso
+        if len(termo) < GRAM or 0 < len(digits) < GRAM:
+            return None
+        self._ensure_fresh()
+        if not self._built:
+            return None
+        with self._lock:
+            found = set()
+            if len(termo) >= GRAM:
+                found |= {sk for sk in self._candidates(termo) if any(termo in t for t in self._docs[sk][0])}
+            if len(digits) >= GRAM:
+                found |= {sk for sk in self._candidates(digits) if digits in self._docs[sk][1]}
+        if len(found) > self.max_ids:
+            return None
+        return sorted(found)
+
+    def _candidates(self, termo):
+        buckets = sorted((self._grams.get(g, set()) for g in _grams(termo)), key=len)
+        if not buckets or not buckets[0]:
+            return set()
+        return set(buckets[0]).intersection(*buckets[1:])
+
+    def stats(self):
+        with self._lock:
+            return {"chips": len(self._docs), "trigramas": len(self._grams), "idade_sec": int(time.monotonic() - self._refreshed_at) if self._built else None, "last_error": self.last_error}
+
+    def __len__(self):
+        return len(self._docs)
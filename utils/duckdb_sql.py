@@ -0,0 +1,266 @@
+# utils/duckdb_sql.py
+# -*- coding: utf-8 -*-
+
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+# funções do BigQuery sem equivalente direto no DuckDB (mesma assinatura, nome próprio)
+MACROS = (
+    "CREATE OR REPLACE MACRO bq_regexp_replace(s, p, r) AS regexp_replace(s, p, r, 'g')",
+    "CREATE OR REPLACE MACRO bq_date_sub(d, i) AS CAST(d - i AS DATE)",
+    "CREATE OR REPLACE MACRO bq_date_add(d, i) AS CAST(d + i AS DATE)",
+    "CREATE OR REPLACE MACRO bq_timestamp_sub(t, i) AS t - i",
+    "CREATE OR REPLACE MACRO bq_format_timestamp(f, t, z := 'UTC') AS strftime(t, replace(f, '%E6S', '%S.%f'))",
+    "CREATE OR REPLACE MACRO bq_timestamp_diff(a, b, u) AS CAST(trunc((epoch(a) - epoch(b)) / CASE u WHEN 'SECOND' THEN 1 WHEN 'MINUTE' THEN 60 WHEN 'HOUR' THEN 3600 ELSE 86400 END) AS BIGINT)",
+    "CREATE OR REPLACE MACRO bq_date_diff(a, b, u) AS date_diff(lower(u), CAST(b AS DATE), CAST(a AS DATE))",
+)
+
+TYPES = {
+    "INT64": "BIGINT", "INTEGER": "BIGINT", "FLOAT64": "DOUBLE", "FLOAT": "DOUBLE", "STRING": "VARCHAR",
+    "BYTES": "BLOB", "NUMERIC": "DECIMAL(38,9)", "BIGNUMERIC": "DECIMAL(38,9)", "BOOL": "BOOLEAN",
+    "BOOLEAN": "BOOLEAN", "DATE": "DATE", "DATETIME": "TIMESTAMP", "TIMESTAMP": "TIMESTAMPTZ",
+}
+
+_STRING = re.compile(r"(?<![\w])r?'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"", re.S)
+_REWRITES = (
+    (re.compile(r"`[^`.]+\.[^`.]+\.INFORMATION_SCHEMA\.COLUMNS`", re.I), "information_schema.columns"),
+    (re.compile(r"`(?:[^`.]+\.)?[^`.]+\.([^`.]+)`"), r'"\1"'),
+    (re.compile(r"\bAS\s+(INT64|FLOAT64|STRING|BYTES|NUMERIC|BIGNUMERIC|BOOL|DATETIME)\b", re.I), lambda m: "AS " + TYPES[m.group(1).upper()]),
+    (re.compile(r"(?<=\w)(\s+)(INT64|FLOAT64|STRING|BYTES|BIGNUMERIC|BOOL)\b(?=\s*[,)])", re.I), lambda m: m.group(1) + TYPES[m.group(2).upper()]),
+    (re.compile(r"\bSAFE_CAST\(", re.I), "TRY_CAST("),
+    (re.compile(r"\bCOUNTIF\(", re.I), "count_if("),
+    (re.compile(r"\bREGEXP_REPLACE\(", re.I), "bq_regexp_replace("),
+    (re.compile(r"\bDATE_SUB\(", re.I), "bq_date_sub("),
+    (re.compile(r"\bDATE_ADD\(", re.I), "bq_date_add("),
+    (re.compile(r"\bTIMESTAMP_SUB\(", re.I), "bq_timestamp_sub("),
+    (re.compile(r"\bFORMAT_TIMESTAMP\(", re.I), "bq_format_timestamp("),
+    # DDL: particionamento e cluster do BigQuery não existem no DuckDB
+    (re.compile(r"\)\s*CLUSTER\s+BY\s+\w+(?:\s*,\s*\w+)*\s*$", re.I), ")"),
+    (re.compile(r"\)\s*PARTITION\s+BY\s+[\w()]+\s*$", re.I), ")"),
+    (re.compile(r"\bTIMESTAMP_DIFF\(", re.I), "bq_timestamp_diff("),
+    (re.compile(r"\bDATE_DIFF\(", re.I), "bq_date_diff("),
+    (re.compile(r",\s*(SECOND|MINUTE|HOUR|DAY)\s*\)", re.I), lambda m: f", '{m.group(1).upper()}')"),
+    (re.compile(r"\bGENERATE_ARRAY\(", re.I), "generate_series("),
+    (re.compile(r"\bCURRENT_(DATE|TIMESTAMP)\(\)", re.I), r"current_\1"),
+    (re.compile(r"\b(TIMESTAMP|DATE)\(('[^']*')\)", re.I), r"\1 \2"),
+    (re.compile(r"\bEXCEPT\s*\(", re.I), "EXCLUDE ("),
+    (re.compile(r"\bMERGE\s+(?!INTO\b)", re.I), "MERGE INTO "),
+    (re.compile(r"\bIN\s+UNNEST\(\s*@(\w+)\s*\)", re.I), r"IN (SELECT UNNEST(@\1))"),
+    (re.compile(r"\bFROM\s+UNNEST\(\s*@(\w+)\s*\)", re.I), r"FROM (SELECT UNNEST(@\1, recursive := true))"),
+)
+
+
+class Untranslatable(Exception):
+    """SQL do BigQuery sem tradução para o DuckDB."""
+
+
+# ============================================================
+# PARSING MÍNIMO (RESPEITA ASPAS E PARÊNTESES)
+# ============================================================
+def _scan(text):
+    """Gera (índice, caractere, profundidade) ignorando o que está entre aspas."""
+    depth, quote, i = 0, None, 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\":
+                i += 2
+                continue
+            if ch == quote:
+                quote = None
+        elif ch in "'\"`":
+            quote = ch
+        else:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            yield i, ch, depth
+        i += 1
+
+
+def split_top(text, sep=","):
+    """Divide no separador só no nível zero de parênteses (fora de aspas)."""
+    parts, start = [], 0
+    for i, ch, depth in _scan(text):
+        if ch == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def find_top(text, pattern):
+    """Primeiro match da regex no nível zero de parênteses (fora de aspas), ou None."""
+    zero = {i for i, ch, depth in _scan(text) if depth == 0 and ch != ")"}
+    for m in re.finditer(pattern, text, re.I):
+        if m.start() in zero:
+            return m
+    return None
+
+
+def _closing(text, open_at):
+    for i, ch, depth in _scan(text[open_at:]):
+        if ch == ")" and depth == 0:
+            return open_at + i
+    raise Untranslatable("parênteses desbalanceados")
+
+
+def _rewrite_calls(sql, name, fn):
+    """Troca NAME(args) por fn(args), de dentro para fora."""
+    pattern = re.compile(rf"\b{name}\s*\(", re.I)
+    while True:
+        m = None
+        for candidate in pattern.finditer(sql):
+            m = candidate  # o último é o mais interno (ou o mais à direita)
+        if m is None:
+            return sql
+        close = _closing(sql, m.end() - 1)
+        sql = sql[:m.start()] + fn(sql[m.end():close]) + sql[close + 1:]
+
+
+def _struct(args):
+    campos = []
+    for arg in split_top(args):
+        arg = arg.strip()
+        m = re.match(r"(.*)\s+AS\s+(\w+)$", arg, re.I | re.S)
+        expr, nome = (m.group(1), m.group(2)) if m else (arg, arg.split(".")[-1])
+        if not re.match(r"^\w+$", nome):
+            raise Untranslatable(f"campo de STRUCT sem nome: {arg}")
+        campos.append(f"{nome} := {expr}")
+    return f"struct_pack({', '.join(campos)})"
+
+
+def _array_agg(args):
+    m = re.search(r"\bIGNORE\s+NULLS\b", args, re.I)
+    if not m:
+        return f"list({args})"
+    expr = args[:m.start()]
+    return f"list({expr}{args[m.end():]}) FILTER (WHERE ({expr}) IS NOT NULL)"
+
+
+def _normalize(args):
+    return f"strip_accents({split_top(args)[0]})"
+
+
+def _join_unnest(sql):
+    pattern = re.compile(r"\b((?:LEFT\s+|CROSS\s+|INNER\s+)?JOIN)\s+UNNEST\s*\(", re.I)
+    while True:
+        m = pattern.search(sql)
+        if not m:
+            return sql
+        close = _closing(sql, m.end() - 1)
+        alias = re.match(r"\s+AS\s+(\w+)", sql[close + 1:], re.I)
+        if not alias:
+            raise Untranslatable("JOIN UNNEST sem alias")
+        join = "LEFT JOIN" if m.group(1).upper().startswith("LEFT") else "JOIN"
+        sql = (sql[:m.start()] + f"{join} LATERAL (SELECT UNNEST({sql[m.end():close]}) AS {alias.group(1)}) ON TRUE"
+               + sql[close + 1 + alias.end():])
+
+
+def to_duckdb(sql, types=None):
+    """Traduz o dialeto do painel (BigQuery) para DuckDB.
+
+    Parâmetros @nome viram $nome, com CAST pelo tipo declarado quando
+    informado em types ({nome: tipo BigQuery}). Levanta Untranslatable
+    para o que não tem tradução.
+    """
+    types = types or {}
+
+    def rewrite(part):
+        for pattern, repl in _REWRITES:
+            part = pattern.sub(repl, part)
+        part = _rewrite_calls(part, "STRUCT", _struct)
+        part = _rewrite_calls(part, "ARRAY_AGG", _array_agg)
+        part = _rewrite_calls(part, "NORMALIZE", _normalize)
+        part = _join_unnest(part)
+        return re.sub(r"@(\w+)", lambda m: _param_ref(m.group(1), types.get(m.group(1))), part)
+
+    if re.search(r"\bSAFE\.|\bQUALIFY\b|\bPIVOT\b", sql, re.I):
+        raise Untranslatable("construção sem tradução")
+    return outside_strings(sql, rewrite)
+
+
+def outside_strings(sql, fn):
+    """Aplica fn no SQL com os literais de texto protegidos (trocados por marcadores e devolvidos)."""
+    literais = []
+
+    def guardar(m):
+        literal = m.group(0)
+        if literal.startswith("r"):
+            # regex crua: \uXXXX do BigQuery vira \x{XXXX} no RE2 do DuckDB
+            literal = re.sub(r"\\u([0-9a-fA-F]{4})", r"\\x{\1}", literal[1:])
+        if literal.startswith('"'):
+            # no BigQuery aspas duplas também são texto; no DuckDB são identificador
+            literal = "'" + literal[1:-1].replace("'", "''") + "'"
+        literais.append(literal)
+        return f"'\x00{len(literais) - 1}\x00'"
+
+    marcado = _STRING.sub(guardar, sql)
+    return re.sub(r"'\x00(\d+)\x00'", lambda m: literais[int(m.group(1))], fn(marcado))
+
+
+def _param_ref(name, bq_type):
+    if not bq_type:
+        return f"${name}"
+    if bq_type.startswith("ARRAY<STRUCT") or bq_type == "STRUCT":
+        return f"${name}"
+    if bq_type.startswith("ARRAY<"):
+        return f"CAST(${name} AS {TYPES.get(bq_type[6:-1], 'VARCHAR')}[])"
+    return f"CAST(${name} AS {TYPES.get(bq_type, 'VARCHAR')})"
+
+
+# ============================================================
+# PARÂMETROS DO BIGQUERY → VALORES PYTHON
+# ============================================================
+def _coerce(value, bq_type):
+    if value is None or bq_type is None:
+        return value
+    if bq_type in ("INT64", "INTEGER"):
+        return int(value)
+    if bq_type in ("FLOAT64", "FLOAT"):
+        return float(value)
+    if bq_type in ("NUMERIC", "BIGNUMERIC"):
+        return Decimal(str(value))
+    if bq_type in ("BOOL", "BOOLEAN"):
+        return value if isinstance(value, bool) else str(value).lower() in ("1", "true")
+    if bq_type == "DATE" and isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if bq_type in ("TIMESTAMP", "DATETIME") and isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
+def _struct_value(p):
+    return {name: _coerce(value, p.struct_types.get(name)) for name, value in p.struct_values.items()}
+
+
+def param_values(params):
+    """({nome: valor}, {nome: tipo BigQuery}) a partir da lista/dict de parâmetros do painel."""
+    if not params:
+        return {}, {}
+    if isinstance(params, dict):
+        return dict(params), {k: ("INT64" if isinstance(v, int) else "STRING") for k, v in params.items()}
+    values, types = {}, {}
+    for p in params:
+        if hasattr(p, "array_type"):
+            if p.array_type == "STRUCT":
+                values[p.name] = [_struct_value(v) for v in p.values]
+                types[p.name] = "ARRAY<STRUCT>"
+            else:
+                values[p.name] = [_coerce(v, p.array_type) for v in p.values]
+                types[p.name] = f"ARRAY<{p.array_type}>"
+        elif hasattr(p, "struct_values"):
+            values[p.name] = _struct_value(p)
+            types[p.name] = "STRUCT"
+        else:
+            values[p.name] = _coerce(p.value, p.type_)
+            types[p.name] = p.type_
+    return values, types
+
+
+def used_params(sql, values):
+    """Só os valores citados no SQL traduzido (o DuckDB recusa parâmetros sobrando)."""
+    citados = set(re.findall(r"\$(\w+)", sql))
+    return {k: v for k, v in values.items() if k in citados}
@@ -0,0 +1,223 @@
+# utils/event_writer.py
+# -*- coding: utf-8 -*-
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from google.cloud import bigquery
+
+EVENT_FIELDS = (("sk_chip", "INT64"), ("tipo_evento", "STRING"), ("origem", "STRING"), ("observacao", "STRING"), ("created_at", "TIMESTAMP"))
+# teto da espera entre tentativas depois de falha na gravação
+MAX_BACKOFF_SEC = 300
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+# ============================================================
+# ESCRITOR DE EVENTOS EM LOTE (f_chip_evento)
+# ============================================================
+class EventWriter:
+    """Fila em memória de eventos de auditoria, gravados em lote por uma thread.
+
+    enqueue() só empilha e retorna: a rota não paga um job de DML por
+    evento. A thread grava quando a fila chega a batch_size ou a cada
+    flush_sec, num único INSERT ... SELECT FROM UNNEST(@eventos). Perda
+    limitada: a fila tem no máximo max_queue eventos (os mais antigos são
+    descartados e contados) e, se spool_path estiver definido, o que não
+    puder ser gravado no desligamento vai para um arquivo JSONL que é
+    reenfileirado na próxima subida do processo.
+    """
+
+    def __init__(self, bq, table="f_chip_evento", batch_size=None, flush_sec=None, max_queue=None, spool_path=None):
+        self.bq = bq
+        self.table = table
+        self.batch_size = batch_size or _env_int("EVENT_BATCH_SIZE", 200)
+        self.flush_sec = flush_sec or _env_int("EVENT_FLUSH_SEC", 5)
+        self.max_queue = max_queue or _env_int("EVENT_QUEUE_MAX", 10000)
+        self.spool_path = spool_path if spool_path is not None else os.getenv("EVENT_SPOOL_PATH", "")
+        self._queue = deque()
+        self._in_flight = []  # lote saído da fila e ainda não confirmado pelo insert
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_error = None
+        atexit.register(self.close)
+
+    # --------------------------------------------------------
+    # API
+    # --------------------------------------------------------
+    def enqueue(self, sk_chip, tipo, observacao, origem="Painel"):
+        event = {
+            "sk_chip": int(sk_chip),
+            "tipo_evento": tipo,
+            "origem": origem,
+            "observacao": observacao,
+            "created_at": datetime.now(timezone.utc),
+        }
+        with self._cond:
+            self._push([event])
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_thread()
+
+    def pending_for(self, sk_chip):
+        """Há evento do chip na fila ou no lote sendo gravado (flush() espera esse lote terminar)."""
+        with self._cond:
+            return any(e["sk_chip"] == sk_chip for e in self._queue) or any(e["sk_chip"] == sk_chip for e in self._in_flight)
+
+    def flush(self):
+        """Grava tudo o que está na fila agora (bloqueante). Devolve quantos gravou."""
+        total = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                    self._in_flight = batch
+                if not batch:
+                    return total
+                try:
+                    self._write(batch)
+                except Exception as exc:
+                    self.failures += 1
+                    self.last_error = str(exc)
+                    with self._cond:
+                        # devolve o lote para a frente da fila; respeita o limite
+                        self._in_flight = []
+                        self._queue.extendleft(reversed(batch))
+                        self._trim()
+                    raise
+                with self._cond:
+                    self._in_flight = []
+                total += len(batch)
+                self.written += len(batch)
+                self.last_error = None
+
+    def close(self):
+        """Drena a fila no desligamento; o que falhar vai para o spool (se houver)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        try:
+            self.flush()
+        except Exception as exc:
+            print(f"[EventWriter] Aviso: {len(self._queue)} evento(s) não gravados no desligamento: {exc}")
+            self._save_spool()
+
+    @property
+    def max_latency_sec(self):
+        """Atraso máximo entre created_at e o commit, sem contar spool de um restart (flush + backoff)."""
+        return self.flush_sec + MAX_BACKOFF_SEC
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {"queued": queued, "written": self.written, "dropped": self.dropped, "failures": self.failures, "last_error": self.last_error}
+
+    # --------------------------------------------------------
+    # INTERNOS
+    # --------------------------------------------------------
+    def _push(self, events):
+        self._queue.extend(events)
+        self._trim()
+
+    def _trim(self):
+        excess = len(self._queue) - self.max_queue
+        if excess > 0:
+            for _ in range(excess):
+                self._queue.popleft()
+            self.dropped += excess
+            print(f"[EventWriter] Aviso: fila cheia, {excess} evento(s) antigo(s) descartado(s)")
+
+    def _ensure_thread(self):
+        # a thread é por processo: workers do gunicorn criados por fork não herdam a do master
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._load_spool()
+            self._thread = threading.Thread(target=self._loop, name="event-writer", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        backoff = self.flush_sec
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._cond.wait(timeout=self.flush_sec)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+                backoff = self.flush_sec
+            except Exception as exc:
+                backoff = min(backoff * 2, MAX_BACKOFF_SEC)
+                print(f"[EventWriter] Erro ao gravar eventos (nova tentativa em {backoff}s): {exc}")
+                # espera o backoff inteiro: fila cheia não pode virar laço de tentativas
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stopping, timeout=backoff)
+
+    def _write(self, batch):
+        eventos = [
+            bigquery.StructQueryParameter(None, *(bigquery.ScalarQueryParameter(name, typ, event[name]) for name, typ in EVENT_FIELDS))
+            for event in batch
+        ]
+        columns = ", ".join(name for name, _ in EVENT_FIELDS)
+        started_at = time.perf_counter()
+        self.bq.run(f"""
+            INSERT INTO `{self.bq.project}.{self.bq.dataset}.{self.table}` ({columns})
+            SELECT {columns} FROM UNNEST(@eventos)
+        """, [bigquery.ArrayQueryParameter("eventos", "STRUCT", eventos)], writes=(self.table,))
+        print(f"[EventWriter] {len(batch)} evento(s) gravados tempo_ms={int((time.perf_counter() - started_at) * 1000)}")
+
+    def _save_spool(self):
+        if not self.spool_path:
+            return
+        with self._cond:
+            events, self._queue = list(self._queue), deque()
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as fh:
+                for event in events:
+                    fh.write(json.dumps(dict(event, created_at=event["created_at"].isoformat())) + "\n")
+            print(f"[EventWriter] {len(events)} evento(s) salvos em {self.spool_path}")
+        except Exception as exc:
+            self.dropped += len(events)
+            print(f"[EventWriter] Erro ao salvar spool {self.spool_path}: {exc}")
+
+    def _load_spool(self):
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        # rename atômico: só um worker reenfileira o spool
+        claimed = f"{self.spool_path}.{os.getpid()}"
+        try:
+            os.rename(self.spool_path, claimed)
+        except OSError:
+            return
+        try:
+            with open(claimed, encoding="utf-8") as fh:
+                events = [json.loads(line) for line in fh if line.strip()]
+            os.remove(claimed)
+        except Exception as exc:
+            print(f"[EventWriter] Erro ao ler spool {claimed}: {exc}")
+            return
+        for event in events:
+            event["created_at"] = datetime.fromisoformat(event["created_at"])
+        self._push(events)
+        print(f"[EventWriter] {len(events)} evento(s) do spool reenfileirados")
@@ -0,0 +1,391 @@
+# utils/local_engine.py
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+from pathlib import Path
+
+from utils.duckdb_sql import MACROS, TYPES, find_top, outside_strings, param_values, split_top, to_duckdb, used_params
+
+try:
+    import duckdb
+except ImportError:  # motor local é opcional (BQ_BACKEND=local / benchmark)
+    duckdb = None
+
+SCHEMA_SQL = Path(__file__).resolve().parent.parent / "sql" / "local" / "schema.sql"
+_VAR_PREFIX = "__v_"
+# coluna sem alias que era uma variável do script: volta a ter o nome da variável
+_VAR_COLUMN = re.compile(r"^(?:CAST\()?\$__v_(\w+)")
+
+
+class ScriptError(RuntimeError):
+    """Erro levantado pelo script (RAISE) ou por uma SP emulada, como no BigQuery."""
+
+
+# ============================================================
+# RESULTADO NO FORMATO DO RowIterator
+# ============================================================
+class LocalRow(dict):
+    """Linha com o acesso do bigquery.Row: row["col"], row.col, items(), get()."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class LocalResult:
+    def __init__(self, columns=None, rows=None, page_size=None):
+        self.columns = columns or []
+        self._rows = rows or []
+        self.page_size = page_size
+        self.total_rows = len(self._rows)
+
+    def __iter__(self):
+        return (LocalRow(zip(self.columns, row)) for row in self._rows)
+
+    @property
+    def pages(self):
+        size = self.page_size or max(len(self._rows), 1)
+        for start in range(0, len(self._rows), size):
+            yield [LocalRow(zip(self.columns, row)) for row in self._rows[start:start + size]]
+
+    def to_dataframe(self, **_):
+        import pandas as pd
+        return pd.DataFrame.from_records(self._rows, columns=self.columns)
+
+    def to_arrow(self, **_):
+        import pyarrow as pa
+        return pa.Table.from_pylist([dict(zip(self.columns, row)) for row in self._rows])
+
+
+class LocalJob:
+    def __init__(self, result):
+        self._result = result
+
+    def result(self, page_size=None, **_):
+        self._result.page_size = page_size
+        return self._result
+
+
+# ============================================================
+# MOTOR LOCAL (DuckDB) COM A INTERFACE DO bigquery.Client
+# ============================================================
+class LocalEngine:
+    """Backend de consultas em memória (DuckDB) para rodar o painel sem BigQuery.
+
+    Implementa a parte do bigquery.Client usada pelo BigQueryClient:
+    query(sql, job_config) → job.result() (iterável de linhas, pages,
+    to_dataframe, to_arrow) e load_table_from_json. O SQL do painel é
+    traduzido por utils.duckdb_sql; scripts (DECLARE/SET/IF/RAISE,
+    transações, tabelas temporárias) são interpretados aqui e as stored
+    procedures são emuladas em Python (PROCEDURES). Escritas são
+    serializadas por um lock, como os jobs de DML na mesma tabela.
+    """
+
+    def __init__(self, path=":memory:", schema=True):
+        if duckdb is None:
+            raise RuntimeError("Motor local indisponível: instale duckdb.")
+        self._con = duckdb.connect(path)
+        self._con.execute("SET TimeZone = 'UTC'")
+        for macro in MACROS:
+            self._con.execute(macro)
+        if schema:
+            self.execute_file(SCHEMA_SQL)
+        self._write_lock = threading.RLock()
+        self.queries = 0
+
+    def execute_file(self, path):
+        texto = re.sub(r"--[^\n]*", "", Path(path).read_text(encoding="utf-8"))
+        for stmt in split_top(texto, ";"):
+            if stmt.strip():
+                self._con.execute(stmt)
+
+    def cursor(self):
+        return self._con.cursor()
+
+    # --------------------------------------------------------
+    # INTERFACE DO bigquery.Client
+    # --------------------------------------------------------
+    def query(self, sql, job_config=None, **_):
+        params = getattr(job_config, "query_parameters", None) if job_config is not None else None
+        values, types = param_values(params)
+        self.queries += 1
+        cur = self.cursor()
+        try:
+            if _is_script(sql):
+                with self._write_lock:
+                    result = _Script(self, cur, values, types).run(sql)
+            elif re.match(r"\s*(SELECT|WITH)\b", sql, re.I):
+                result = _run(cur, sql, values, types)
+            else:
+                with self._write_lock:
+                    result = _run(cur, sql, values, types)
+        finally:
+            cur.close()
+        return LocalJob(result)
+
+    def load_table_from_json(self, rows, table_id, job_config=None, **_):
+        table = table_id.split(".")[-1]
+        schema = getattr(job_config, "schema", None) or []
+        disposition = getattr(job_config, "write_disposition", None) or "WRITE_APPEND"
+        with self._write_lock:
+            cur = self.cursor()
+            try:
+                cols = ", ".join(f'"{f.name}" {TYPES.get(f.field_type, "VARCHAR")}' for f in schema)
+                if disposition == "WRITE_TRUNCATE" or not _exists(cur, table):
+                    cur.execute(f'CREATE OR REPLACE TABLE "{table}" ({cols})')
+                names = [f.name for f in schema]
+                if rows:
+                    marks = ", ".join("?" for _ in names)
+                    cur.executemany(f'INSERT INTO "{table}" ({", ".join(names)}) VALUES ({marks})', [[row.get(n) for n in names] for row in rows])
+            finally:
+                cur.close()
+        return LocalJob(LocalResult())
+
+
+def _exists(cur, table):
+    return bool(cur.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [table]).fetchone()[0])
+
+
+def _is_script(sql):
+    return bool(re.match(r"\s*(DECLARE|BEGIN|CALL|IF)\b", sql, re.I)) or len([s for s in split_top(sql, ";") if s.strip()]) > 1
+
+
+def _run(cur, sql, values, types):
+    translated = to_duckdb(sql, types)
+    cur.execute(translated, used_params(translated, values))
+    if cur.description is None:
+        return LocalResult()
+    columns = [(_VAR_COLUMN.match(d[0]) or [d[0], d[0]])[1] for d in cur.description]
+    return LocalResult(columns, cur.fetchall())
+
+
+# ============================================================
+# INTERPRETADOR DE SCRIPTS DO BIGQUERY
+# ============================================================
+class _Script:
+    """DECLARE / SET / IF-ELSEIF-ELSE / RAISE / BEGIN-COMMIT / CALL + statements SQL.
+
+    Variáveis viram parâmetros ($__v_nome) com o tipo declarado; o
+    resultado é o do último statement executado, como no job do BigQuery.
+    """
+
+    def __init__(self, engine, cur, values, types):
+        self.engine = engine
+        self.cur = cur
+        self.values = dict(values)
+        self.types = dict(types)
+        self.vars = {}
+        self.result = LocalResult()
+        self.in_transaction = False
+
+    def run(self, sql):
+        tree, _ = self._parse(_tokens(sql), 0, ())
+        try:
+            self._exec(tree)
+        except Exception:
+            if self.in_transaction:
+                self.cur.execute("ROLLBACK")
+            raise
+        return self.result
+
+    # --- parsing ---------------------------------------------
+    def _parse(self, tokens, pos, stop):
+        nodes = []
+        while pos < len(tokens):
+            kind, text = tokens[pos]
+            if kind in stop:
+                return nodes, pos
+            if kind == "IF":
+                branches, otherwise = [], []
+                body, pos = self._parse(tokens, pos + 1, ("ELSEIF", "ELSE", "ENDIF"))
+                branches.append((text, body))
+                while tokens[pos][0] == "ELSEIF":
+                    cond = tokens[pos][1]
+                    body, pos = self._parse(tokens, pos + 1, ("ELSEIF", "ELSE", "ENDIF"))
+                    branches.append((cond, body))
+                if tokens[pos][0] == "ELSE":
+                    otherwise, pos = self._parse(tokens, pos + 1, ("ENDIF",))
+                nodes.append(("IF", branches, otherwise))
+                pos += 1
+                continue
+            nodes.append(("STMT", text))
+            pos += 1
+        return nodes, pos
+
+    # --- execução --------------------------------------------
+    def _exec(self, nodes):
+        for node in nodes:
+            if node[0] == "IF":
+                for cond, body in node[1]:
+                    if self._scalar(cond):
+                        self._exec(body)
+                        break
+                else:
+                    self._exec(node[2])
+            else:
+                self._statement(node[1])
+
+    def _statement(self, stmt):
+        m = re.match(r"DECLARE\s+([\w\s,]+?)\s+([A-Z0-9_<>]+)(?:\s+DEFAULT\s+(.+))?$", stmt, re.I | re.S)
+        if m:
+            valor = self._scalar(m.group(3)) if m.group(3) else None
+            for nome in (n.strip() for n in m.group(1).split(",")):
+                self.vars[nome] = m.group(2).upper()
+                self.values[_VAR_PREFIX + nome] = valor
+                self.types[_VAR_PREFIX + nome] = m.group(2).upper()
+            return
+        m = re.match(r"SET\s+(\w+)\s*=\s*(.+)$", stmt, re.I | re.S)
+        if m and m.group(1) in self.vars:
+            self.values[_VAR_PREFIX + m.group(1)] = self._scalar(m.group(2))
+            return
+        m = re.match(r"RAISE(?:\s+USING\s+MESSAGE\s*=\s*(.+))?$", stmt, re.I | re.S)
+        if m:
+            raise ScriptError(self._scalar(m.group(1)) if m.group(1) else "RAISE")
+        if re.match(r"BEGIN(\s+TRANSACTION)?$", stmt, re.I):
+            self.cur.execute("BEGIN TRANSACTION")
+            self.in_transaction = True
+            return
+        if re.match(r"COMMIT(\s+TRANSACTION)?$", stmt, re.I):
+            self.cur.execute("COMMIT")
+            self.in_transaction = False
+            return
+        if re.match(r"ROLLBACK(\s+TRANSACTION)?$", stmt, re.I):
+            self.cur.execute("ROLLBACK")
+            self.in_transaction = False
+            return
+        m = re.match(r"CALL\s+`?(?:[\w-]+\.)*(\w+)`?\s*\((.*)\)$", stmt, re.I | re.S)
+        if m:
+            proc = PROCEDURES.get(m.group(1))
+            if proc is None:
+                raise ScriptError(f"Procedure {m.group(1)} não emulada no motor local")
+            args = [a for a in split_top(m.group(2)) if a.strip()]
+            valores = list(self._row(", ".join(args))) if args else []
+            proc(self.cur, *valores)
+            self.result = LocalResult()
+            return
+        self.result = _run(self.cur, self._vars(stmt), self.values, self.types)
+
+    def _vars(self, sql):
+        if not self.vars:
+            return sql
+        pattern = re.compile(r"(?<![\w.@$])(" + "|".join(map(re.escape, self.vars)) + r")\b(?!\s*\()")
+        return outside_strings(sql, lambda part: pattern.sub(lambda m: "@" + _VAR_PREFIX + m.group(1), part))
+
+    def _row(self, exprs):
+        result = _run(self.cur, self._vars(f"SELECT {exprs}"), self.values, self.types)
+        return result._rows[0] if result._rows else (None,)
+
+    def _scalar(self, expr):
+        return self._row(f"({expr})")[0]
+
+
+def _tokens(sql):
+    """Statements do script já separados em IF/ELSEIF/ELSE/END IF e SQL puro."""
+    sql = re.sub(r"--[^\n]*", "", sql)
+    tokens = []
+    for stmt in split_top(sql, ";"):
+        stmt = stmt.strip()
+        while stmt:
+            m = re.match(r"END\s+IF\b", stmt, re.I)
+            if m:
+                tokens.append(("ENDIF", None))
+                stmt = stmt[m.end():].strip()
+                continue
+            m = re.match(r"(ELSEIF|IF)\s", stmt, re.I)
+            if m and not re.match(r"IF\s*\(", stmt, re.I):
+                then = find_top(stmt, r"\bTHEN\b")
+                if then is None:
+                    raise ScriptError(f"IF sem THEN: {stmt[:80]}")
+                tokens.append((m.group(1).upper(), stmt[m.end():then.start()].strip()))
+                stmt = stmt[then.end():].strip()
+                continue
+            m = re.match(r"ELSE\b", stmt, re.I)
+            if m:
+                tokens.append(("ELSE", None))
+                stmt = stmt[m.end():].strip()
+                continue
+            tokens.append(("STMT", stmt))
+            break
+    return tokens
+
+
+# ============================================================
+# STORED PROCEDURES EMULADAS
+# ============================================================
+def sp_insert_chip(cur, id_chip, numero, operadora, plano, status, observacao, origem):
+    cur.execute("""
+        INSERT INTO dim_chip (sk_chip, id_chip, numero, numero_limpo, operadora, plano, status, observacao, origem,
+                              ultima_recarga_valor, total_gasto, qt_disparos, qt_banimentos, data_status, ativo, created_at, updated_at)
+        SELECT COALESCE(MAX(sk_chip), 0) + 1, ?, ?, regexp_replace(?, '[^0-9]', '', 'g'), ?, ?, COALESCE(?, 'DISPONIVEL'), ?, ?,
+               NULL, 0, 0, 0, current_date, TRUE, current_timestamp, current_timestamp
+        FROM dim_chip
+    """, [id_chip, numero, numero, operadora, plano, status, observacao, origem])
+
+
+def sp_registrar_recarga_chip(cur, sk_chip, valor, origem, observacao):
+    cur.execute("""
+        UPDATE dim_chip SET ultima_recarga_valor = ?, ultima_recarga_data = current_date,
+               total_gasto = COALESCE(total_gasto, 0) + ?, updated_at = current_timestamp
+        WHERE sk_chip = ?
+    """, [valor, valor, sk_chip])
+
+
+def sp_vincular_aparelho_chip(cur, sk_chip, sk_aparelho, slot, origem, observacao):
+    cap = cur.execute("SELECT cap_whats_business FROM dim_aparelho WHERE sk_aparelho = ?", [sk_aparelho]).fetchone()
+    if cap is None:
+        raise ScriptError(f"Aparelho {sk_aparelho} não encontrado")
+    dono = cur.execute("""
+        SELECT sk_chip FROM dim_chip
+        WHERE sk_aparelho_atual = ? AND slot_whatsapp = ? AND sk_chip != ? AND COALESCE(ativo, TRUE)
+    """, [sk_aparelho, slot, sk_chip]).fetchone()
+    if dono is not None:
+        raise ScriptError(f"Slot {slot} já ocupado pelo chip {dono[0]}")
+    cur.execute("UPDATE f_chip_aparelho SET dt_fim = current_timestamp WHERE sk_chip = ? AND dt_fim IS NULL", [sk_chip])
+    cur.execute("INSERT INTO f_chip_aparelho VALUES (?, ?, ?, ?, ?, current_timestamp, NULL)", [sk_chip, sk_aparelho, slot, origem, observacao])
+    cur.execute("""
+        UPDATE dim_chip SET sk_aparelho_atual = ?, slot_whatsapp = ?,
+               tipo_whatsapp = COALESCE(tipo_whatsapp, IF(? <= ?, 'BUSINESS', 'NORMAL')), updated_at = current_timestamp
+        WHERE sk_chip = ?
+    """, [sk_aparelho, slot, slot, cap[0] or 0, sk_chip])
+
+
+def sp_desvincular_aparelho_chip(cur, sk_chip, origem, observacao):
+    cur.execute("UPDATE f_chip_aparelho SET dt_fim = current_timestamp WHERE sk_chip = ? AND dt_fim IS NULL", [sk_chip])
+    cur.execute("""
+        UPDATE dim_chip SET sk_aparelho_atual = NULL, slot_whatsapp = NULL, updated_at = current_timestamp
+        WHERE sk_chip = ?
+    """, [sk_chip])
+
+
+def sp_alterar_status_chip(cur, sk_chip, status, origem, observacao):
+    cur.execute("""
+        UPDATE dim_chip SET status = ?, data_status = current_date, updated_at = current_timestamp
+        WHERE sk_chip = ?
+    """, [status, sk_chip])
+
+
+PROCEDURES = {
+    "sp_insert_chip": sp_insert_chip,
+    "sp_registrar_recarga_chip": sp_registrar_recarga_chip,
+    "sp_vincular_aparelho_chip": sp_vincular_aparelho_chip,
+    "sp_desvincular_aparelho_chip": sp_desvincular_aparelho_chip,
+    "sp_alterar_status_chip": sp_alterar_status_chip,
+}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_local_engine():
+    """Motor local único do processo (BQ_BACKEND=local); BQ_LOCAL_PATH aponta para um arquivo .duckdb."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = LocalEngine(os.getenv("BQ_LOCAL_PATH", ":memory:"))
+    return _engine
@@ -0,0 +1,251 @@
+# utils/local_replica.py
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+
+from utils.duckdb_sql import MACROS, Untranslatable, param_values, to_duckdb, used_params
+from utils.query_cache import VIEW_DEPENDENCIES, normalize_sql, referenced_tables
+
+try:
+    import duckdb
+except ImportError:  # réplica é opcional: sem duckdb tudo continua indo ao BigQuery
+    duckdb = None
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+REPLICA_ENABLED = os.getenv("BQ_REPLICA_ENABLED", "0").lower() in ("1", "true", "sim")
+REPLICA_PATH = os.getenv("BQ_REPLICA_PATH", ":memory:")
+REPLICA_TABLES = [t.strip() for t in os.getenv("BQ_REPLICA_TABLES", "dim_chip,dim_aparelho,vw_chips_painel,f_chip_evento,f_chip_aparelho").split(",") if t.strip()]
+REPLICA_SYNC_SEC = _env_int("BQ_REPLICA_SYNC_SEC", 60)
+REPLICA_MAX_STALENESS_SEC = _env_int("BQ_REPLICA_MAX_STALENESS_SEC", 300)
+# tabelas só de inserção: sync incremental pela coluna de watermark em vez de cópia inteira
+INCREMENTAL = {"f_chip_evento": "created_at"}
+# a fila de eventos grava created_at de quando o evento entrou, até flush + backoff depois:
+# cada sync incremental relê essa janela antes do watermark e a substitui na réplica
+REPLICA_OVERLAP_SEC = _env_int("BQ_REPLICA_OVERLAP_SEC", 900)
+# eventos mais atrasados que a janela (spool reenfileirado num restart) entram na cópia inteira periódica
+REPLICA_FULL_SYNC_SEC = _env_int("BQ_REPLICA_FULL_SYNC_SEC", 3600)
+
+# scripts e metadados do BigQuery ficam fora da réplica
+_UNSUPPORTED = re.compile(r"INFORMATION_SCHEMA|\bDECLARE\b|\bCALL\b|\bBEGIN\b", re.I)
+
+
+class ReplicaMiss(Exception):
+    """A réplica não pode responder esta consulta (o chamador usa o BigQuery)."""
+
+
+# ============================================================
+# RÉPLICA LOCAL DE LEITURA (DuckDB)
+# ============================================================
+class LocalReplica:
+    """Cópia local (DuckDB) das tabelas do marts lidas pelas páginas.
+
+    Uma thread copia as tabelas a cada sync_sec (cópia inteira, ou
+    incremental para as tabelas de INCREMENTAL: relê as linhas desde o
+    watermark menos overlap_sec e troca essa janela inteira na réplica,
+    sem duplicar; a cada full_sync_sec a cópia é inteira). O BigQueryClient tenta
+    query() antes de ir ao BigQuery; a réplica recusa (ReplicaMiss) quando
+    alguma tabela lida não foi copiada, está mais velha que max_staleness
+    ou foi escrita por este processo depois do último sync (mark_dirty):
+    quem escreve lê o próprio dado no BigQuery até a próxima cópia.
+    Escritas continuam todas no BigQuery (SPs e DML). Consultas que o
+    DuckDB não entende são lembradas e passam a ir direto ao BigQuery.
+    """
+
+    def __init__(self, fetch=None, tables=REPLICA_TABLES, path=REPLICA_PATH, sync_sec=REPLICA_SYNC_SEC, max_staleness=REPLICA_MAX_STALENESS_SEC,
+                 overlap_sec=REPLICA_OVERLAP_SEC, full_sync_sec=REPLICA_FULL_SYNC_SEC):
+        if duckdb is None:
+            raise RuntimeError("Réplica local indisponível: instale duckdb.")
+        self._fetch = fetch  # fetch(tabela, coluna_watermark, watermark) → pyarrow.Table
+        self.tables = list(tables)
+        self.sync_sec = sync_sec
+        self.max_staleness = max_staleness
+        self.overlap_sec = overlap_sec
+        self.full_sync_sec = full_sync_sec
+        self._con = duckdb.connect(path)
+        self._con.execute("SET TimeZone = 'UTC'")
+        for macro in MACROS:
+            self._con.execute(macro)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._synced_at = {}     # tabela → time.monotonic() do início do último sync bem-sucedido
+        self._dirty_at = {}      # tabela → time.monotonic() da última escrita vista
+        self._watermarks = {}
+        self._full_at = {}       # tabela incremental → time.monotonic() da última cópia inteira
+        self._unsupported = set()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.last_error = None
+
+    # --------------------------------------------------------
+    # CARGA
+    # --------------------------------------------------------
+    def load(self, table, data, window=None):
+        """Grava na réplica um pyarrow.Table / DataFrame.
+
+        window=None substitui a tabela; window=(coluna, desde) troca só as
+        linhas com coluna > desde pelas de data (que trazem a janela inteira).
+        """
+        cur = self._con.cursor()
+        try:
+            cur.register("_replica_load", data)
+            if window is not None and self._exists(cur, table):
+                coluna, desde = window
+                # numa transação: leitores veem a janela antiga ou a nova, nunca sem ela
+                cur.execute("BEGIN TRANSACTION")
+                try:
+                    cur.execute(f'DELETE FROM "{table}" WHERE "{coluna}" > ?', [desde])
+                    cur.execute(f'INSERT INTO "{table}" SELECT * FROM _replica_load')
+                    cur.execute("COMMIT")
+                except Exception:
+                    cur.execute("ROLLBACK")
+                    raise
+            else:
+                # CREATE OR REPLACE é atômico: leitores veem a cópia antiga ou a nova
+                cur.execute(f'CREATE OR REPLACE TABLE "{table}" AS SELECT * FROM _replica_load')
+            cur.unregister("_replica_load")
+        finally:
+            cur.close()
+
+    @staticmethod
+    def _exists(cur, table):
+        return bool(cur.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [table]).fetchone()[0])
+
+    def sync_table(self, table):
+        started = time.monotonic()
+        coluna = INCREMENTAL.get(table)
+        watermark = self._watermarks.get(table) if coluna else None
+        desde = None
+        if watermark is not None and started - self._full_at.get(table, 0) < self.full_sync_sec:
+            desde = watermark - timedelta(seconds=self.overlap_sec)
+        data = self._fetch(table, coluna if desde is not None else None, desde)
+        self.load(table, data, window=(coluna, desde) if desde is not None else None)
+        if coluna and desde is None:
+            self._full_at[table] = started
+        if coluna and data.num_rows:
+            maximo = max((v for v in data.column(coluna).to_pylist() if v is not None), default=None)
+            if maximo is not None and (watermark is None or maximo > watermark):
+                self._watermarks[table] = maximo
+        with self._lock:
+            self._synced_at[table] = started
+            if self._dirty_at.get(table, 0) < started:
+                self._dirty_at.pop(table, None)
+        return data.num_rows
+
+    def sync(self):
+        for table in self.tables:
+            t0 = time.perf_counter()
+            try:
+                linhas = self.sync_table(table)
+                print(f"[Replica] {table}: {linhas} linha(s) copiadas tempo_ms={int((time.perf_counter() - t0) * 1000)}")
+            except Exception as exc:
+                self.last_error = f"{table}: {exc}"
+                print(f"[Replica] Erro ao copiar {table}: {exc}")
+
+    def start(self):
+        """Sobe a thread de sync (a réplica é criada por processo, depois do fork)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="bq-replica", daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while True:
+            self.sync()
+            self._wake.wait(timeout=self.sync_sec)
+            self._wake.clear()
+
+    def mark_dirty(self, tables=None):
+        """Escrita deste processo: as tabelas (e views que as leem) saem da réplica até o próximo sync."""
+        agora = time.monotonic()
+        alvo = set(self.tables) if tables is None else set(tables)
+        alvo |= {view for view, bases in VIEW_DEPENDENCIES.items() if bases & alvo}
+        with self._lock:
+            for table in alvo:
+                self._dirty_at[table] = agora
+        self._wake.set()
+
+    # --------------------------------------------------------
+    # LEITURA
+    # --------------------------------------------------------
+    def _check(self, sql):
+        tables = referenced_tables(sql)
+        if not tables:
+            raise ReplicaMiss("sem tabela do dataset")
+        agora = time.monotonic()
+        with self._lock:
+            for table in tables:
+                synced = self._synced_at.get(table)
+                if synced is None:
+                    raise ReplicaMiss(f"{table} fora da réplica")
+                if table in self._dirty_at:
+                    raise ReplicaMiss(f"{table} escrita depois do último sync")
+                if agora - synced > self.max_staleness:
+                    raise ReplicaMiss(f"{table} mais velha que {self.max_staleness}s")
+
+    def _execute(self, sql, params):
+        fingerprint = normalize_sql(sql)
+        try:
+            if fingerprint in self._unsupported:
+                raise ReplicaMiss("consulta já recusada pelo DuckDB")
+            self._check(sql)
+            if _UNSUPPORTED.search(sql):
+                raise ReplicaMiss("script ou metadados do BigQuery")
+            values, types = param_values(params)
+            translated = to_duckdb(sql, types)
+            values = used_params(translated, values)
+        except Untranslatable as exc:
+            self._unsupported.add(fingerprint)
+            self.misses += 1
+            raise ReplicaMiss(str(exc)) from exc
+        except ReplicaMiss:
+            self.misses += 1
+            raise
+        cur = self._con.cursor()
+        try:
+            return cur, cur.execute(translated, values) if values else cur.execute(translated)
+        except Exception as exc:
+            cur.close()
+            self._unsupported.add(fingerprint)
+            self.misses += 1
+            print(f"[Replica] Consulta passa a ir ao BigQuery: {exc}")
+            raise ReplicaMiss(str(exc)) from exc
+
+    def query(self, sql, params=None):
+        """Linhas como list[dict], ou ReplicaMiss."""
+        cur, result = self._execute(sql, params)
+        try:
+            columns = [d[0] for d in result.description]
+            rows = [dict(zip(columns, row)) for row in result.fetchall()]
+        finally:
+            cur.close()
+        self.hits += 1
+        return rows
+
+    def query_df(self, sql, params=None):
+        """Resultado como DataFrame, ou ReplicaMiss."""
+        cur, result = self._execute(sql, params)
+        try:
+            df = result.df()
+        finally:
+            cur.close()
+        self.hits += 1
+        return df
+
+    def stats(self):
+        agora = time.monotonic()
+        with self._lock:
+            idade = {t: int(agora - s) for t, s in self._synced_at.items()}
+            sujas = sorted(self._dirty_at)
+        return {"tabelas": idade, "sujas": sujas, "hits": self.hits, "misses": self.misses, "nao_suportadas": len(self._unsupported), "last_error": self.last_error}
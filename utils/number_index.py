@@ -0,0 +1,192 @@
+# utils/number_index.py
+# -*- coding: utf-8 -*-
+
+import heapq
+import re
+import threading
+import time
+from collections import defaultdict
+
+from google.cloud import bigquery
+
+from utils.bigquery_client import get_bq
+
+NGRAM_SIZES = (2, 3)
+
+
+def _digits(value):
+    return re.sub(r"\D+", "", str(value or ""))
+
+
+def _ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# ============================================================
+# ÍNDICE RESIDENTE DE NÚMEROS (AUTOCOMPLETE)
+# ============================================================
+class ChipNumberIndex:
+    """Índice em memória (por worker) de números de chip para busca por substring.
+
+    Guarda bigramas e trigramas de only_digits(numero) → sk_chip. A busca
+    intersecta as listas dos n-gramas do termo e confirma o substring só
+    nos candidatos, sem varrer a frota. Também mantém número limpo → sk_chip
+    dos chips ativos, para a checagem de duplicado (lookup) sem consulta.
+    O loader recebe o watermark
+    (updated_at máximo já visto, ou None na carga inicial) e devolve as
+    linhas alteradas desde então: dicts com sk_chip, numero, operadora,
+    ativo e updated_at.
+    """
+
+    def __init__(self, loader, refresh_sec=60):
+        self._loader = loader
+        self.refresh_sec = refresh_sec
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._chips = {}
+        self._grams = defaultdict(set)
+        self._by_digits = defaultdict(set)
+        self._watermark = None
+        self._refreshed_at = 0.0
+        self._built = False
+
+    # --------------------------------------------------------
+    # MANUTENÇÃO
+    # --------------------------------------------------------
+    def _remove(self, sk_chip):
+        chip = self._chips.pop(sk_chip, None)
+        if chip is None:
+            return
+        owners = self._by_digits.get(chip["digits"])
+        if owners is not None:
+            owners.discard(sk_chip)
+            if not owners:
+                del self._by_digits[chip["digits"]]
+        for n in NGRAM_SIZES:
+            for gram in _ngrams(chip["digits"], n):
+                bucket = self._grams.get(gram)
+                if bucket is not None:
+                    bucket.discard(sk_chip)
+                    if not bucket:
+                        del self._grams[gram]
+
+    def upsert(self, sk_chip, numero, operadora=None, ativo=True):
+        if sk_chip is None:
+            return
+        sk_chip = int(sk_chip)
+        with self._lock:
+            self._remove(sk_chip)
+            if ativo is False:
+                return
+            digits = _digits(numero)
+            self._chips[sk_chip] = {
+                "sk_chip": sk_chip,
+                "numero": numero,
+                "operadora": operadora,
+                "digits": digits,
+                "lower": str(numero or "").lower(),
+            }
+            self._by_digits[digits].add(sk_chip)
+            for n in NGRAM_SIZES:
+                for gram in _ngrams(digits, n):
+                    self._grams[gram].add(sk_chip)
+
+    def remove(self, sk_chip):
+        with self._lock:
+            self._remove(int(sk_chip))
+
+    def refresh(self):
+        """Aplica as linhas alteradas desde o último watermark."""
+        with self._refresh_lock:
+            rows = self._loader(self._watermark)
+            for row in rows:
+                self.upsert(row.get("sk_chip"), row.get("numero"), row.get("operadora"), row.get("ativo"))
+                updated_at = row.get("updated_at")
+                if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+                    self._watermark = updated_at
+            self._refreshed_at = time.monotonic()
+            self._built = True
+
+    def _ensure_fresh(self):
+        if not self._built:
+            self.refresh()
+            return
+        if time.monotonic() - self._refreshed_at < self.refresh_sec:
+            return
+        # refresh incremental em segundo plano: o autocomplete não espera o BigQuery
+        if self._refresh_lock.locked():
+            return
+        self._refreshed_at = time.monotonic()
+        threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as exc:
+            print(f"[NumberIndex] Aviso: refresh incremental falhou: {exc}")
+
+    # --------------------------------------------------------
+    # BUSCA
+    # --------------------------------------------------------
+    def search(self, termo, limit=20):
+        """Top-N chips cujo número contém o termo (dígitos ou texto)."""
+        self._ensure_fresh()
+        termo = str(termo or "").strip().lower()
+        digits = _digits(termo)
+
+        with self._lock:
+            if len(digits) >= 2:
+                n = 3 if len(digits) >= 3 else 2
+                grams = sorted((self._grams.get(g, set()) for g in _ngrams(digits, n)), key=len)
+                candidates = set(grams[0]).intersection(*grams[1:]) if grams else set()
+                matches = [self._chips[sk] for sk in candidates if digits in self._chips[sk]["digits"]]
+                position = lambda c: c["digits"].find(digits)
+            else:
+                matches = [c for c in self._chips.values() if termo in c["lower"]]
+                position = lambda c: c["lower"].find(termo)
+
+            # começo do número primeiro, depois ordem do número
+            top = heapq.nsmallest(limit, matches, key=lambda c: (position(c), c["digits"]))
+            return [
+                {"sk_chip": c["sk_chip"], "numero": c["numero"], "operadora": c["operadora"]}
+                for c in top
+            ]
+
+    def lookup(self, digits):
+        """sk_chips ativos com exatamente este número limpo (conjunto vazio = não é duplicado)."""
+        self._ensure_fresh()
+        with self._lock:
+            return set(self._by_digits.get(_digits(digits), ()))
+
+    def __len__(self):
+        return len(self._chips)
+
+
+def _carregar_numeros(since):
+    bq = get_bq()
+    where = "WHERE COALESCE(ativo, TRUE) = TRUE"
+    params = None
+    if since is not None:
+        # incremental: inclui desativados para removê-los do índice
+        where = "WHERE updated_at >= @since"
+        params = [bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)]
+    rows = bq.run(f"""
+        SELECT sk_chip, numero, operadora, COALESCE(ativo, TRUE) AS ativo, updated_at
+        FROM `{bq.project}.{bq.dataset}.dim_chip`
+        {where}
+    """, params=params)
+    return [dict(r.items()) for r in rows]
+
+
+_number_index = None
+_number_index_lock = threading.Lock()
+
+
+def get_number_index():
+    """Índice de números único do processo (autocomplete da movimentação + duplicados em chips)."""
+    global _number_index
+    if _number_index is None:
+        with _number_index_lock:
+            if _number_index is None:
+                _number_index = ChipNumberIndex(_carregar_numeros)
+    return _number_index
@@ -0,0 +1,179 @@
+# utils/query_cache.py
+# -*- coding: utf-8 -*-
+
+import json
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# `projeto.dataset.tabela` → tabela
+_TABLE_REF = re.compile(r"`[^`.]+\.[^`.]+\.([^`]+)`")
+
+# Views do painel → tabelas que elas leem. Escrever numa tabela derruba as views dependentes.
+# As views de chips não leem f_chip_evento: a fila de eventos grava a cada poucos segundos
+# e derrubaria a lista, os stats e o dashboard a cada flush.
+VIEW_DEPENDENCIES = {
+    "vw_chips_painel": {"dim_chip", "dim_aparelho", "f_chip_aparelho"},
+    "vw_chips_painel_base": {"dim_chip", "dim_aparelho", "f_chip_aparelho"},
+    "vw_relacionamentos_whatsapp": {"dim_chip", "dim_aparelho"},
+    "vw_aparelhos": {"dim_aparelho", "dim_chip"},
+    "vw_chip_timeline": {"dim_chip", "f_chip_evento", "f_chip_aparelho"},
+}
+
+
+def referenced_tables(sql):
+    """Tabelas/views citadas no SQL (nome curto, sem projeto/dataset)."""
+    return {name.lower() for name in _TABLE_REF.findall(sql or "")}
+
+
+def cache_tags(sql):
+    """Tags de um SELECT: tabelas lidas + tabelas base das views lidas."""
+    tags = referenced_tables(sql)
+    for view in list(tags):
+        tags |= VIEW_DEPENDENCIES.get(view, set())
+    return tags
+
+
+def normalize_sql(sql):
+    return " ".join((sql or "").split())
+
+
+def _param_repr(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return sorted(params.items())
+    return [p.to_api_repr() if hasattr(p, "to_api_repr") else repr(p) for p in params]
+
+
+def cache_key(sql, params=None):
+    return normalize_sql(sql) + "|" + json.dumps(_param_repr(params), sort_keys=True, default=str)
+
+
+def estimate_size(value):
+    """Bytes aproximados de um DataFrame ou de uma lista de dicts (run_rows)."""
+    if hasattr(value, "memory_usage"):
+        try:
+            return int(value.memory_usage(index=True, deep=True).sum())
+        except Exception:
+            return 0
+    if isinstance(value, list):
+        if not value:
+            return sys.getsizeof(value)
+        sample = value[0]
+        per_row = sys.getsizeof(sample) + sum(sys.getsizeof(v) for v in sample.values())
+        return sys.getsizeof(value) + per_row * len(value)
+    return sys.getsizeof(value)
+
+
+# ============================================================
+# CACHE DE RESULTADOS — LRU + TTL + LIMITE DE MEMÓRIA
+# ============================================================
+class QueryResultCache:
+    """Cache em memória (por processo) de resultados de run_df / run_rows.
+
+    Entradas expiram por TTL e são removidas em ordem LRU quando o total
+    estimado passa de max_bytes. Cada entrada é marcada com as tabelas que
+    leu; invalidate() derruba só as entradas afetadas por uma escrita.
+    Quem vai consultar pega generation() antes e passa para put(): se
+    alguma tabela lida foi invalidada no meio, o resultado (anterior à
+    escrita) não é guardado. A invalidação vale só para este processo;
+    escritas de outro worker aparecem aqui quando o TTL vence.
+    Os objetos guardados são compartilhados: trate como somente-leitura.
+    """
+
+    def __init__(self, max_bytes, ttl_sec):
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+        self._generation = 0
+        self._tag_generation = {}   # tabela → geração da última invalidação
+        self._clear_generation = 0  # geração do último invalidate() sem tabelas
+
+    def generation(self):
+        """Marca a tomar antes da consulta; put() recusa o resultado se houve invalidação depois."""
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.monotonic() - entry["stored_at"] > self.ttl_sec:
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key, value, tags, generation=None):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        tags = {t.lower() for t in tags}
+        with self._lock:
+            if generation is not None and self._invalidated_since(tags, generation):
+                self.stale_puts += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {"value": value, "tags": tags, "size": size, "stored_at": time.monotonic()}
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables=None):
+        """Remove entradas que leram alguma das tabelas (None → limpa tudo)."""
+        with self._lock:
+            self._generation += 1
+            if tables is None:
+                self._clear_generation = self._generation
+                removed = len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                tables = {t.lower() for t in tables}
+                for table in tables:
+                    self._tag_generation[table] = self._generation
+                stale = [k for k, e in self._entries.items() if e["tags"] & tables]
+                for key in stale:
+                    self._drop(key)
+                removed = len(stale)
+            self.invalidations += removed
+            return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
+
+    def _invalidated_since(self, tags, generation):
+        if self._clear_generation > generation:
+            return True
+        return any(self._tag_generation.get(tag, 0) > generation for tag in tags)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
@@ -0,0 +1,150 @@
+# utils/query_guard.py
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+import time
+
+from utils.query_metrics import current_route, fingerprint
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_map(name):
+    """Lê "rota=valor,rota=valor" → {rota: int} (entradas inválidas são ignoradas)."""
+    valores = {}
+    for item in os.getenv(name, "").split(","):
+        rota, _, valor = item.strip().rpartition("=")
+        try:
+            valores[rota.strip()] = int(valor)
+        except ValueError:
+            continue
+    return valores
+
+
+MB = 1024 * 1024
+
+GUARD_ENABLED = os.getenv("BQ_GUARD_ENABLED", "1").lower() in ("1", "true", "sim")
+# teto padrão de bytes cobrados por job e orçamentos por rota (rota do url_map ou "background")
+MAX_BYTES_BILLED = _env_int("BQ_MAX_BYTES_BILLED_MB", 10240) * MB
+ROUTE_MAX_BYTES = {rota: mb * MB for rota, mb in _env_map("BQ_ROUTE_MAX_MB").items()}
+# tempo máximo de cada job (cancelado no BigQuery ao passar) e por rota
+TIMEOUT_SEC = _env_int("BQ_TIMEOUT_SEC", 60)
+ROUTE_TIMEOUT_SEC = _env_map("BQ_ROUTE_TIMEOUT_SEC")
+# validade da estimativa do dry run por fingerprint (as tabelas crescem)
+ESTIMATE_TTL_SEC = _env_int("BQ_ESTIMATE_TTL_SEC", 3600)
+
+_READ_SQL = re.compile(r"^\s*\(?\s*(SELECT|WITH)\b", re.I)
+
+
+class QueryBudgetExceeded(Exception):
+    """Consulta estimada acima do orçamento de bytes da rota."""
+
+    def __init__(self, route, estimated, budget):
+        super().__init__(f"Consulta estimada em {estimated / MB:.0f} MB, acima do orçamento de {budget / MB:.0f} MB da rota {route}.")
+        self.route = route
+        self.estimated = estimated
+        self.budget = budget
+
+
+# ============================================================
+# GUARDA DE CUSTO — DRY RUN + ORÇAMENTO POR ROTA
+# ============================================================
+class QueryGuard:
+    """Limites de bytes/tempo por rota e checagem prévia de leituras.
+
+    limits() dá (maximum_bytes_billed, timeout) da rota atual e vale para
+    todo job (o BigQuery falha o job que passar do teto, em vez de cobrar).
+    check() estima leituras (SELECT/WITH) com um dry run na primeira vez
+    que vê cada fingerprint, guarda a estimativa por ESTIMATE_TTL_SEC e
+    levanta QueryBudgetExceeded quando ela passa do orçamento: o
+    BigQueryClient tenta o fallback da chamada (consulta mais barata) ou
+    devolve o erro para a rota, sem gastar um job que falharia ou sairia
+    caro. dry_run(sql, params) → bytes estimados; None desliga a estimativa
+    (motor local), mantendo só os limites.
+    """
+
+    def __init__(self, dry_run=None, default_bytes=MAX_BYTES_BILLED, route_bytes=ROUTE_MAX_BYTES, default_timeout=TIMEOUT_SEC, route_timeout=ROUTE_TIMEOUT_SEC, ttl=ESTIMATE_TTL_SEC, enabled=GUARD_ENABLED):
+        self._dry_run = dry_run
+        self.default_bytes = default_bytes
+        self.route_bytes = dict(route_bytes)
+        self.default_timeout = default_timeout
+        self.route_timeout = dict(route_timeout)
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._estimates = {}    # fingerprint → (bytes, time.monotonic())
+        self.dry_runs = 0
+        self.rejected = 0
+        self.downgraded = 0
+        self.last_error = None
+
+    def limits(self, route=None):
+        route = route or current_route.get()
+        return self.route_bytes.get(route, self.default_bytes), self.route_timeout.get(route, self.default_timeout)
+
+    def estimate(self, sql, params=None):
+        """Bytes estimados (dry run, em cache por fingerprint) ou None quando não dá para estimar."""
+        if self._dry_run is None:
+            return None
+        fp = fingerprint(sql)
+        with self._lock:
+            cached = self._estimates.get(fp)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        try:
+            estimated = int(self._dry_run(sql, params) or 0)
+        except Exception as exc:
+            # consulta inválida falha igual no job de verdade; aqui só não estima
+            self.last_error = str(exc)
+            return None
+        with self._lock:
+            self._estimates[fp] = (estimated, time.monotonic())
+            self.dry_runs += 1
+        return estimated
+
+    def check(self, sql, params=None):
+        """(maximum_bytes_billed, timeout) para o job, ou QueryBudgetExceeded para leitura acima do orçamento."""
+        route = current_route.get()
+        budget, timeout = self.limits(route)
+        if not self.enabled:
+            return None, timeout
+        if _READ_SQL.match(sql or ""):
+            estimated = self.estimate(sql, params)
+            if estimated is not None and estimated > budget:
+                raise QueryBudgetExceeded(route, estimated, budget)
+        return budget, timeout
+
+    def choose(self, sql, params=None, fallback=None):
+        """(sql, maximum_bytes_billed, timeout) do job: o próprio sql, o fallback ou QueryBudgetExceeded.
+
+        O fallback só é usado se o dry run dele funcionar e couber no orçamento.
+        """
+        try:
+            return (sql, *self.check(sql, params))
+        except QueryBudgetExceeded as exc:
+            if fallback is not None and self.estimate(fallback, params) is not None:
+                try:
+                    limites = self.check(fallback, params)
+                except QueryBudgetExceeded:
+                    pass
+                else:
+                    with self._lock:
+                        self.downgraded += 1
+                    print(f"[QueryGuard] Consulta trocada pelo fallback: {exc}")
+                    return (fallback, *limites)
+            with self._lock:
+                self.rejected += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            estimativas = len(self._estimates)
+        return {"ativo": self.enabled, "teto_padrao_mb": self.default_bytes // MB, "rotas_mb": {r: b // MB for r, b in self.route_bytes.items()},
+                "estimativas": estimativas, "dry_runs": self.dry_runs, "rejeitadas": self.rejected, "rebaixadas": self.downgraded, "last_error": self.last_error}
@@ -0,0 +1,259 @@
+# utils/query_metrics.py
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from utils.query_cache import normalize_sql
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+# consulta acima disso (ms) sai no log com o SQL; 0 = slow log desligado
+SLOW_QUERY_MS = _env_int("BQ_SLOW_QUERY_MS", 0)
+# fração das consultas registrada no log (registro JSON de uma linha, sem o SQL)
+LOG_SAMPLE = _env_float("BQ_LOG_SAMPLE", 0.01)
+# teto de fingerprints distintos nas métricas; acima disso caem em "outros"
+MAX_FINGERPRINTS = _env_int("BQ_METRICS_MAX_FINGERPRINTS", 500)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(float(10 ** n) for n in range(6, 13))  # 1 MB … 1 TB
+
+# rota da requisição atual ("background" fora de request: threads de refresh, fila de eventos)
+current_route = ContextVar("bq_route", default="background")
+
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\b\d+(?:\.\d+)?\b")
+
+
+def fingerprint(sql):
+    """Hash curto do SQL sem literais: a mesma consulta com outros valores cai na mesma série."""
+    return hashlib.sha1(_LITERALS.sub("?", normalize_sql(sql)).encode("utf-8")).hexdigest()[:12]
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        acumulado = 0
+        for le, n in zip(self.buckets, self.counts):
+            acumulado += n
+            yield f"{name}_bucket{_labels(labels, le=_num(le))} {acumulado}"
+        yield f"{name}_bucket{_labels(labels, le='+Inf')} {self.count}"
+        yield f"{name}_sum{_labels(labels)} {_num(self.sum)}"
+        yield f"{name}_count{_labels(labels)} {self.count}"
+
+
+def _num(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+class _QuerySeries:
+    __slots__ = ("wall", "queue", "bytes", "billed", "slot_ms", "rows", "errors")
+
+    def __init__(self):
+        self.wall = _Histogram(DURATION_BUCKETS)
+        self.queue = _Histogram(DURATION_BUCKETS)
+        self.bytes = _Histogram(BYTES_BUCKETS)
+        self.billed = 0
+        self.slot_ms = 0
+        self.rows = 0
+        self.errors = 0
+
+
+# ============================================================
+# MÉTRICAS POR ROTA E POR FINGERPRINT DE CONSULTA
+# ============================================================
+class QueryMetrics:
+    """Histogramas/contadores em memória (por processo) no formato do Prometheus.
+
+    record() é chamado pelo BigQueryClient ao fim de cada consulta com o
+    tempo de parede (query + leitura do resultado) e o job do BigQuery, de
+    onde saem fila (created → started), bytes processados/cobrados,
+    slot-ms e cache do BigQuery. Séries por (rota, fingerprint, tipo,
+    origem); origem diz quem respondeu: bigquery, bigquery_cache, cache
+    (cache de resultados do processo), replica ou local. Em vez do SQL
+    inteiro a cada chamada, o log recebe uma amostra (LOG_SAMPLE) de
+    registros JSON de uma linha, as falhas e, com BQ_SLOW_QUERY_MS, as
+    consultas lentas com o SQL normalizado.
+    """
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, sample=LOG_SAMPLE, max_fingerprints=MAX_FINGERPRINTS):
+        self.slow_ms = slow_ms
+        self.sample = sample
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._queries = {}      # (rota, fingerprint, tipo, origem) → _QuerySeries
+        self._requests = {}     # (rota, método, status) → _Histogram
+        self._sql = {}          # fingerprint → início do SQL normalizado (diagnóstico)
+
+    def record(self, sql, kind, origem, wall_s, job=None, rows=None, error=None):
+        route = current_route.get()
+        fp = fingerprint(sql)
+        queue_s = bytes_processed = bytes_billed = slot_ms = None
+        if job is not None:
+            created, started = getattr(job, "created", None), getattr(job, "started", None)
+            if created is not None and started is not None:
+                queue_s = max((started - created).total_seconds(), 0.0)
+            bytes_processed = getattr(job, "total_bytes_processed", None)
+            bytes_billed = getattr(job, "total_bytes_billed", None)
+            slot_ms = getattr(job, "slot_millis", None)
+            if origem == "bigquery" and getattr(job, "cache_hit", False):
+                origem = "bigquery_cache"
+
+        with self._lock:
+            if fp not in self._sql:
+                if len(self._sql) >= self.max_fingerprints:
+                    fp = "outros"
+                self._sql.setdefault(fp, normalize_sql(sql)[:300])
+            series = self._queries.get((route, fp, kind, origem))
+            if series is None:
+                series = self._queries[(route, fp, kind, origem)] = _QuerySeries()
+            series.wall.observe(wall_s)
+            if queue_s is not None:
+                series.queue.observe(queue_s)
+            if bytes_processed is not None:
+                series.bytes.observe(float(bytes_processed))
+            series.billed += int(bytes_billed or 0)
+            series.slot_ms += int(slot_ms or 0)
+            series.rows += int(rows or 0)
+            if error is not None:
+                series.errors += 1
+
+        wall_ms = round(wall_s * 1000, 1)
+        slow = bool(self.slow_ms) and wall_ms >= self.slow_ms
+        if error is None and not slow and random.random() >= self.sample:
+            return
+        registro = {
+            "severity": "ERROR" if error is not None else ("WARNING" if slow else "INFO"),
+            "evento": "bq_query_lenta" if slow else "bq_query",
+            "rota": route, "fingerprint": fp, "tipo": kind, "origem": origem,
+            "tempo_ms": wall_ms, "fila_ms": None if queue_s is None else round(queue_s * 1000, 1),
+            "bytes_processados": bytes_processed, "bytes_cobrados": bytes_billed, "slot_ms": slot_ms, "linhas": rows,
+        }
+        if error is not None:
+            registro["erro"] = str(error)[:500]
+        if slow or error is not None:
+            registro["sql"] = normalize_sql(sql)[:4000]
+        print(json.dumps(registro, ensure_ascii=False, default=str))
+
+    def record_request(self, route, method, status, wall_s):
+        with self._lock:
+            hist = self._requests.get((route, method, status))
+            if hist is None:
+                hist = self._requests[(route, method, status)] = _Histogram(DURATION_BUCKETS)
+            hist.observe(wall_s)
+
+    # --------------------------------------------------------
+    # EXPOSIÇÃO
+    # --------------------------------------------------------
+    def render(self, extra=None):
+        """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4).
+
+        extra: {nome: (tipo, ajuda, valor)} de métricas sem rótulo de fora daqui
+        (cache de resultados, fila de eventos).
+        """
+        with self._lock:
+            queries = sorted(self._queries.items())
+            requests = sorted(self._requests.items())
+            out = []
+
+            def header(name, kind, help_text):
+                out.append(f"# HELP {name} {help_text}")
+                out.append(f"# TYPE {name} {kind}")
+
+            def labels(key):
+                return dict(zip(("route", "fingerprint", "kind", "origem"), key))
+
+            header("painel_http_request_duration_seconds", "histogram", "Tempo das requisições por rota.")
+            for (route, method, status), hist in requests:
+                out.extend(hist.lines("painel_http_request_duration_seconds", {"route": route, "method": method, "status": status}))
+            header("painel_bq_query_duration_seconds", "histogram", "Tempo de parede das consultas (query + leitura do resultado).")
+            for key, s in queries:
+                out.extend(s.wall.lines("painel_bq_query_duration_seconds", labels(key)))
+            header("painel_bq_query_queue_seconds", "histogram", "Espera do job na fila do BigQuery (created → started).")
+            for key, s in queries:
+                if s.queue.count:
+                    out.extend(s.queue.lines("painel_bq_query_queue_seconds", labels(key)))
+            header("painel_bq_bytes_processed", "histogram", "Bytes processados por consulta.")
+            for key, s in queries:
+                if s.bytes.count:
+                    out.extend(s.bytes.lines("painel_bq_bytes_processed", labels(key)))
+            for name, attr, help_text in (
+                ("painel_bq_bytes_billed_total", "billed", "Bytes cobrados."),
+                ("painel_bq_slot_ms_total", "slot_ms", "Slot-milissegundos consumidos."),
+                ("painel_bq_rows_total", "rows", "Linhas devolvidas."),
+                ("painel_bq_query_errors_total", "errors", "Consultas que falharam."),
+            ):
+                header(name, "counter", help_text)
+                for key, s in queries:
+                    out.append(f"{name}{_labels(labels(key))} {getattr(s, attr)}")
+        for name, (kind, help_text, value) in (extra or {}).items():
+            header(name, kind, help_text)
+            out.append(f"{name} {_num(value)}")
+        return "\n".join(out) + "\n"
+
+    def top(self, n=10):
+        """Fingerprints que mais somam tempo (para o diagnóstico)."""
+        por_fp = {}
+        with self._lock:
+            for (route, fp, _kind, _origem), s in self._queries.items():
+                item = por_fp.setdefault(fp, {"fingerprint": fp, "sql": self._sql.get(fp, ""), "rotas": set(), "consultas": 0, "tempo_total_ms": 0.0})
+                item["rotas"].add(route)
+                item["consultas"] += s.wall.count
+                item["tempo_total_ms"] += s.wall.sum * 1000
+        ordenados = sorted(por_fp.values(), key=lambda i: i["tempo_total_ms"], reverse=True)[:n]
+        return [{**i, "rotas": sorted(i["rotas"]), "tempo_total_ms": round(i["tempo_total_ms"], 1)} for i in ordenados]
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_query_metrics():
+    """Métricas únicas do processo (BigQueryClient, hooks do app e /admin/metrics)."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = QueryMetrics()
+    return _metrics
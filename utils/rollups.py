@@ -0,0 +1,124 @@
+# utils/rollups.py
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+from pathlib import Path
+
+from utils.bigquery_client import get_bq
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1").lower() in ("1", "true", "sim")
+# intervalo entre refreshes disparados pelo próprio app; 0 = só por POST /admin/rollups/refresh
+REFRESH_SEC = _env_int("ROLLUP_REFRESH_SEC", 300)
+# agregado atualizado há mais que isso é ignorado e o dashboard volta às consultas diretas
+MAX_STALENESS_SEC = _env_int("ROLLUP_MAX_STALENESS_SEC", 3600)
+
+SQL_DIR = Path(__file__).resolve().parent.parent / "sql" / "rollups"
+SCRIPTS = ("refresh_chips.sql", "refresh_eventos.sql")
+TABLES = ("agg_chip_estado", "agg_chip_atual", "agg_chip_dia", "agg_evento_dia", "agg_ranking_disparos", "agg_watermark")
+
+
+def carregar_sql(nome, project, dataset):
+    """Script de sql/rollups com o projeto/dataset configurados no lugar de painel-universidade.marts."""
+    sql = (SQL_DIR / nome).read_text(encoding="utf-8")
+    return sql.replace("`painel-universidade.marts.", f"`{project}.{dataset}.")
+
+
+# ============================================================
+# AGREGADOS DO DASHBOARD (REFRESH INCREMENTAL)
+# ============================================================
+class RollupRefresher:
+    """Mantém as tabelas agg_* (sql/rollups) que o dashboard lê.
+
+    refresh() cria as tabelas se faltarem e roda os scripts de SCRIPTS,
+    cada um incremental pelo próprio watermark em agg_watermark
+    (dim_chip.updated_at e f_chip_evento.created_at) e dentro de uma
+    transação. Contam todos os chips, ativos e inativos (os ativos ficam
+    na coluna ativos), como a consulta direta. ensure_fresh() é chamado pelo dashboard: passado
+    refresh_sec desde o último refresh, dispara outro em segundo plano
+    (a página não espera). Com vários workers cada um faz o seu; um
+    refresh que conflita com o de outro worker só falha e fica para a
+    próxima vez.
+    """
+
+    def __init__(self, bq, refresh_sec=REFRESH_SEC, enabled=ROLLUPS_ENABLED):
+        self._bq = bq
+        self.refresh_sec = refresh_sec
+        self.enabled = enabled
+        self._refresh_lock = threading.Lock()
+        self._created = False
+        self._refreshed_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self.last_ms = None
+        self.last_error = None
+
+    def table(self, nome):
+        return f"`{self._bq.project}.{self._bq.dataset}.{nome}`"
+
+    def _script(self, nome):
+        return carregar_sql(nome, self._bq.project, self._bq.dataset)
+
+    def refresh(self):
+        """Roda os scripts de refresh (cria as tabelas na primeira vez); devolve o tempo em ms."""
+        with self._refresh_lock:
+            started = time.perf_counter()
+            try:
+                if not self._created:
+                    self._bq.run(self._script("create_rollups.sql"), writes=TABLES)
+                    self._created = True
+                for nome in SCRIPTS:
+                    self._bq.run(self._script(nome), writes=TABLES)
+            except Exception as exc:
+                self.failures += 1
+                self.last_error = str(exc)
+                raise
+            finally:
+                self._refreshed_at = time.monotonic()
+            self.refreshes += 1
+            self.last_ms = int((time.perf_counter() - started) * 1000)
+            self.last_error = None
+            print(f"[Rollups] Agregados atualizados tempo_ms={self.last_ms}")
+            return self.last_ms
+
+    def ensure_fresh(self):
+        if not self.enabled or self.refresh_sec <= 0:
+            return
+        if time.monotonic() - self._refreshed_at < self.refresh_sec or self._refresh_lock.locked():
+            return
+        self._refreshed_at = time.monotonic()
+        threading.Thread(target=self._refresh_quietly, name="rollups-refresh", daemon=True).start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as exc:
+            print(f"[Rollups] Aviso: refresh falhou: {exc}")
+
+    def stats(self):
+        idade = int(time.monotonic() - self._refreshed_at) if self._refreshed_at else None
+        return {"ativo": self.enabled, "refresh_sec": self.refresh_sec, "refreshes": self.refreshes, "falhas": self.failures,
+                "ultimo_ms": self.last_ms, "idade_s": idade, "last_error": self.last_error}
+
+
+_rollups = None
+_rollups_lock = threading.Lock()
+
+
+def get_rollups():
+    """Refresher único do processo (dashboard, /admin/rollups/refresh e benchmark)."""
+    global _rollups
+    if _rollups is None:
+        with _rollups_lock:
+            if _rollups is None:
+                _rollups = RollupRefresher(get_bq())
+    return _rollups
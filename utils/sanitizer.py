@@ -1,20 +1,97 @@
 # utils/sanitizer.py
+from datetime import date, datetime
+
+import numpy as np
 import pandas as pd
 
-def sanitize_df(df):
+# Plano de conversão por schema: (colunas + dtypes, opções) → [(coluna, ação)]
+_PLANS = {}
+_PLANS_MAX = 256
+
+
+def format_value(value, null=""):
+    """Um valor no formato do sanitize_df: nulo → `null`, DATE/TIMESTAMP → YYYY-MM-DD."""
+    if value is None:
+        return null
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _plan(df, format_dates):
+    key = (tuple(zip(df.columns, map(str, df.dtypes))), format_dates)
+    plan = _PLANS.get(key)
+    if plan is None:
+        plan = []
+        for col, dtype in zip(df.columns, df.dtypes):
+            if format_dates and pd.api.types.is_datetime64_any_dtype(dtype):
+                plan.append((col, "date"))
+            elif dtype == object:
+                plan.append((col, "object"))
+            else:
+                plan.append((col, "cast"))
+        if len(_PLANS) >= _PLANS_MAX:
+            _PLANS.clear()
+        _PLANS[key] = plan
+    return plan
+
+
+def _format_dates(serie, fill):
+    # datetime_as_string é vetorizado (strftime roda linha a linha)
+    if getattr(serie.dt, "tz", None) is not None:
+        serie = serie.dt.tz_localize(None)
+    values = np.datetime_as_string(serie.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")).astype(object)
+    values[serie.isna().to_numpy()] = fill
+    return values
+
+
+def _convert(serie, action, fill):
+    """Array object já normalizado, ou None quando a coluna não precisa mudar."""
+    if action == "date":
+        return _format_dates(serie, fill)
+    mask = serie.isna().to_numpy()
+    if action == "object" and not mask.any():
+        return None
+    values = serie.to_numpy(dtype=object, copy=True)
+    values[mask] = fill
+    return values
+
+
+def normalize_nulls(df, fill="", format_dates=True, inplace=False):
+    """Converte nulos (NaN/NaT/None/pd.NA) em `fill` seguindo um plano por schema.
+
+    O plano (que colunas formatar como data, quais converter para object e
+    quais já são object) é calculado uma vez por combinação de colunas e
+    dtypes. Cada coluna é convertida com operações vetorizadas; colunas
+    object sem nulos não são tocadas. format_dates=True formata colunas
+    datetime64 como YYYY-MM-DD. inplace=True altera o próprio df, sem
+    cópia defensiva: use só em DataFrames recém-criados, nunca em
+    resultados vindos do cache.
+    """
     if df is None or df.empty:
         return df
 
-    df = df.copy()
+    plan = _plan(df, format_dates)
 
-    for col in df.columns:
+    if inplace:
+        for col, action in plan:
+            values = _convert(df[col], action, fill)
+            if values is not None:
+                # Series object explícita: atribuir o array cru deixa o pandas re-inferir datetime64
+                df[col] = pd.Series(values, index=df.index, dtype=object)
+        return df
 
-        # Mantém datas do BigQuery corretamente
-        if pd.api.types.is_datetime64_any_dtype(df[col]):
-            df[col] = df[col].dt.strftime("%Y-%m-%d")
-            continue
+    data = {}
+    for col, action in plan:
+        values = _convert(df[col], action, fill)
+        if values is None:
+            values = df[col].to_numpy(dtype=object, copy=True)
+        data[col] = pd.Series(values, index=df.index, dtype=object)
+    return pd.DataFrame(data, index=df.index, columns=df.columns, copy=False)
 
-        # Mantém valores como estão, convertendo apenas NaN → ""
-        df[col] = df[col].astype(object).where(pd.notnull(df[col]), "")
 
-    return df
+def sanitize_df(df, inplace=False):
+    # Mantém datas do BigQuery como YYYY-MM-DD e converte NaN → ""
+    return normalize_nulls(df, fill="", format_dates=True, inplace=inplace)
@@ -0,0 +1,174 @@
+# utils/slot_map.py
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+
+from utils.bigquery_client import get_bq
+
+REFRESH_SEC = int(os.getenv("SLOT_MAP_REFRESH_SEC", "300"))
+
+
+def _capacidade_total(cap):
+    """Slots do aparelho, ou None quando alguma capacidade é desconhecida."""
+    return None if None in cap else cap[0] + cap[1]
+
+
+# ============================================================
+# MAPA RESIDENTE DE OCUPAÇÃO (APARELHO × SLOT)
+# ============================================================
+class SlotOccupancyMap:
+    """Ocupação dos slots de WhatsApp por aparelho, em memória (por worker).
+
+    Guarda as capacidades (business/normal) de cada aparelho e o chip que
+    ocupa cada slot. As rotas consultam o mapa antes de gastar um job
+    (is_free / next_free) e o atualizam depois das próprias escritas
+    (occupy / release); a cada refresh_sec um reconcile em segundo plano
+    recarrega tudo da base para absorver escritas de fora do painel.
+    O BigQuery continua sendo a checagem final: o mapa só evita jobs
+    fadados a falhar. O loader devolve dicts com sk_aparelho, cap_bus,
+    cap_norm (None quando a base não sabe) e ocupados = [{slot, sk_chip}].
+    """
+
+    def __init__(self, loader, refresh_sec=REFRESH_SEC):
+        self._loader = loader
+        self.refresh_sec = refresh_sec
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._capacidade = {}   # sk_aparelho → (cap_bus, cap_norm), None = desconhecida
+        self._slots = {}        # (sk_aparelho, slot) → sk_chip
+        self._chips = {}        # sk_chip → (sk_aparelho, slot)
+        self._refreshed_at = 0.0
+        self._built = False
+
+    # --------------------------------------------------------
+    # CARGA / RECONCILE
+    # --------------------------------------------------------
+    def reconcile(self):
+        """Recarrega capacidades e ocupação da base (substitui o estado inteiro)."""
+        with self._refresh_lock:
+            capacidade, slots, chips = {}, {}, {}
+            for row in self._loader():
+                ap = int(row["sk_aparelho"])
+                capacidade[ap] = tuple(None if row.get(k) is None else int(row[k]) for k in ("cap_bus", "cap_norm"))
+                for item in row.get("ocupados") or []:
+                    slots[(ap, int(item["slot"]))] = int(item["sk_chip"])
+                    chips[int(item["sk_chip"])] = (ap, int(item["slot"]))
+            with self._lock:
+                self._capacidade, self._slots, self._chips = capacidade, slots, chips
+            self._refreshed_at = time.monotonic()
+            self._built = True
+
+    def _ensure_fresh(self):
+        if not self._built:
+            try:
+                self.reconcile()
+            except Exception as exc:
+                # mapa vazio não recusa nada; nova tentativa só no próximo reconcile
+                print(f"[SlotMap] Aviso: carga inicial falhou: {exc}")
+                self._refreshed_at = time.monotonic()
+                self._built = True
+            return
+        if time.monotonic() - self._refreshed_at < self.refresh_sec or self._refresh_lock.locked():
+            return
+        self._refreshed_at = time.monotonic()
+        threading.Thread(target=self._reconcile_quietly, daemon=True).start()
+
+    def _reconcile_quietly(self):
+        try:
+            self.reconcile()
+        except Exception as exc:
+            print(f"[SlotMap] Aviso: reconcile falhou: {exc}")
+
+    # --------------------------------------------------------
+    # CONSULTAS
+    # --------------------------------------------------------
+    def check(self, sk_aparelho, slot, sk_chip=None):
+        """Motivo para recusar (sk_aparelho, slot) → ("slot_taken", dono) / ("invalid_slot", None), ou None.
+
+        Aparelho desconhecido (mapa vazio ou desatualizado) não recusa nada:
+        a decisão fica para o BigQuery. Capacidade NULL ou zerada também não
+        recusa o slot como inválido: quem decide é o SP, como antes do mapa.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            cap = self._capacidade.get(sk_aparelho)
+            if cap is None:
+                return None
+            total = _capacidade_total(cap)
+            if total and not 1 <= slot <= total:
+                return ("invalid_slot", None)
+            dono = self._slots.get((sk_aparelho, slot))
+            if dono is not None and dono != sk_chip:
+                return ("slot_taken", dono)
+            return None
+
+    def is_free(self, sk_aparelho, slot, sk_chip=None):
+        return self.check(sk_aparelho, slot, sk_chip) is None
+
+    def next_free(self, sk_aparelho, tipo=None):
+        """Primeiro slot livre do aparelho (opcionalmente só BUSINESS ou NORMAL)."""
+        self._ensure_fresh()
+        tipo = (tipo or "").upper() or None
+        with self._lock:
+            cap = self._capacidade.get(sk_aparelho)
+            if cap is None or not _capacidade_total(cap):
+                return None
+            cap_bus, cap_norm = cap
+            faixa = {"BUSINESS": range(1, cap_bus + 1), "NORMAL": range(cap_bus + 1, cap_bus + cap_norm + 1)}.get(tipo, range(1, cap_bus + cap_norm + 1))
+            return next((slot for slot in faixa if (sk_aparelho, slot) not in self._slots), None)
+
+    # --------------------------------------------------------
+    # ESCRITAS DO PAINEL
+    # --------------------------------------------------------
+    def occupy(self, sk_aparelho, slot, sk_chip):
+        with self._lock:
+            self._release(sk_chip)
+            self._slots[(sk_aparelho, slot)] = sk_chip
+            self._chips[sk_chip] = (sk_aparelho, slot)
+
+    def release(self, sk_chip):
+        with self._lock:
+            self._release(sk_chip)
+
+    def _release(self, sk_chip):
+        atual = self._chips.pop(sk_chip, None)
+        if atual is not None and self._slots.get(atual) == sk_chip:
+            del self._slots[atual]
+
+    def stats(self):
+        with self._lock:
+            return {"aparelhos": len(self._capacidade), "slots_ocupados": len(self._slots), "idade_sec": int(time.monotonic() - self._refreshed_at) if self._built else None}
+
+
+def _carregar_ocupacao():
+    bq = get_bq()
+    return bq.run_rows(f"""
+        SELECT
+            a.sk_aparelho,
+            ANY_VALUE(a.cap_whats_business) AS cap_bus,
+            ANY_VALUE(a.cap_whats_normal) AS cap_norm,
+            ARRAY_AGG(IF(c.sk_chip IS NULL, NULL, STRUCT(c.slot_whatsapp AS slot, c.sk_chip AS sk_chip)) IGNORE NULLS) AS ocupados
+        FROM `{bq.project}.{bq.dataset}.dim_aparelho` a
+        LEFT JOIN `{bq.project}.{bq.dataset}.dim_chip` c
+          ON c.sk_aparelho_atual = a.sk_aparelho
+         AND c.slot_whatsapp IS NOT NULL
+         AND COALESCE(c.ativo, TRUE) = TRUE
+        WHERE a.sk_aparelho IS NOT NULL
+        GROUP BY a.sk_aparelho
+    """, null=None)
+
+
+_slot_map = None
+_slot_map_lock = threading.Lock()
+
+
+def get_slot_map():
+    """Mapa de ocupação único do processo (compartilhado por chips e relacionamentos)."""
+    global _slot_map
+    if _slot_map is None:
+        with _slot_map_lock:
+            if _slot_map is None:
+                _slot_map = SlotOccupancyMap(_carregar_ocupacao)
+    return _slot_map
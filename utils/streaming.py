@@ -0,0 +1,59 @@
+# utils/streaming.py
+# -*- coding: utf-8 -*-
+
+import json
+from decimal import Decimal
+
+from flask import Response, stream_with_context
+
+from utils.sanitizer import format_value
+
+# Quantas linhas juntar antes de mandar um pedaço para o socket
+CHUNK_ROWS = 500
+
+
+def _json_value(value):
+    # mesmas regras do sanitize_df: nulo → "", datas → YYYY-MM-DD
+    if isinstance(value, Decimal):
+        return float(value)
+    return format_value(value)
+
+
+def _dump(row):
+    return json.dumps({k: _json_value(v) for k, v in row.items()}, ensure_ascii=False, default=str)
+
+
+def _json_array(rows):
+    yield "["
+    buffer, first = [], True
+    for row in rows:
+        buffer.append(("" if first else ",") + _dump(row))
+        first = False
+        if len(buffer) >= CHUNK_ROWS:
+            yield "".join(buffer)
+            buffer = []
+    if buffer:
+        yield "".join(buffer)
+    yield "]"
+
+
+def _ndjson(rows):
+    buffer = []
+    for row in rows:
+        buffer.append(_dump(row) + "\n")
+        if len(buffer) >= CHUNK_ROWS:
+            yield "".join(buffer)
+            buffer = []
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_rows(rows, fmt="json"):
+    """Resposta HTTP em streaming a partir de um iterável de dicts.
+
+    fmt="json" → array JSON enviado em pedaços (compatível com response.json());
+    fmt="ndjson" → um objeto JSON por linha.
+    """
+    if fmt == "ndjson":
+        return Response(stream_with_context(_ndjson(rows)), mimetype="application/x-ndjson")
+    return Response(stream_with_context(_json_array(rows)), mimetype="application/json")